@@ -0,0 +1,52 @@
+from functools import cached_property
+from .models import Member
+from .cache import membershipCache
+
+
+# holds the authorization-related information about the user making a request,
+# which is loaded lazily, at most once per request, and shared by every
+# permission class and serializer involved in handling said request
+class AuthorizationContext:
+    def __init__(self, user):
+        self.user = user
+        # the member's primary key is the id of their base user
+        self.userId = user.id if user and user.is_authenticated else None
+
+    @cached_property
+    def member(self):
+        if self.userId is None:
+            return None
+
+        return Member.objects.get(pk=self.userId)
+
+    # maps the id of every group the user belongs to onto whether the
+    # user is an admin of said group; read from the cross-request cache
+    @cached_property
+    def memberships(self):
+        if self.userId is None:
+            return {}
+
+        return membershipCache.get(self.userId)
+
+    def isUser(self, userId):
+        return self.userId is not None and self.userId == userId
+
+    def isInGroup(self, groupId):
+        return groupId in self.memberships
+
+    def isAdminOfGroup(self, groupId):
+        return self.memberships.get(groupId, False)
+
+
+# the context is stored on the underlying django request, so that
+# the same instance is reused regardless of which request wrapper
+# (django or rest framework) it is accessed through
+def getAuthorizationContext(request):
+    baseRequest = getattr(request, '_request', request)
+    context = getattr(baseRequest, 'authorizationContext', None)
+
+    if context is None or context.user is not request.user:
+        context = AuthorizationContext(request.user)
+        baseRequest.authorizationContext = context
+
+    return context
@@ -0,0 +1,231 @@
+from collections import OrderedDict
+from threading import Lock
+from time import monotonic
+from django.conf import settings
+from django.core.cache import caches
+from .models import BelongsTo
+
+
+# caches the group memberships (group id -> isAdmin) of every member across
+# requests, since they are read on almost every request, but rarely change;
+# the entries are kept in a bounded, per-process LRU or, when a cache alias
+# is configured through the MEMBERSHIP_CACHE_ALIAS setting, in the shared
+# cache backend, so that every worker process sees the same invalidations;
+# in both cases, the receivers in 'signals.py' invalidate the entries of
+# the members affected by any change to the BelongsTo model (including the
+# cascading deletions of groups)
+class MembershipCache:
+    keyPrefix = 'sparrow:memberships:'
+
+    def __init__(self, maxSize=None, timeout=None, alias=None):
+        self.maxSize = maxSize if maxSize is not None else getattr(settings, 'MEMBERSHIP_CACHE_SIZE', 10000)
+        self.timeout = timeout if timeout is not None else getattr(settings, 'MEMBERSHIP_CACHE_TIMEOUT', 300)
+        self.alias = alias if alias is not None else getattr(settings, 'MEMBERSHIP_CACHE_ALIAS', None)
+
+        self.entries = OrderedDict()
+        self.lock = Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    @property
+    def backend(self):
+        return caches[self.alias] if self.alias else None
+
+    def get(self, userId):
+        memberships = self.lookup(userId)
+
+        if memberships is None:
+            with self.lock:
+                self.misses += 1
+
+            memberships = dict(BelongsTo.objects.filter(user_id=userId).values_list('group_id', 'isAdmin'))
+            self.store(userId, memberships)
+        else:
+            with self.lock:
+                self.hits += 1
+
+        # a copy is returned, so that callers cannot alter the cached entry
+        return dict(memberships)
+
+    def lookup(self, userId):
+        if self.backend is not None:
+            return self.backend.get(self.keyPrefix + str(userId))
+
+        with self.lock:
+            entry = self.entries.get(userId)
+
+            if entry is None:
+                return None
+
+            memberships, expiresAt = entry
+
+            if expiresAt < monotonic():
+                del self.entries[userId]
+                return None
+
+            # marking the entry as the most recently used one
+            self.entries.move_to_end(userId)
+            return memberships
+
+    def store(self, userId, memberships):
+        if self.backend is not None:
+            self.backend.set(self.keyPrefix + str(userId), memberships, self.timeout)
+            return
+
+        if self.maxSize <= 0:
+            return
+
+        with self.lock:
+            self.entries[userId] = (memberships, monotonic() + self.timeout)
+            self.entries.move_to_end(userId)
+
+            # evicting the least recently used entries
+            while len(self.entries) > self.maxSize:
+                self.entries.popitem(last=False)
+
+    def invalidateUser(self, userId):
+        with self.lock:
+            self.invalidations += 1
+            self.entries.pop(userId, None)
+
+        if self.backend is not None:
+            self.backend.delete(self.keyPrefix + str(userId))
+
+    # only the per-process entries are dropped, since the shared
+    # backend may hold entries unrelated to the group memberships
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        with self.lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'invalidations': self.invalidations,
+                'size': len(self.entries),
+                'maxSize': self.maxSize,
+                'backend': self.alias or 'local',
+            }
+
+
+membershipCache = MembershipCache()
+
+
+# caches the reference data (Status, Tag & RatingFlagType), which is seeded once, after migrating,
+# and seldom changes afterwards, yet is read by the list endpoints of said models, as well as by
+# every notebook, rating and tag written; every worker process keeps its own copy of each table,
+# loaded on first use, along with the responses rendered from it, and drops it whenever the
+# receivers in 'signals.py' report a change; each table is versioned, so that, when a cache alias
+# is configured through the REFERENCE_DATA_CACHE_ALIAS setting, every change bumps the version held
+# by the shared backend and the other processes reload the table as soon as they read it again,
+# whereas, without a shared backend, their copies expire after REFERENCE_DATA_CACHE_TIMEOUT seconds
+class ReferenceDataCache:
+    keyPrefix = 'sparrow:referenceData:'
+    # the rendered responses kept per table version, by URL and format
+    maxRenderings = 32
+
+    def __init__(self, timeout=None, alias=None):
+        self.timeout = timeout if timeout is not None else getattr(settings, 'REFERENCE_DATA_CACHE_TIMEOUT', 300)
+        self.alias = alias if alias is not None else getattr(settings, 'REFERENCE_DATA_CACHE_ALIAS', None)
+
+        self.tables = {}
+        self.lock = Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    @property
+    def backend(self):
+        return caches[self.alias] if self.alias else None
+
+    def versionKey(self, model):
+        return self.keyPrefix + model._meta.label_lower
+
+    def sharedVersion(self, model):
+        if self.backend is None:
+            return None
+
+        return self.backend.get_or_set(self.versionKey(model), 0, None)
+
+    # the cached table of the model: its instances, in order and by primary key,
+    # along with the responses rendered from them
+    def table(self, model):
+        version = self.sharedVersion(model)
+
+        with self.lock:
+            table = self.tables.get(model)
+
+            if table is not None and table['version'] == version and table['expiresAt'] >= monotonic():
+                self.hits += 1
+                return table
+
+            self.misses += 1
+
+        instances = list(model.objects.order_by(*(model._meta.ordering or ['pk'])))
+        table = {
+            'version': version,
+            'expiresAt': monotonic() + self.timeout,
+            'instances': instances,
+            'byPk': {instance.pk: instance for instance in instances},
+            'renderings': {},
+        }
+
+        with self.lock:
+            self.tables[model] = table
+
+        return table
+
+    # the instances are shared by every request, and must therefore not be modified
+    def all(self, model):
+        return self.table(model)['instances']
+
+    def get(self, model, pk):
+        try:
+            return self.table(model)['byPk'].get(int(pk))
+        except (TypeError, ValueError):
+            return None
+
+    # the response rendered by 'render' for the given key, which is only
+    # rendered once for every version of the table
+    def rendered(self, model, key, render):
+        renderings = self.table(model)['renderings']
+        content = renderings.get(key)
+
+        if content is None:
+            content = render()
+
+            with self.lock:
+                if len(renderings) < self.maxRenderings:
+                    renderings[key] = content
+
+        return content
+
+    def invalidate(self, model):
+        with self.lock:
+            self.invalidations += 1
+            self.tables.pop(model, None)
+
+        if self.backend is not None:
+            try:
+                self.backend.incr(self.versionKey(model))
+            except ValueError:
+                self.backend.set(self.versionKey(model), 1, None)
+
+    def clear(self):
+        with self.lock:
+            self.tables.clear()
+
+    def stats(self):
+        with self.lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'invalidations': self.invalidations,
+                'tables': {model._meta.object_name: len(table['instances']) for model, table in self.tables.items()},
+                'backend': self.alias or 'local',
+            }
+
+
+referenceDataCache = ReferenceDataCache()
@@ -0,0 +1,93 @@
+from django_filters import FilterSet, NumberFilter
+from rest_framework.exceptions import ValidationError
+from rest_framework.filters import BaseFilterBackend, SearchFilter
+from .geo import boundingBoxCondition, circleBoundingBox, distanceExpression
+from .models import Route
+from .search import indexedModels, search, tokenize
+
+
+# answers the 'search' parameter of the SearchFilter through the inverted index
+# of the searchable models, instead of a LIKE '%term%' scan over every row;
+# every term is matched as a prefix and the results are sorted by their rank; a text
+# without any term (too short or only punctuation) leaves the queryset as it is
+class IndexedSearchFilter(SearchFilter):
+    def filter_queryset(self, request, queryset, view):
+        text = request.query_params.get(self.search_param, '')
+
+        if queryset.model not in indexedModels:
+            return super().filter_queryset(request, queryset, view)
+
+        if not tokenize(text):
+            return queryset
+
+        return search(queryset, text).order_by('-rank')
+
+
+# spatial filtering for list actions, based on the fields named by the view's
+# 'proximityFields' attribute (latitude, longitude and geohash, in this order):
+#   - 'bbox=minLat,minLon,maxLat,maxLon' keeps the rows within the box (minLon may
+#     be greater than maxLon, for boxes crossing the antimeridian);
+#   - 'near=lat,lon&radius=km' keeps the rows within the circle, annotated with
+#     their 'distance' (in km) from its center and sorted by it
+class ProximityFilter(BaseFilterBackend):
+    maxRadius = 1000
+
+    def filter_queryset(self, request, queryset, view):
+        latField, lonField, geohashField = view.proximityFields
+        bbox = request.query_params.get('bbox')
+        near = request.query_params.get('near')
+
+        if bbox is not None:
+            minLat, minLon, maxLat, maxLon = self.parseCoordinates('bbox', bbox, 4)
+
+            if minLat > maxLat:
+                raise ValidationError({'bbox': 'The minimum latitude must not exceed the maximum one.'})
+
+            queryset = queryset.filter(boundingBoxCondition(minLat, minLon, maxLat, maxLon, latField, lonField, geohashField))
+
+        if near is not None:
+            latitude, longitude = self.parseCoordinates('near', near, 2)
+
+            try:
+                radius = float(request.query_params['radius'])
+            except (KeyError, ValueError):
+                raise ValidationError({'radius': 'A radius (in km) is required along with "near".'})
+
+            if not 0 < radius <= self.maxRadius:
+                raise ValidationError({'radius': f'The radius must be positive and at most {self.maxRadius} km.'})
+
+            # the bounding box of the circle narrows the candidates down
+            # through the geohash index, before computing any distance
+            queryset = queryset.filter(boundingBoxCondition(*circleBoundingBox(latitude, longitude, radius), latField, lonField, geohashField))
+            queryset = queryset.annotate(distance=distanceExpression(latitude, longitude, latField, lonField))
+            queryset = queryset.filter(distance__lte=radius).order_by('distance')
+
+        return queryset
+
+    def parseCoordinates(self, parameter, value, count):
+        try:
+            coordinates = [float(coordinate) for coordinate in value.split(',')]
+        except ValueError:
+            coordinates = []
+
+        if len(coordinates) != count:
+            raise ValidationError({parameter: f'Expected {count} comma-separated coordinates.'})
+
+        for latitude, longitude in zip(coordinates[0::2], coordinates[1::2]):
+            if not -90 <= latitude <= 90 or not -180 <= longitude <= 180:
+                raise ValidationError({parameter: 'Coordinates out of range.'})
+
+        return coordinates
+
+
+# the filters of the route list: the fields matched exactly, along with the range of
+# the route's length ('min_length' and 'max_length', in km; see core.routemetrics)
+class RouteFilterSet(FilterSet):
+    min_length = NumberFilter(field_name='length', lookup_expr='gte')
+    max_length = NumberFilter(field_name='length', lookup_expr='lte')
+
+    class Meta:
+        model = Route
+        fields = ['verified', 'user__baseUser__username', 'user__baseUser__first_name', 'user__baseUser__last_name',
+                  'group__name', 'isWithin__attraction__name', 'isWithin__attraction__isTagged__tag__tagName',
+                  'notebook__id', 'user', 'group', 'ratingFlag__id']
@@ -0,0 +1,134 @@
+import math
+from django.db.models import F, FloatField, Q, Value
+from django.db.models.functions import ASin, Cos, Least, Power, Radians, Sin, Sqrt
+
+earthRadius = 6371.0088     # km
+geohashAlphabet = '0123456789bcdefghjkmnpqrstuvwxyz'
+geohashPrecision = 12
+
+
+# encodes a point as a geohash, by interleaving the bits obtained through the
+# bisection of the longitude and latitude intervals; points which are close
+# to each other usually share a long prefix, which makes geohashes suitable
+# for spatial lookups through index range scans on a regular string column
+def encodeGeohash(latitude, longitude, precision=geohashPrecision):
+    latInterval = [-90.0, 90.0]
+    lonInterval = [-180.0, 180.0]
+    geohash = []
+    bits = 0
+    bitCount = 0
+    evenBit = True
+
+    while len(geohash) < precision:
+        interval, value = (lonInterval, longitude) if evenBit else (latInterval, latitude)
+        middle = (interval[0] + interval[1]) / 2
+
+        bits <<= 1
+        if value >= middle:
+            bits |= 1
+            interval[0] = middle
+        else:
+            interval[1] = middle
+
+        evenBit = not evenBit
+        bitCount += 1
+
+        if bitCount == 5:
+            geohash.append(geohashAlphabet[bits])
+            bits = 0
+            bitCount = 0
+
+    return ''.join(geohash)
+
+
+# height and width, in degrees, of the cells of the given precision
+def cellSize(precision):
+    latBits = 5 * precision // 2
+    lonBits = 5 * precision - latBits
+    return 180.0 / 2 ** latBits, 360.0 / 2 ** lonBits
+
+
+def normalizeLongitude(longitude):
+    return (longitude + 180.0) % 360.0 - 180.0
+
+
+# the geohash cells of the longest precision, out of which at most 'maxCells'
+# cover the given bounding box, or None, if the box is too large to be
+# covered by a few cells; the longitude range may cross the antimeridian
+def coveringCells(minLat, minLon, maxLat, maxLon, maxCells=16):
+    lonSpan = (maxLon - minLon) % 360.0 or (360.0 if maxLon != minLon else 0.0)
+
+    for precision in range(geohashPrecision, 0, -1):
+        height, width = cellSize(precision)
+        rows = math.floor(maxLat / height) - math.floor(minLat / height) + 1
+        columns = math.ceil(lonSpan / width) + 1
+
+        if rows * columns <= maxCells:
+            break
+    else:
+        return None
+
+    cells = set()
+    latitudes = [min(minLat + row * height, maxLat) for row in range(rows)] + [maxLat]
+    longitudes = [minLon + column * width for column in range(columns)] + [minLon + lonSpan]
+
+    for latitude in latitudes:
+        for longitude in longitudes:
+            cells.add(encodeGeohash(latitude, normalizeLongitude(longitude), precision))
+
+    return sorted(cells)
+
+
+# the bounding box of a circle, which spans every longitude when it reaches a pole
+def circleBoundingBox(latitude, longitude, radius):
+    deltaLat = math.degrees(radius / earthRadius)
+    minLat, maxLat = latitude - deltaLat, latitude + deltaLat
+
+    if minLat <= -90 or maxLat >= 90:
+        return max(minLat, -90.0), -180.0, min(maxLat, 90.0), 180.0
+
+    deltaLon = math.degrees(math.asin(min(math.sin(radius / earthRadius) / math.cos(math.radians(latitude)), 1.0)))
+    return minLat, normalizeLongitude(longitude - deltaLon), maxLat, normalizeLongitude(longitude + deltaLon)
+
+
+# condition selecting the rows within the given bounding box: the geohash prefixes
+# of the covering cells narrow the candidates through index range scans (the
+# alphabet only holds characters lower than '{'), and the coordinates are then
+# compared exactly, since the cells usually extend beyond the box
+def boundingBoxCondition(minLat, minLon, maxLat, maxLon, latField, lonField, geohashField):
+    condition = Q(**{latField + '__gte': minLat, latField + '__lte': maxLat})
+
+    if minLon <= maxLon:
+        condition &= Q(**{lonField + '__gte': minLon, lonField + '__lte': maxLon})
+    else:
+        condition &= Q(**{lonField + '__gte': minLon}) | Q(**{lonField + '__lte': maxLon})
+
+    cells = coveringCells(minLat, minLon, maxLat, maxLon)
+
+    if cells is not None:
+        prefixes = Q(pk__in=[])
+
+        for cell in cells:
+            prefixes |= Q(**{geohashField + '__gte': cell, geohashField + '__lt': cell + '{'})
+
+        condition &= prefixes
+
+    return condition
+
+
+# haversine distance, in km, between the given point and the row's coordinates
+def distanceExpression(latitude, longitude, latField, lonField):
+    deltaLat = Radians(F(latField) - Value(latitude))
+    deltaLon = Radians(F(lonField) - Value(longitude))
+    haversine = (Power(Sin(deltaLat / 2), 2) +
+                 Value(math.cos(math.radians(latitude))) * Cos(Radians(F(latField))) * Power(Sin(deltaLon / 2), 2))
+
+    # rounding errors could otherwise place the argument of the arcsine slightly above 1
+    return Value(2 * earthRadius) * ASin(Least(Sqrt(haversine), Value(1.0)), output_field=FloatField())
+
+
+def haversine(lat1, lon1, lat2, lon2):
+    deltaLat = math.radians(lat2 - lat1)
+    deltaLon = math.radians(lon2 - lon1)
+    a = math.sin(deltaLat / 2) ** 2 + math.cos(math.radians(lat1)) * math.cos(math.radians(lat2)) * math.sin(deltaLon / 2) ** 2
+    return 2 * earthRadius * math.asin(min(math.sqrt(a), 1.0))
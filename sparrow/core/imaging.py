@@ -0,0 +1,80 @@
+import os
+from io import BytesIO
+from PIL import Image as PillowImage, ImageOps
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+
+# the derivatives of every uploaded image, from the largest to the smallest: the longest
+# side of each one is at most 'size' pixels (None keeps the original size) and every one
+# of them is re-encoded as a progressive JPEG, without the metadata of the original
+# (EXIF, including the GPS coordinates of the camera); can be overridden through settings
+defaultImageVariants = {
+    'full': {'size': None, 'quality': 85},
+    'medium': {'size': 1024, 'quality': 80},
+    'thumbnail': {'size': 256, 'quality': 75},
+}
+
+
+def getImageVariants():
+    return getattr(settings, 'IMAGE_VARIANTS', defaultImageVariants)
+
+
+# 'notebook_images/<name>.png' -> 'notebook_images/<name>.thumbnail.jpeg'
+def variantPath(path, variant):
+    return f'{os.path.splitext(path)[0]}.{variant}.jpeg'
+
+
+def openImage(path):
+    with default_storage.open(path, 'rb') as file:
+        image = PillowImage.open(file)
+        image.load()
+
+    # the orientation is applied to the pixels, since the EXIF tag holding it is dropped
+    image = ImageOps.exif_transpose(image)
+
+    if image.mode in ('RGB', 'L'):
+        return image
+
+    # transparent images are flattened onto a white background, since JPEG has no alpha channel
+    image = image.convert('RGBA')
+    background = PillowImage.new('RGB', image.size, (255, 255, 255))
+    background.paste(image, mask=image.getchannel('A'))
+    return background
+
+
+def encodeImage(image, quality):
+    output = BytesIO()
+    image.save(output, 'JPEG', quality=quality, optimize=True, progressive=True)
+    return output.getvalue()
+
+
+# renders and stores every variant of the stored image, returning their paths by name;
+# each variant is downscaled from the previous (larger) one, rather than from the
+# original, so that the cost of resizing shrinks along with the variants
+def createVariants(path):
+    image = openImage(path)
+    variants = {}
+
+    for name, options in getImageVariants().items():
+        if options['size'] is not None:
+            image = image.copy()
+            image.thumbnail((options['size'], options['size']), PillowImage.LANCZOS)
+
+        # the storage would otherwise pick another name for an existing variant
+        variant = variantPath(path, name)
+        default_storage.delete(variant)
+        variants[name] = default_storage.save(variant, ContentFile(encodeImage(image, options['quality'])))
+
+    return variants
+
+
+def deleteVariants(variants):
+    for path in variants.values():
+        default_storage.delete(path)
+
+
+# the URL of every variant, falling back to the original image for
+# the variants which were not rendered (yet, or ever, for older images)
+def variantUrls(path, variants):
+    return {name: default_storage.url(variants.get(name, path)) for name in getImageVariants()}
@@ -0,0 +1,97 @@
+import traceback
+from contextlib import nullcontext
+from datetime import timedelta
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Count, F
+from django.utils import timezone
+from .models import Job
+
+# the functions run by the workers, by job name
+jobHandlers = {}
+
+
+# registers the decorated function as the handler of the named jobs,
+# which is called with the payload of each job as keyword arguments
+def jobHandler(name):
+    def register(function):
+        jobHandlers[name] = function
+        return function
+
+    return register
+
+
+# queues a job; when called within a transaction, the job is only
+# visible to the workers once said transaction commits
+def enqueue(name, **payload):
+    return Job.objects.create(name=name, payload=payload, maxAttempts=getattr(settings, 'JOB_MAX_ATTEMPTS', 5))
+
+
+# marks at most 'limit' due jobs as running on behalf of the given worker and returns their ids;
+# the rows are locked with SKIP LOCKED, so that concurrent workers never wait for each other,
+# and the claimed jobs are selected again afterwards, since the backends without row locks
+# (SQLite) may let another worker claim some of them in between; on said backends, the
+# selection is not wrapped in a transaction, which SQLite could not upgrade to a write
+# while another thread is writing
+def claimJobs(workerId, limit):
+    now = timezone.now()
+    locking = transaction.atomic() if connection.features.has_select_for_update else nullcontext()
+
+    with locking:
+        dueJobs = (Job.objects.select_for_update(skip_locked=True)
+                   .filter(status=Job.QUEUED, runAfter__lte=now).order_by('runAfter', 'id'))
+        jobIds = list(dueJobs.values_list('id', flat=True)[:limit])
+
+        if not jobIds:
+            return []
+
+        Job.objects.filter(pk__in=jobIds, status=Job.QUEUED).update(status=Job.RUNNING, lockedBy=workerId, lockedAt=now,
+                                                                    attempts=F('attempts') + 1)
+
+    return list(Job.objects.filter(pk__in=jobIds, lockedBy=workerId, lockedAt=now).values_list('id', flat=True))
+
+
+# runs a claimed job, in whichever thread or process of the worker's pool: finished jobs
+# are deleted, while failed ones are either retried later or dead-lettered
+def executeJob(jobId):
+    job = Job.objects.filter(pk=jobId, status=Job.RUNNING).first()
+    if job is None:
+        return
+
+    try:
+        jobHandlers[job.name](**job.payload)
+    except Exception:
+        failJob(job, traceback.format_exc())
+    else:
+        Job.objects.filter(pk=job.pk).delete()
+
+
+# the delay before each retry doubles with every failed attempt
+def failJob(job, error):
+    if job.attempts >= job.maxAttempts:
+        Job.objects.filter(pk=job.pk).update(status=Job.DEAD, lockedBy=None, lastError=error)
+        return
+
+    retryDelay = getattr(settings, 'JOB_RETRY_DELAY', 30) * 2 ** (job.attempts - 1)
+    Job.objects.filter(pk=job.pk).update(status=Job.QUEUED, lockedBy=None, lastError=error,
+                                         runAfter=timezone.now() + timedelta(seconds=retryDelay))
+
+
+# the jobs left running by a worker which stopped before finishing them are
+# either queued again or, when out of attempts, dead-lettered
+def releaseStaleJobs():
+    lockedBefore = timezone.now() - timedelta(seconds=getattr(settings, 'JOB_LOCK_TIMEOUT', 600))
+    staleJobs = Job.objects.filter(status=Job.RUNNING, lockedAt__lt=lockedBefore)
+
+    staleJobs.filter(attempts__gte=F('maxAttempts')).update(status=Job.DEAD, lockedBy=None, lastError='Timed out.')
+    staleJobs.update(status=Job.QUEUED, lockedBy=None)
+
+
+def requeueDeadJobs():
+    return Job.objects.filter(status=Job.DEAD).update(status=Job.QUEUED, attempts=0, runAfter=timezone.now())
+
+
+# number of jobs in every state
+def queueStats():
+    counts = dict(Job.objects.order_by().values_list('status').annotate(count=Count('id')))
+    return {status: counts.get(status, 0) for status, label in Job.statuses}
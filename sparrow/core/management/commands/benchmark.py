@@ -0,0 +1,158 @@
+import io
+import json
+import math
+import uuid
+from statistics import mean
+from time import perf_counter
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import Count
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import get_resolver
+from core.middleware import endpointStats
+from core.models import Member
+
+
+# extra query parameters used when listing the objects whose ids are
+# needed for the detail requests, so that the chosen objects can be
+# viewed by the benchmarking member (notebooks are private and
+# groups can only be viewed by their members)
+detailLookupParameters = {
+    'notebook': lambda member: {'user_id': member.pk},
+    'group': lambda member: {'belongsTo__user_id': member.pk},
+}
+
+
+# generates a dataset for every requested scale, issues repeated GET requests on
+# every list and detail endpoint of the core app, as one of the generated members,
+# and reports the latency percentiles, query count, duplicate queries and database
+# time of each endpoint (the last two through the query instrumentation) as JSON;
+# every dataset is generated inside a transaction which gets rolled back afterwards,
+# so the database is left untouched
+class Command(BaseCommand):
+    help = 'Benchmarks every list and detail endpoint against generated datasets of increasing size.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='100,1000', help='comma-separated member counts of the generated datasets')
+        parser.add_argument('--repeat', type=int, default=20, help='requests issued on every endpoint')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', default=None, help='file the JSON report is written to (stdout by default)')
+
+    @override_settings(QUERY_INSTRUMENTATION=True)
+    def handle(self, *args, **options):
+        report = {'repeat': options['repeat'], 'results': []}
+
+        for size in [int(size) for size in options['sizes'].split(',')]:
+            with transaction.atomic():
+                report['results'].append(self.benchmarkSize(size, options['repeat'], options['seed']))
+                transaction.set_rollback(True)
+
+        output = json.dumps(report, indent=2)
+
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                file.write(output)
+        else:
+            self.stdout.write(output)
+
+    def benchmarkSize(self, size, repeat, seed):
+        prefix = 'bench-' + uuid.uuid4().hex[:6]
+        sizes = {
+            'members': size,
+            'groups': max(size // 10, 1),
+            'group_size': 8,
+            'attractions': size * 2,
+            'routes': size * 2,
+            'stops': 8,
+            'tags': 2,
+            'ratings': size * 5,
+            'notebooks': size,
+            'images': 2,
+        }
+
+        call_command('generatedata', prefix=prefix, seed=seed, stdout=io.StringIO(), **sizes)
+
+        # the member belonging to the most groups is the one issuing the requests
+        member = (Member.objects.filter(baseUser__username__startswith=prefix + '-')
+                  .annotate(groupCount=Count('belongsTo')).order_by('-groupCount', 'pk').first())
+        # the host has to be one of the allowed ones, outside of the test runner;
+        # failing endpoints are reported through their status code
+        client = Client(HTTP_HOST=settings.ALLOWED_HOSTS[0] if settings.ALLOWED_HOSTS else 'localhost', raise_request_exception=False)
+        client.force_login(member.baseUser)
+
+        endpoints = {}
+
+        for name, route in self.getEndpoints():
+            if name.endswith('-list'):
+                url = '/' + route
+            else:
+                objectId = self.findObjectId(client, name[:-len('-detail')], member)
+                if objectId is None:
+                    continue
+                url = '/' + route.replace('<int:pk>', str(objectId))
+
+            endpoints[name] = self.measure(client, url, repeat)
+
+        return {'size': size, 'dataset': sizes, 'endpoints': endpoints}
+
+    # every GET-able list and detail URL pattern of the core app
+    def getEndpoints(self):
+        for pattern in get_resolver().url_patterns:
+            if getattr(pattern, 'namespace', None) != 'core':
+                continue
+
+            for corePattern in pattern.url_patterns:
+                actions = getattr(corePattern.callback, 'actions', {})
+                name = corePattern.name
+
+                if 'get' in actions and (name.endswith('-list') or name.endswith('-detail')):
+                    yield name, str(corePattern.pattern)
+
+    def findObjectId(self, client, resource, member):
+        parameters = detailLookupParameters.get(resource, lambda member: {})(member)
+        response = client.get(f'/{resource}/list/', parameters)
+
+        # the reference data lists are pre-rendered (see ReferenceDataMixin), without any 'data'
+        results = response.json().get('results') if response.status_code == 200 else None
+        if not results:
+            return None
+
+        result = results[0]
+        return result['id'] if 'id' in result else result['baseUser']['id']
+
+    def measure(self, client, url, repeat):
+        latencies = []
+        queries = 0
+        statusCode = None
+        endpointStats.reset()
+
+        for index in range(repeat):
+            with CaptureQueriesContext(connection) as capturedQueries:
+                start = perf_counter()
+                response = client.get(url)
+                latencies.append((perf_counter() - start) * 1000)
+
+            queries = len(capturedQueries)
+            statusCode = response.status_code
+
+        latencies.sort()
+        instrumentation = next(iter(endpointStats.summary().values()), {})
+        return {
+            'url': url,
+            'status': statusCode,
+            'queries': queries,
+            'duplicateQueries': instrumentation.get('duplicateQueries', 0) // repeat,
+            'dbMs': round(instrumentation.get('averageDbTime', 0.0) * 1000, 3),
+            'meanMs': round(mean(latencies), 3),
+            'p50Ms': round(self.percentile(latencies, 50), 3),
+            'p90Ms': round(self.percentile(latencies, 90), 3),
+            'p99Ms': round(self.percentile(latencies, 99), 3),
+        }
+
+    # nearest-rank percentile of an already sorted list
+    def percentile(self, values, rank):
+        index = max(math.ceil(rank / 100 * len(values)) - 1, 0)
+        return values[index]
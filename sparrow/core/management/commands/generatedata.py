@@ -0,0 +1,190 @@
+import random
+import uuid
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from core.models import Attraction, BelongsTo, Group, Image, IsTagged, isWithin, Member, Notebook, RatingFlag, RatingFlagType, Route, Status, Tag
+from core.geo import encodeGeohash
+from core.search import rebuildIndex
+from core.ratings import rebuildSummaries
+from core.routemetrics import updateMetrics
+
+
+# generates a synthetic dataset of the requested size, inserting every model through
+# batched 'bulk_create' calls; since some database backends (MySQL) do not return the
+# primary keys of bulk-inserted rows, every generated name starts with a prefix unique
+# to the current run, through which the inserted rows are selected again afterwards
+class Command(BaseCommand):
+    help = 'Generates a synthetic dataset of members, groups, routes, attractions and related data.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--members', type=int, default=100)
+        parser.add_argument('--groups', type=int, default=10)
+        parser.add_argument('--group-size', type=int, default=8, help='members in each group')
+        parser.add_argument('--attractions', type=int, default=200)
+        parser.add_argument('--routes', type=int, default=200)
+        parser.add_argument('--stops', type=int, default=8, help='attractions placed in each route')
+        parser.add_argument('--tags', type=int, default=2, help='tags of each attraction')
+        parser.add_argument('--ratings', type=int, default=500)
+        parser.add_argument('--notebooks', type=int, default=100)
+        parser.add_argument('--images', type=int, default=2, help='images of each notebook')
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--seed', type=int, default=None)
+        parser.add_argument('--prefix', default=None, help='prefix of every generated name (random by default)')
+
+    def handle(self, *args, **options):
+        self.random = random.Random(options['seed'])
+        self.batchSize = options['batch_size']
+        self.prefix = options['prefix'] or 'gen-' + uuid.uuid4().hex[:6]
+
+        statusIds = list(Status.objects.values_list('id', flat=True))
+        tagIds = list(Tag.objects.values_list('id', flat=True))
+        ratingFlagTypeIds = list(RatingFlagType.objects.values_list('id', flat=True))
+
+        if not statusIds or not tagIds or not ratingFlagTypeIds:
+            raise CommandError('The Status, Tag and RatingFlagType tables must be seeded first (run "migrate").')
+
+        # the routes, ratings, notebooks and images are owned by members, the notebooks
+        # belong to routes and the ratings are given to either routes or attractions
+        if not options['members'] and (options['routes'] or options['ratings'] or options['notebooks'] or options['attractions']):
+            raise CommandError('Routes, attractions (whose images are owned by members), ratings and notebooks require members.')
+
+        if options['notebooks'] and not options['routes']:
+            raise CommandError('Notebooks require routes.')
+
+        if options['ratings'] and not options['routes'] and not options['attractions']:
+            raise CommandError('Ratings require routes or attractions.')
+
+        with transaction.atomic():
+            memberIds = self.generateMembers(options['members'])
+            groupIds = self.generateGroups(options['groups'])
+            self.generateMemberships(memberIds, groupIds, options['group_size'])
+            attractionIds = self.generateAttractions(options['attractions'])
+            self.generateTags(attractionIds, tagIds, options['tags'])
+            routeIds = self.generateRoutes(options['routes'], memberIds, groupIds)
+            self.generateStops(routeIds, attractionIds, options['stops'])
+            self.generateRatings(options['ratings'], memberIds, routeIds, attractionIds, ratingFlagTypeIds)
+            notebookIds = self.generateNotebooks(options['notebooks'], memberIds, routeIds, statusIds)
+            self.generateImages(notebookIds, attractionIds, memberIds, options['images'])
+
+        self.stdout.write(self.style.SUCCESS(f'Generated dataset "{self.prefix}".'))
+
+    def insert(self, model, instances):
+        model.objects.bulk_create(instances, batch_size=self.batchSize)
+        self.stdout.write(f'{model.__name__}: {len(instances)}')
+
+    def generateMembers(self, count):
+        # hashing is slow by design, which is why all users share the same password
+        password = make_password(self.prefix)
+        self.insert(User, [User(username=f'{self.prefix}-{index}', password=password, first_name='Generated',
+                                last_name=str(index), email=f'{self.prefix}-{index}@domain.com') for index in range(count)])
+
+        # the signal creating a member for every new user is not sent for bulk insertions
+        userIds = list(User.objects.filter(username__startswith=self.prefix + '-').values_list('id', flat=True))
+        self.insert(Member, [Member(baseUser_id=userId) for userId in userIds])
+
+        return userIds
+
+    def generateGroups(self, count):
+        self.insert(Group, [Group(name=f'{self.prefix}-{index}', description='generated group') for index in range(count)])
+        return list(Group.objects.filter(name__startswith=self.prefix + '-').values_list('id', flat=True))
+
+    def generateMemberships(self, memberIds, groupIds, groupSize):
+        memberships = []
+
+        for groupId in groupIds:
+            members = self.random.sample(memberIds, min(groupSize, len(memberIds)))
+
+            # the first member of every group is its admin
+            for index, memberId in enumerate(members):
+                memberships.append(BelongsTo(user_id=memberId, group_id=groupId, isAdmin=index == 0))
+
+        self.insert(BelongsTo, memberships)
+
+    def generateAttractions(self, count):
+        attractions = []
+
+        for index in range(count):
+            latitude, longitude = self.random.uniform(43.6, 48.3), self.random.uniform(20.2, 29.7)
+            attractions.append(Attraction(name=f'{self.prefix}-{index}', generalDescription=self.describe(),
+                                          latitude=latitude, longitude=longitude, geohash=encodeGeohash(latitude, longitude)))
+
+        self.insert(Attraction, attractions)
+
+        # the search index is only updated by the signals sent when saving
+        generated = Attraction.objects.filter(name__startswith=self.prefix + '-')
+        rebuildIndex(generated, self.batchSize)
+        return list(generated.values_list('id', flat=True))
+
+    def generateTags(self, attractionIds, tagIds, tagsPerAttraction):
+        self.insert(IsTagged, [IsTagged(attraction_id=attractionId, tag_id=tagId)
+                               for attractionId in attractionIds
+                               for tagId in self.random.sample(tagIds, min(tagsPerAttraction, len(tagIds)))])
+
+    def generateRoutes(self, count, memberIds, groupIds):
+        routes = []
+
+        for index in range(count):
+            # a quarter of the routes are owned by groups
+            ownedByGroup = groupIds and self.random.random() < 0.25
+            latitude, longitude = self.random.uniform(43.6, 48.3), self.random.uniform(20.2, 29.7)
+            routes.append(Route(title=f'{self.prefix}-{index}', description=self.describe(),
+                                public=self.random.random() < 0.7, verified=self.random.random() < 0.2,
+                                startingPointLat=latitude, startingPointLon=longitude,
+                                startingPointGeohash=encodeGeohash(latitude, longitude),
+                                user_id=None if ownedByGroup else self.random.choice(memberIds),
+                                group_id=self.random.choice(groupIds) if ownedByGroup else None))
+
+        self.insert(Route, routes)
+
+        generated = Route.objects.filter(title__startswith=self.prefix + '-')
+        rebuildIndex(generated, self.batchSize)
+        return list(generated.values_list('id', flat=True))
+
+    def generateStops(self, routeIds, attractionIds, stopsPerRoute):
+        self.insert(isWithin, [isWithin(route_id=routeId, attraction_id=attractionId, orderNumber=orderNumber)
+                               for routeId in routeIds
+                               for orderNumber, attractionId in enumerate(self.random.sample(attractionIds, min(stopsPerRoute, len(attractionIds))), start=1)])
+
+        # the metrics of the routes are only updated by the signals sent when saving
+        updateMetrics(routeIds, self.batchSize)
+
+    def generateRatings(self, count, memberIds, routeIds, attractionIds, ratingFlagTypeIds):
+        ratings = []
+
+        for index in range(count):
+            onRoute = routeIds and (not attractionIds or self.random.random() < 0.5)
+            ratings.append(RatingFlag(user_id=self.random.choice(memberIds), rating_id=self.random.choice(ratingFlagTypeIds),
+                                      comment=f'{self.prefix} comment {index}',
+                                      route_id=self.random.choice(routeIds) if onRoute else None,
+                                      attraction_id=None if onRoute else self.random.choice(attractionIds)))
+
+        self.insert(RatingFlag, ratings)
+
+        # the rating summaries are only updated by the signals sent when saving
+        rebuildSummaries('route', routeIds)
+        rebuildSummaries('attraction', attractionIds)
+
+    def generateNotebooks(self, count, memberIds, routeIds, statusIds):
+        self.insert(Notebook, [Notebook(title=f'{self.prefix}-{index}', note=self.describe(),
+                                        user_id=self.random.choice(memberIds), route_id=self.random.choice(routeIds),
+                                        status_id=self.random.choice(statusIds))
+                               for index in range(count)])
+        return list(Notebook.objects.filter(title__startswith=self.prefix + '-').values_list('id', flat=True))
+
+    # only the image entries are generated, without any files on disk
+    def generateImages(self, notebookIds, attractionIds, memberIds, imagesPerNotebook):
+        images = [Image(imagePath=f'notebook_images/{self.prefix}-{notebookId}-{index}.jpeg', notebook_id=notebookId,
+                        owner_id=self.random.choice(memberIds))
+                  for notebookId in notebookIds for index in range(imagesPerNotebook)]
+        images += [Image(imagePath=f'attraction_images/{self.prefix}-{attractionId}.jpeg', attraction_id=attractionId,
+                         owner_id=self.random.choice(memberIds))
+                   for attractionId in attractionIds]
+
+        self.insert(Image, images)
+
+    def describe(self):
+        words = ['scenic', 'historic', 'mountain', 'river', 'castle', 'museum', 'forest', 'village', 'lake', 'monastery',
+                 'trail', 'view', 'old', 'town', 'bridge', 'church', 'market', 'valley', 'park', 'fortress']
+        return ' '.join(self.random.choice(words) for index in range(self.random.randint(10, 60)))
@@ -0,0 +1,43 @@
+from django.core.management.base import BaseCommand
+from core.geo import encodeGeohash
+from core.models import Attraction, Route
+
+# the (latitude, longitude, geohash) fields of every model looked up by the ProximityFilter
+geohashedModels = {
+    Attraction: ('latitude', 'longitude', 'geohash'),
+    Route: ('startingPointLat', 'startingPointLon', 'startingPointGeohash'),
+}
+
+
+# recomputes the geohashes of every attraction and of the starting point of every route, in
+# batches; needed once for the instances saved before the geohashes existed, as well as for the
+# ones inserted through 'bulk_create' or modified through 'update', since the geohashes are
+# otherwise set when saving, and the instances without one are left out of every spatial lookup
+class Command(BaseCommand):
+    help = 'Recomputes the geohashes of attractions and of the starting points of routes.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        for model, (latField, lonField, geohashField) in geohashedModels.items():
+            lastId = 0
+            updated = 0
+
+            while True:
+                batch = list(model.objects.filter(pk__gt=lastId).order_by('pk').only(latField, lonField, geohashField)[:options['batch_size']])
+                if not batch:
+                    break
+
+                changed = []
+                for instance in batch:
+                    geohash = encodeGeohash(float(getattr(instance, latField)), float(getattr(instance, lonField)))
+                    if getattr(instance, geohashField) != geohash:
+                        setattr(instance, geohashField, geohash)
+                        changed.append(instance)
+
+                model.objects.bulk_update(changed, [geohashField])
+                lastId = batch[-1].pk
+                updated += len(changed)
+
+            self.stdout.write(f'{model.__name__}: {updated}')
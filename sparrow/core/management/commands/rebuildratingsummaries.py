@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from core.ratings import rebuildSummaries
+
+
+# recomputes the rating summaries of every route and attraction from their ratings;
+# needed once for the ratings posted before the summaries existed, as well as for the
+# ones inserted through 'bulk_create', since the summaries are otherwise updated when saving
+class Command(BaseCommand):
+    help = 'Recomputes the rating summaries of routes and attractions.'
+
+    def handle(self, *args, **options):
+        for relationField in ['route', 'attraction']:
+            self.stdout.write(f'{relationField}: {rebuildSummaries(relationField)}')
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+from core.models import Route
+from core.routemetrics import updateMetrics
+
+
+# recomputes the metrics (length, legs, bounding box and centroid) of every route, in batches;
+# needed once for the routes created before the metrics existed, as well as for the placements
+# inserted through 'bulk_create', since the metrics are otherwise updated along with them
+class Command(BaseCommand):
+    help = 'Recomputes the length, bounding box and centroid of every route.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        updated = updateMetrics(Route.objects.order_by('pk').values_list('pk', flat=True), options['batch_size'])
+        self.stdout.write(f'Route: {updated}')
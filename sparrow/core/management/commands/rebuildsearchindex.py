@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+from core.search import indexedModels, rebuildIndex
+
+
+# rebuilds the inverted index of every searchable model, in batches; needed once for
+# the instances created before the index existed, as well as for the ones inserted
+# through 'bulk_create', since the index is otherwise updated when saving
+class Command(BaseCommand):
+    help = 'Rebuilds the search index of routes and attractions.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        for model in indexedModels:
+            indexed = rebuildIndex(model.objects.all(), options['batch_size'])
+            self.stdout.write(f'{model.__name__}: {indexed}')
@@ -0,0 +1,97 @@
+import multiprocessing
+import os
+import socket
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+import django
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections, connections
+from core.jobs import claimJobs, executeJob, releaseStaleJobs, requeueDeadJobs
+
+
+# every thread or process of the pool holds its own database connection,
+# which is closed whenever it becomes unusable or reaches CONN_MAX_AGE
+def runJob(jobId):
+    try:
+        executeJob(jobId)
+    finally:
+        close_old_connections()
+
+
+# runs the queued background jobs (see core.jobs) in a pool of threads or, for CPU-bound
+# work, of processes; the worker only claims as many jobs as it has idle slots, so that
+# the other workers can pick up the rest, and polls the queue whenever it runs out of jobs;
+# without any pool ('--workers 0'), the jobs are run one by one, by the command itself
+class Command(BaseCommand):
+    help = 'Runs the queued background jobs.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4, help='jobs run at the same time (0 runs them one by one, inline)')
+        parser.add_argument('--processes', action='store_true', help='runs the jobs in processes, rather than threads')
+        parser.add_argument('--poll-interval', type=float, default=1.0, help='seconds between polls of an empty queue')
+        parser.add_argument('--once', action='store_true', help='exits once there are no due jobs left')
+        parser.add_argument('--requeue-dead', action='store_true', help='queues the dead-lettered jobs again and exits')
+
+    def handle(self, *args, **options):
+        if options['requeue_dead']:
+            self.stdout.write(f'Requeued {requeueDeadJobs()} jobs.')
+            return
+
+        self.workerId = f'{socket.gethostname()}:{os.getpid()}'
+        self.options = options
+
+        try:
+            if options['workers'] <= 0:
+                self.runInline()
+            else:
+                self.runPool(options['workers'])
+        except KeyboardInterrupt:
+            self.stdout.write('Stopped.')
+
+    def runInline(self):
+        while True:
+            releaseStaleJobs()
+            jobIds = claimJobs(self.workerId, 1)
+
+            for jobId in jobIds:
+                executeJob(jobId)
+
+            if not jobIds:
+                if self.options['once']:
+                    return
+
+                time.sleep(self.options['poll_interval'])
+
+    def runPool(self, workers):
+        if self.options['processes']:
+            # the processes are spawned, rather than forked, so that they never share the database
+            # connections of the worker; every one of them sets up Django on its own, before
+            # anything depending on the models (such as 'runJob') is imported
+            connections.close_all()
+            pool = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('spawn'), initializer=django.setup)
+        else:
+            pool = ThreadPoolExecutor(workers, thread_name_prefix='job')
+
+        pending = set()
+
+        # the running jobs are finished before exiting, even when interrupted
+        with pool:
+            while True:
+                releaseStaleJobs()
+
+                if len(pending) < workers:
+                    pending |= {pool.submit(runJob, jobId) for jobId in claimJobs(self.workerId, workers - len(pending))}
+
+                if not pending:
+                    if self.options['once']:
+                        return
+
+                    time.sleep(self.options['poll_interval'])
+                    continue
+
+                done, pending = wait(pending, timeout=self.options['poll_interval'], return_when=FIRST_COMPLETED)
+
+                # the failures of the jobs themselves are recorded by 'executeJob'
+                for future in done:
+                    if future.exception() is not None:
+                        self.stderr.write(f'Worker failure: {future.exception()!r}')
@@ -0,0 +1,107 @@
+import os
+import shutil
+import time
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from core.imaging import variantPath
+from core.mediastore import isSharded, shardedPath
+from core.models import Image, StoredFile
+
+
+# moves the images stored in the flat layout (along with their variants) into the sharded one,
+# while the application keeps running: the images are scanned in batches, in the order of their
+# ids, and every file is first linked under its new path, then its rows are updated and only
+# then is the old path unlinked, so that the file can be read under either path throughout;
+# the command can be stopped at any time and run again, since it skips the moved images, and
+# the id of the last scanned image is reported after every batch, so that it can resume from it
+class Command(BaseCommand):
+    help = 'Moves the stored images into the sharded directory layout.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--start-after', type=int, default=0, help='id of the last image scanned by a previous run')
+        parser.add_argument('--sleep', type=float, default=0.0, help='seconds to pause between batches')
+        parser.add_argument('--dry-run', action='store_true', help='only reports the files which would be moved')
+
+    def handle(self, *args, **options):
+        lastId = options['start_after']
+        movedFiles = 0
+
+        while True:
+            batch = list(Image.objects.filter(pk__gt=lastId).order_by('pk').values_list('pk', 'imagePath')[:options['batch_size']])
+            if not batch:
+                break
+
+            # the images sharing a file are moved together
+            for path in sorted({imagePath for imageId, imagePath in batch if not isSharded(imagePath)}):
+                if options['dry_run']:
+                    self.stdout.write(f'{path} -> {shardedPath(path)}')
+                elif not self.moveFile(path):
+                    continue
+
+                movedFiles += 1
+
+            lastId = batch[-1][0]
+            self.stdout.write(f'Scanned the images up to id {lastId}, {movedFiles} files moved.')
+            time.sleep(options['sleep'])
+
+        self.stdout.write(self.style.SUCCESS(f'Done, {movedFiles} files moved.'))
+
+    def moveFile(self, path):
+        newPath = shardedPath(path)
+
+        with transaction.atomic():
+            # concurrent uploads of the same content wait until the stored file is moved
+            list(StoredFile.objects.select_for_update().filter(path=path))
+            images = list(Image.objects.select_for_update().filter(imagePath=path))
+
+            # the images were deleted in the meantime
+            if not images:
+                return False
+
+            # old path -> new path, for the image itself and each of its variants
+            moves = {path: newPath}
+            for image in images:
+                for name, currentPath in image.variants.items():
+                    moves[currentPath] = variantPath(newPath, name)
+
+                image.imagePath = newPath
+                image.variants = {name: variantPath(newPath, name) for name in image.variants}
+
+            for currentPath, movedPath in moves.items():
+                self.linkFile(currentPath, movedPath)
+
+            Image.objects.bulk_update(images, ['imagePath', 'variants'])
+            StoredFile.objects.filter(path=path).update(path=newPath)
+
+        # the old paths are only unlinked once no committed row refers to them
+        for currentPath, movedPath in moves.items():
+            if os.path.exists(default_storage.path(movedPath)):
+                try:
+                    os.remove(default_storage.path(currentPath))
+                except FileNotFoundError:
+                    pass
+
+        return True
+
+    # hard links are created instantly, without copying the file, unless the new
+    # path is on another filesystem; a file already linked by an interrupted run
+    # is kept, and a missing one is reported, but does not stop the migration
+    def linkFile(self, currentPath, movedPath):
+        source = default_storage.path(currentPath)
+        destination = default_storage.path(movedPath)
+
+        if not os.path.exists(source):
+            if not os.path.exists(destination):
+                self.stderr.write(f'Missing file: {currentPath}')
+            return
+
+        os.makedirs(os.path.dirname(destination), exist_ok=True)
+
+        try:
+            os.link(source, destination)
+        except FileExistsError:
+            pass
+        except OSError:
+            shutil.copy2(source, destination)
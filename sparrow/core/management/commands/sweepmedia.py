@@ -0,0 +1,142 @@
+import os
+import posixpath
+import shutil
+import time
+from functools import reduce
+from itertools import islice
+from operator import or_
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Q
+from core.imaging import getImageVariants
+from core.models import defaultProfilePhoto, Image, Member, StoredFile
+
+# the variant lookups are split, so that no query ORs together too many prefixes
+prefixChunkSize = 100
+
+
+# the prefix shared by the variants derived from the same file: 'notebook_images/ab/cd/<stem>.'
+# for 'notebook_images/ab/cd/<stem>.thumbnail.jpeg' (the original may have another extension)
+def variantPrefix(path):
+    folder, name = posixpath.split(path)
+    stem, dot, variant = os.path.splitext(name)[0].rpartition('.')
+    return posixpath.join(folder, stem) + '.' if dot and variant in getImageVariants() else None
+
+
+# the paths, among the given ones, which are still referenced by an image or a member, either
+# as the original or as one of its variants; a stored file does not count as a reference by
+# itself, since the rows left behind by the images deleted before their files were released
+# along with them keep a reference count which never drops; the default profile photo is
+# always kept, since it is referenced by every member without a photo of their own
+def referencedPaths(paths):
+    referenced = {defaultProfilePhoto}
+    referenced.update(Image.objects.filter(imagePath__in=paths).values_list('imagePath', flat=True))
+    referenced.update(Member.objects.filter(profilePhoto__in=paths).values_list('profilePhoto', flat=True))
+
+    prefixes = sorted({variantPrefix(path) for path in paths} - {None})
+
+    for index in range(0, len(prefixes), prefixChunkSize):
+        chunk = prefixes[index:index + prefixChunkSize]
+
+        images = Image.objects.filter(reduce(or_, (Q(imagePath__startswith=prefix) for prefix in chunk)))
+        for variants in images.values_list('variants', flat=True):
+            referenced.update(variants.values())
+
+        members = Member.objects.filter(reduce(or_, (Q(profilePhoto__startswith=prefix) for prefix in chunk)))
+        for variants in members.values_list('profilePhotoVariants', flat=True):
+            referenced.update(variants.values())
+
+    return referenced
+
+
+# deletes the media files which are no longer referenced: the profile photos replaced or
+# removed by their members, and the files left behind by failed or cascaded deletions;
+# the media directory is walked with 'os.scandir' (which reads the size and modification
+# time of the files along with the directory listing) and the files are checked against
+# the database in batches, so that neither the paths nor the references are ever all kept
+# in memory; the files modified within the grace period are kept, since they may belong
+# to uploads whose rows are not committed yet, and the orphans may be moved to a
+# quarantine directory (outside of the media directory), rather than deleted
+class Command(BaseCommand):
+    help = 'Deletes (or quarantines) the media files which are no longer referenced.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--grace-period', type=float, default=24.0, help='hours during which an unreferenced file is kept')
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--quarantine', help='directory the orphaned files are moved to, rather than deleted')
+        parser.add_argument('--dry-run', action='store_true', help='only reports the orphaned files')
+
+    def handle(self, *args, **options):
+        self.root = os.path.abspath(settings.MEDIA_ROOT)
+        self.quarantine = os.path.abspath(options['quarantine']) if options['quarantine'] else None
+        self.scanned = 0
+
+        files = self.walk(time.time() - options['grace_period'] * 3600)
+        orphans = reclaimed = 0
+
+        while batch := dict(islice(files, options['batch_size'])):
+            referenced = referencedPaths(list(batch))
+
+            # the stale stored files of the orphans are locked (waiting for the uploads reusing
+            # them to commit their images) and checked again, then deleted, their files with them
+            if not options['dry_run']:
+                with transaction.atomic():
+                    stale = list(StoredFile.objects.select_for_update().filter(path__in=set(batch) - referenced).values_list('path', flat=True))
+                    referenced |= referencedPaths(stale)
+                    StoredFile.objects.filter(path__in=set(stale) - referenced).delete()
+
+            for path, size in batch.items():
+                if path in referenced:
+                    continue
+
+                if options['dry_run']:
+                    self.stdout.write(path)
+                elif not self.removeFile(path):
+                    continue
+
+                orphans += 1
+                reclaimed += size
+
+        action = 'would be reclaimed' if options['dry_run'] else 'reclaimed'
+        self.stdout.write(self.style.SUCCESS(f'Scanned {self.scanned} files, {orphans} orphaned, {reclaimed} bytes {action}.'))
+
+    # yields the (path, size) pairs of the files modified before the cutoff, the paths being
+    # relative to the media directory, as stored in the database; the quarantine is skipped
+    def walk(self, cutoff):
+        directories = [self.root]
+
+        while directories:
+            directory = directories.pop()
+
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        if entry.path != self.quarantine:
+                            directories.append(entry.path)
+                        continue
+
+                    if not entry.is_file(follow_symlinks=False):
+                        continue
+
+                    self.scanned += 1
+                    stat = entry.stat(follow_symlinks=False)
+
+                    if stat.st_mtime < cutoff:
+                        yield os.path.relpath(entry.path, self.root).replace(os.sep, '/'), stat.st_size
+
+    # the now empty directories are kept, since concurrent uploads may be about to use them
+    def removeFile(self, path):
+        fullPath = os.path.join(self.root, path)
+
+        try:
+            if self.quarantine is None:
+                os.remove(fullPath)
+            else:
+                destination = os.path.join(self.quarantine, path)
+                os.makedirs(os.path.dirname(destination), exist_ok=True)
+                shutil.move(fullPath, destination)
+        except FileNotFoundError:
+            return False
+
+        return True
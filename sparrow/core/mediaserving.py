@@ -0,0 +1,139 @@
+import mimetypes
+import os
+import posixpath
+import re
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.files.storage import default_storage
+from django.http import FileResponse, Http404, HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from django.views.decorators.http import require_safe
+from .mediastore import isContentAddressed
+
+# the content-addressed files are cached for a year, the others are revalidated on every use
+immutableCacheControl = 'public, max-age=31536000, immutable'
+revalidatedCacheControl = 'public, no-cache'
+
+rangePattern = re.compile(r'bytes=(\d*)-(\d*)')
+chunkSize = 64 * 1024
+
+
+# the strong validator of the file: the content-addressed files are identified by their
+# name, the other ones by their modification time and size, so that no file is ever read
+def fileETag(path, stat):
+    if isContentAddressed(path):
+        return f'"{os.path.splitext(posixpath.basename(path))[0]}"'
+
+    return f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+
+
+# the (first, last) byte positions requested by a single-range header, None when the whole
+# file is to be served (no header, an invalid one or several ranges, which are seldom used
+# for media) and False when the range cannot be satisfied
+def parseRange(header, size):
+    match = rangePattern.fullmatch(header.strip()) if header else None
+    if match is None or match.group(1) == match.group(2) == '':
+        return None
+
+    first, last = match.groups()
+
+    # 'bytes=-500' requests the last 500 bytes
+    if first == '':
+        length = int(last)
+        return (max(size - length, 0), size - 1) if length and size else False
+
+    first = int(first)
+    if last != '' and int(last) < first:
+        return None
+
+    return (first, size - 1 if last == '' else min(int(last), size - 1)) if first < size else False
+
+
+# a range is only served when the 'If-Range' validator (if any) still matches the file
+def rangeApplies(request, etag, lastModified):
+    validator = request.headers.get('If-Range')
+    return validator is None or validator in (etag, lastModified)
+
+
+def readRange(file, first, length):
+    with file:
+        file.seek(first)
+
+        while length > 0:
+            chunk = file.read(min(chunkSize, length))
+            if not chunk:
+                break
+
+            length -= len(chunk)
+            yield chunk
+
+
+# the whole file or, for a satisfiable 'Range' header, the requested range of it
+def fileResponse(request, fullPath, size, etag, lastModified):
+    requestedRange = parseRange(request.headers.get('Range'), size) if rangeApplies(request, etag, lastModified) else None
+
+    if requestedRange is False:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{size}'
+        return response
+
+    if requestedRange is None:
+        response = FileResponse(open(fullPath, 'rb'))
+    else:
+        first, last = requestedRange
+        response = StreamingHttpResponse(readRange(open(fullPath, 'rb'), first, last - first + 1), status=206)
+        response['Content-Range'] = f'bytes {first}-{last}/{size}'
+        response['Content-Length'] = last - first + 1
+
+    response['Accept-Ranges'] = 'bytes'
+    return response
+
+
+# the response handing the transfer off to the front-end server, which reads the file
+# (and serves the requested range) itself; nginx maps the internal location given by
+# MEDIA_ACCEL_REDIRECT_PREFIX to MEDIA_ROOT, while mod_xsendfile is given the full path
+def offloadedResponse(path, fullPath):
+    response = HttpResponse()
+
+    if settings.MEDIA_SENDFILE == 'x-accel-redirect':
+        prefix = getattr(settings, 'MEDIA_ACCEL_REDIRECT_PREFIX', '/protected-media/')
+        response['X-Accel-Redirect'] = prefix.rstrip('/') + '/' + path
+    else:
+        response['X-Sendfile'] = fullPath
+
+    return response
+
+
+# serves the stored images and profile photos (along with their variants): the conditional
+# requests are answered from the metadata of the file alone, and the file itself is either
+# streamed by the worker (through the server's 'wsgi.file_wrapper', when served whole) or,
+# when MEDIA_SENDFILE is set, by the front-end server
+@require_safe
+def serveMedia(request, path):
+    try:
+        fullPath = default_storage.path(path)
+        stat = os.stat(fullPath)
+    except (SuspiciousFileOperation, OSError):
+        raise Http404('No such file.')
+
+    if not os.path.isfile(fullPath):
+        raise Http404('No such file.')
+
+    etag = fileETag(path, stat)
+    lastModified = http_date(stat.st_mtime)
+    response = get_conditional_response(request, etag=etag, last_modified=int(stat.st_mtime))
+
+    if response is None:
+        if getattr(settings, 'MEDIA_SENDFILE', None):
+            response = offloadedResponse(path, fullPath)
+        else:
+            response = fileResponse(request, fullPath, stat.st_size, etag, lastModified)
+
+        response['Content-Type'] = mimetypes.guess_type(fullPath)[0] or 'application/octet-stream'
+
+    response['ETag'] = etag
+    response['Last-Modified'] = lastModified
+    response['Cache-Control'] = immutableCacheControl if isContentAddressed(path) else revalidatedCacheControl
+    return response
+
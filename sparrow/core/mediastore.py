@@ -0,0 +1,115 @@
+import hashlib
+import os
+import posixpath
+import re
+from collections import Counter
+from django.core.files.storage import default_storage
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from .models import StoredFile
+from .jobs import enqueue
+
+
+# the upload is hashed before anything is written, so that the content
+# which is already stored never gets written to the disk again
+def hashUpload(upload):
+    digest = hashlib.sha256()
+    for chunk in upload.chunks():
+        digest.update(chunk)
+
+    upload.seek(0)
+    return digest.hexdigest()
+
+
+# the files are spread over two levels of subdirectories, named after the first characters
+# of the hash of their content (or of their name, for the files named otherwise), so that
+# no directory ever holds more than a few thousand files, with 65536 leaf directories
+shardLevels = 2
+shardWidth = 2
+
+
+def shardKey(name):
+    stem = os.path.splitext(name)[0]
+    return stem if re.fullmatch(r'[0-9a-f]{64}', stem) else hashlib.sha256(stem.encode()).hexdigest()
+
+
+# 'notebook_images/<name>' -> 'notebook_images/ab/cd/<name>'
+def shardedPath(path):
+    folder, name = posixpath.split(path)
+    key = shardKey(name)
+    shards = [key[level * shardWidth:(level + 1) * shardWidth] for level in range(shardLevels)]
+    return posixpath.join(folder, *shards, name)
+
+
+def isSharded(path):
+    folder, name = posixpath.split(path)
+    for level in range(shardLevels):
+        folder = posixpath.dirname(folder)
+
+    return path == shardedPath(posixpath.join(folder, name))
+
+
+# the files named after the hash of their content, along with their variants
+# ('<hash>.jpeg', '<hash>.thumbnail.jpeg'), never change once stored
+def isContentAddressed(path):
+    stem = os.path.splitext(posixpath.basename(path))[0]
+    return re.fullmatch(r'[0-9a-f]{64}(\.\w+)?', stem) is not None
+
+
+# 'notebook_images/' + '<hash>.jpeg' -> 'notebook_images/ab/cd/<hash>.jpeg'
+def contentPath(folder, contentHash, extension):
+    return shardedPath(f'{folder}{contentHash}{extension}')
+
+
+# stores the upload under the hash of its content, unless said content is already stored,
+# and returns the path of the file, whose reference count is incremented; the row of the
+# stored file is locked, so that it cannot be released by a concurrent deletion meanwhile
+def storeUpload(upload, folder):
+    contentHash = hashUpload(upload)
+    extension = os.path.splitext(upload.name)[1].lower()
+
+    with transaction.atomic():
+        stored = StoredFile.objects.select_for_update().filter(contentHash=contentHash).first()
+
+        if stored is None:
+            # the storage writes the upload in chunks, creating any missing directory
+            path = default_storage.save(contentPath(folder, contentHash, extension), upload)
+
+            try:
+                with transaction.atomic():
+                    stored = StoredFile.objects.create(contentHash=contentHash, path=path, size=upload.size)
+            except IntegrityError:
+                # the same content was stored by a concurrent upload in the meantime
+                default_storage.delete(path)
+                stored = StoredFile.objects.select_for_update().get(contentHash=contentHash)
+
+        StoredFile.objects.filter(pk=stored.pk).update(referenceCount=F('referenceCount') + 1)
+
+    return stored.path
+
+
+# drops a reference to the file of every given (imagePath, variants) pair, within the transaction
+# deleting the images (see the 'post_delete' receiver of the Image model); the files which are no longer referenced (including the ones stored before
+# the content-addressed storage, which have a single reference) are deleted by background jobs,
+# which only run once said transaction commits
+def releaseImages(images):
+    references = Counter(imagePath for imagePath, variants in images)
+    variantsByPath = {imagePath: variants for imagePath, variants in images if variants}
+
+    with transaction.atomic():
+        storedFiles = {stored.path: stored for stored in StoredFile.objects.select_for_update().filter(path__in=references)}
+        releasedPaths = []
+
+        for path, count in references.items():
+            stored = storedFiles.get(path)
+
+            if stored is not None and stored.referenceCount > count:
+                StoredFile.objects.filter(pk=stored.pk).update(referenceCount=F('referenceCount') - count)
+                continue
+
+            releasedPaths.append(path)
+
+        StoredFile.objects.filter(path__in=releasedPaths).delete()
+
+        for path in releasedPaths:
+            enqueue('deleteUnreferencedFile', path=path, variants=list(variantsByPath.get(path, {}).values()))
@@ -0,0 +1,149 @@
+from contextlib import ExitStack
+from threading import Lock
+from time import perf_counter
+from django.conf import settings
+from django.db import connections
+
+
+# database execute wrapper, which records the duration of every
+# query issued while handling a request, along with how many
+# times each (statement, parameters) pair has been executed
+class QueryRecorder:
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.statements = {}
+
+    def __call__(self, execute, sql, params, many, context):
+        start = perf_counter()
+
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += perf_counter() - start
+            self.count += 1
+
+            key = (sql, repr(params))
+            self.statements[key] = self.statements.get(key, 0) + 1
+
+    @property
+    def duplicates(self):
+        return sum(occurrences - 1 for occurrences in self.statements.values())
+
+
+# aggregates the recorded metrics of every endpoint, identified by the name
+# of its URL pattern and the viewset action handling the request method
+class EndpointStats:
+    def __init__(self):
+        self.lock = Lock()
+        self.endpoints = {}
+
+    def record(self, endpoint, queries, dbTime, duplicates, serializationTime):
+        with self.lock:
+            entry = self.endpoints.setdefault(endpoint, {
+                'requests': 0,
+                'queries': 0,
+                'maxQueries': 0,
+                'dbTime': 0.0,
+                'maxDbTime': 0.0,
+                'duplicateQueries': 0,
+                'serializationTime': 0.0,
+            })
+
+            entry['requests'] += 1
+            entry['queries'] += queries
+            entry['maxQueries'] = max(entry['maxQueries'], queries)
+            entry['dbTime'] += dbTime
+            entry['maxDbTime'] = max(entry['maxDbTime'], dbTime)
+            entry['duplicateQueries'] += duplicates
+            entry['serializationTime'] += serializationTime
+
+    def summary(self):
+        with self.lock:
+            return {
+                endpoint: {
+                    **entry,
+                    'averageQueries': entry['queries'] / entry['requests'],
+                    'averageDbTime': entry['dbTime'] / entry['requests'],
+                    'averageSerializationTime': entry['serializationTime'] / entry['requests'],
+                }
+                for endpoint, entry in sorted(self.endpoints.items())
+            }
+
+    def reset(self):
+        with self.lock:
+            self.endpoints.clear()
+
+
+endpointStats = EndpointStats()
+
+
+# records, for every request, the number of queries, the time spent in the database,
+# the number of duplicate queries and the serialization time, which is the time
+# spent handling the request outside the database (running the view and rendering
+# the response); the metrics are aggregated per endpoint in 'endpointStats' and,
+# when the QUERY_INSTRUMENTATION_HEADERS setting is enabled, returned in headers
+class QueryInstrumentationMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not getattr(settings, 'QUERY_INSTRUMENTATION', False):
+            return self.get_response(request)
+
+        recorder = QueryRecorder()
+        start = perf_counter()
+
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(recorder))
+
+            response = self.get_response(request)
+
+        serializationTime = max(self.getViewTime(request) - recorder.duration, 0.0)
+        endpoint = self.getEndpoint(request)
+
+        if endpoint:
+            endpointStats.record(endpoint, recorder.count, recorder.duration, recorder.duplicates, serializationTime)
+
+        if getattr(settings, 'QUERY_INSTRUMENTATION_HEADERS', False):
+            response['X-Query-Count'] = recorder.count
+            response['X-Duplicate-Query-Count'] = recorder.duplicates
+            response['X-DB-Time'] = f'{recorder.duration * 1000:.2f}ms'
+            response['X-Serialization-Time'] = f'{serializationTime * 1000:.2f}ms'
+            response['X-Total-Time'] = f'{(perf_counter() - start) * 1000:.2f}ms'
+
+        return response
+
+    # the view (including the rendering of the response) is timed from
+    # the moment it is resolved, so that the authentication, session and
+    # other middleware related processing is left out
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request.instrumentedViewStart = perf_counter()
+        request.instrumentedAction = getattr(view_func, 'actions', {}).get(request.method.lower())
+
+    def process_template_response(self, request, response):
+        def stopTimer(renderedResponse):
+            request.instrumentedViewTime = perf_counter() - request.instrumentedViewStart
+
+        response.add_post_render_callback(stopTimer)
+        return response
+
+    # responses which are not rendered lazily are timed up to this point
+    def getViewTime(self, request):
+        if hasattr(request, 'instrumentedViewTime'):
+            return request.instrumentedViewTime
+
+        if hasattr(request, 'instrumentedViewStart'):
+            return perf_counter() - request.instrumentedViewStart
+
+        return 0.0
+
+    def getEndpoint(self, request):
+        match = getattr(request, 'resolver_match', None)
+
+        if match is None or not match.view_name:
+            return None
+
+        action = getattr(request, 'instrumentedAction', None)
+        return f'{match.view_name}:{action}' if action else f'{match.view_name}:{request.method.lower()}'
@@ -1,6 +1,7 @@
 from django.db import models
 from django.contrib.auth.models import User
 from django.core.exceptions import ValidationError
+from django.utils import timezone
 
 defaultProfilePhoto = 'default-profile-photo.jpeg'
 
@@ -28,14 +29,33 @@ class Route(models.Model):
     public = models.BooleanField(db_column='public')
     startingPointLat = models.FloatField(db_column='starting_point_lat')
     startingPointLon = models.FloatField(db_column='starting_point_lon')
+    # geohash of the starting point, kept up to date by a 'pre_save' receiver (and by 'rebuildgeohashes')
+    # and used for spatial lookups through index range scans
+    startingPointGeohash = models.CharField(max_length=12, db_column='starting_point_geohash', db_index=True, editable=False, default='')
     publicationDate = models.DateTimeField(auto_now_add=True, db_column='routePublicationDate')
     user = models.ForeignKey('Member', on_delete=models.CASCADE, null=True, blank=True, db_column='user_id')  # nullable
     group = models.ForeignKey('Group', on_delete=models.CASCADE, null=True, blank=True, db_column='group_id')  # nullable
+    # last modification of the route or of the rows serialized along with it (see core.versioning)
+    updatedAt = models.DateTimeField(default=timezone.now, editable=False, db_column='updated_at')
+    # geometry of the route, through its attractions in order (see core.routemetrics), kept up to date
+    # whenever its attractions change: its length and the length of each leg (in km), the bounding box
+    # and the centroid of the attractions, none of which exist for a route without any attraction
+    length = models.FloatField(default=0.0, editable=False, db_column='length')
+    legs = models.JSONField(default=list, editable=False, db_column='legs')
+    minLat = models.FloatField(null=True, editable=False, db_column='min_lat')
+    minLon = models.FloatField(null=True, editable=False, db_column='min_lon')
+    maxLat = models.FloatField(null=True, editable=False, db_column='max_lat')
+    maxLon = models.FloatField(null=True, editable=False, db_column='max_lon')
+    centroidLat = models.FloatField(null=True, editable=False, db_column='centroid_lat')
+    centroidLon = models.FloatField(null=True, editable=False, db_column='centroid_lon')
 
     class Meta:
         db_table = 'route'
         ordering = ['-publicationDate']
         default_related_name = 'route'
+        # used by the keyset pagination, which orders by the id after the Meta.ordering (or the length)
+        indexes = [models.Index(fields=['-publicationDate', 'id'], name='route_ordering_idx'),
+                   models.Index(fields=['length', 'id'], name='route_length_idx')]
 
     def clean(self):
         if (self.group is None and self.user is None) or (self.group is not None and self.user is not None):
@@ -50,11 +70,16 @@ class Attraction(models.Model):
     generalDescription = models.CharField(max_length=3000, db_column='general_description')
     latitude = models.FloatField(db_column='latitude')
     longitude = models.FloatField(db_column='longitude')
+    # geohash of the location, kept up to date by a 'pre_save' receiver (and by 'rebuildgeohashes')
+    geohash = models.CharField(max_length=12, db_column='geohash', db_index=True, editable=False, default='')
+    # last modification of the attraction, its rating summary, tags or placements (see core.versioning)
+    updatedAt = models.DateTimeField(default=timezone.now, editable=False, db_column='updated_at')
 
     class Meta:
         db_table = 'attraction'
         ordering = ['name']
         default_related_name = 'attraction'
+        indexes = [models.Index(fields=['name', 'id'], name='attraction_ordering_idx')]
 
     def __str__(self):
         return self.name
@@ -64,7 +89,10 @@ class Attraction(models.Model):
 class Member(models.Model):
     baseUser = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True)
     profilePhoto = models.ImageField(upload_to='profile-photos', db_column='profile_photo', default=defaultProfilePhoto)
+    # paths of the derivatives of the profile photo (see core.imaging), by name
+    profilePhotoVariants = models.JSONField(default=dict, blank=True, db_column='profile_photo_variants')
     birthDate = models.DateField(null=True, db_column='birth_date')
+    updatedAt = models.DateTimeField(default=timezone.now, editable=False, db_column='updated_at')
 
     class Meta:
         db_table = 'member'
@@ -78,7 +106,8 @@ class Member(models.Model):
 class Group(models.Model):
     name = models.CharField(max_length=30, db_column='name')
     description = models.CharField(max_length=1500, db_column='description')
-    
+    updatedAt = models.DateTimeField(default=timezone.now, editable=False, db_column='updated_at')
+
     class Meta:
         db_table = 'group'
         default_related_name = 'group'
@@ -129,12 +158,15 @@ class Notebook(models.Model):
     note = models.CharField(max_length = 3000, db_column = 'note')
     dateStarted = models.DateField(auto_now_add=True, db_column = 'date_started')
     dateCompleted = models.DateField(null = True, db_column = 'date_completed') # nullable
-    
+    # last modification of the notebook or of its images (see core.versioning)
+    updatedAt = models.DateTimeField(default=timezone.now, editable=False, db_column='updated_at')
+
     class Meta:
         db_table = 'notebook'
         # descending order for dateStarted, dateCompleted, in order to show the most recent trips first
         ordering = ['-dateStarted', '-dateCompleted', 'title']
         default_related_name = 'notebook'
+        indexes = [models.Index(fields=['-dateStarted', '-dateCompleted', 'title', 'id'], name='notebook_ordering_idx')]
 
     def __str__(self):
         return f'"{self.title}" by {self.user.username}'
@@ -196,6 +228,35 @@ class RatingFlag(models.Model):
         return f'"{self.user.baseUser.username}" rated resource as "{self.rating.type}": "{self.comment}..."'
 
 
+# denormalized rating aggregates of a route or an attraction (exactly one of the two),
+# kept up to date by the receivers of every RatingFlag change, within the same transaction,
+# so that the histogram, the mean and the flag count are read from a single row
+class RatingSummary(models.Model):
+    route = models.OneToOneField('Route', null=True, blank=True, on_delete=models.CASCADE, db_column='route_id') # nullable
+    attraction = models.OneToOneField('Attraction', null=True, blank=True, on_delete=models.CASCADE, db_column='attraction_id') # nullable
+    # histogram of the ratings (RatingFlagType ids 1 through 5)
+    oneStar = models.PositiveIntegerField(default=0, db_column='one_star')
+    twoStars = models.PositiveIntegerField(default=0, db_column='two_stars')
+    threeStars = models.PositiveIntegerField(default=0, db_column='three_stars')
+    fourStars = models.PositiveIntegerField(default=0, db_column='four_stars')
+    fiveStars = models.PositiveIntegerField(default=0, db_column='five_stars')
+    ratingCount = models.PositiveIntegerField(default=0, db_column='rating_count')
+    ratingTotal = models.PositiveIntegerField(default=0, db_column='rating_total')
+    ratingMean = models.FloatField(default=0, db_column='rating_mean')
+    # flags (RatingFlagType ids greater than 5), regardless of their type
+    flagCount = models.PositiveIntegerField(default=0, db_column='flag_count')
+
+    class Meta:
+        db_table = 'ratingSummary'
+        default_related_name = 'ratingSummary'
+        # the rankings are read in the order of these indexes
+        indexes = [models.Index(fields=['-ratingMean', '-ratingCount', 'id'], name='rating_summary_top_idx'),
+                   models.Index(fields=['-flagCount', 'id'], name='rating_summary_flagged_idx')]
+
+    def __str__(self):
+        return f'"{self.route or self.attraction}" rated {self.ratingMean:.2f} by {self.ratingCount} members, flagged {self.flagCount} times'
+
+
 class Image(models.Model):
     imagePath = models.CharField(max_length=300, null = False, blank = False, db_column = 'imagePath', db_index=True)
     notebook = models.ForeignKey('Notebook', on_delete=models.CASCADE, null=True, blank=True, db_column='notebook_id') # nullable
@@ -204,6 +265,9 @@ class Image(models.Model):
     # and for indicating if the information may be outdated or no longer available
     timestamp = models.DateTimeField(auto_now_add=True, null = False, db_column = 'datePosted')
     owner = models.ForeignKey('Member', null=True, on_delete=models.CASCADE, db_column='owner_id')
+    # paths of the derivatives of the image (thumbnail, medium, full), by name;
+    # empty until they are rendered, in which case the original is served instead
+    variants = models.JSONField(default=dict, blank=True, db_column='variants')
 
     class Meta:
         db_table = 'Image'
@@ -211,3 +275,71 @@ class Image(models.Model):
 
     def __str__(self):
         return self.imagePath
+
+
+# an uploaded file, stored under the SHA-256 hash of its content (see core.mediastore); the
+# images sharing the same content share the file, which is only deleted along with its last
+# reference, so that repeated uploads are neither stored, nor written to disk again
+class StoredFile(models.Model):
+    contentHash = models.CharField(max_length=64, unique=True, db_column='content_hash')
+    path = models.CharField(max_length=300, unique=True, db_column='path')
+    size = models.PositiveBigIntegerField(db_column='size')
+    referenceCount = models.PositiveIntegerField(default=0, db_column='reference_count')
+    createdAt = models.DateTimeField(auto_now_add=True, db_column='created_at')
+
+    class Meta:
+        db_table = 'storedFile'
+
+    def __str__(self):
+        return f'{self.path} ({self.referenceCount} references)'
+
+
+# inverted index of the searchable text of routes and attractions; every entry
+# maps an accent-folded, lowercase token onto the route or attraction containing
+# it, weighted by the field it appears in and by how many times it appears
+class SearchToken(models.Model):
+    token = models.CharField(max_length=50, db_column='token')
+    weight = models.FloatField(db_column='weight')
+    route = models.ForeignKey('Route', null=True, blank=True, on_delete=models.CASCADE, db_column='route_id')  # nullable
+    attraction = models.ForeignKey('Attraction', null=True, blank=True, on_delete=models.CASCADE, db_column='attraction_id')  # nullable
+
+    class Meta:
+        db_table = 'searchToken'
+        default_related_name = 'searchToken'
+        # prefix lookups on the token, which then only need the related id
+        indexes = [models.Index(fields=['token', 'route'], name='search_token_route_idx'),
+                   models.Index(fields=['token', 'attraction'], name='search_token_attraction_idx')]
+
+    def __str__(self):
+        return f'"{self.token}" in {self.route or self.attraction}'
+
+
+# background job, run by a worker of the 'runjobs' command (see core.jobs); jobs are
+# inserted within the transaction of whatever enqueues them, so that the workers only
+# see them once the rows they refer to are committed; finished jobs are deleted,
+# while the ones which failed too many times are kept, as dead letters
+class Job(models.Model):
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DEAD = 'dead'
+    statuses = [(QUEUED, 'Queued'), (RUNNING, 'Running'), (DEAD, 'Dead')]
+
+    name = models.CharField(max_length=100, db_column='name')
+    payload = models.JSONField(default=dict, db_column='payload')
+    status = models.CharField(max_length=10, choices=statuses, default=QUEUED, db_column='status')
+    attempts = models.PositiveIntegerField(default=0, db_column='attempts')
+    maxAttempts = models.PositiveIntegerField(default=5, db_column='max_attempts')
+    # queued jobs are not run before this moment, which is pushed back after every failure
+    runAfter = models.DateTimeField(default=timezone.now, db_column='run_after')
+    lockedBy = models.CharField(max_length=100, null=True, blank=True, db_column='locked_by')
+    lockedAt = models.DateTimeField(null=True, blank=True, db_column='locked_at')
+    lastError = models.TextField(blank=True, default='', db_column='last_error')
+    createdAt = models.DateTimeField(auto_now_add=True, db_column='created_at')
+
+    class Meta:
+        db_table = 'job'
+        # the workers claim the queued jobs in the order of this index
+        indexes = [models.Index(fields=['status', 'runAfter', 'id'], name='job_queue_idx')]
+
+    def __str__(self):
+        return f'{self.name}({self.payload}) {self.status} after {self.attempts} attempts'
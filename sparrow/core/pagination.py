@@ -0,0 +1,167 @@
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from django.core.exceptions import ImproperlyConfigured, ValidationError
+from django.db.models import F, Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import CursorPagination
+from rest_framework.utils.urls import replace_query_param
+
+
+# keyset pagination over the members of a group, ordered by the id of their
+# BelongsTo entries, so that every page of a large group costs the same,
+# regardless of how deep into the roster it is, and no COUNT is issued
+class RosterPagination(CursorPagination):
+    ordering = 'id'
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 500
+
+
+# keyset pagination over the queryset's explicit ordering (such as the distance
+# annotated by the ProximityFilter) or, by default, over the model's Meta.ordering,
+# with the id as a tiebreaker;
+# unlike the default CursorPagination, which positions the cursor only on the first
+# ordering field and skips any rows sharing said value through an OFFSET, the cursor
+# holds the values of every ordering field of the last row on the page, so that the
+# next page is selected through a single range condition on the (indexed) ordering,
+# whose cost does not depend on how deep into the list the page is;
+# nullable ordering fields always place their NULLs after every other value
+class KeysetPagination(CursorPagination):
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    # the model's Meta.ordering is used, unless specified
+    ordering = None
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+
+        self.base_url = request.build_absolute_uri()
+        self.keys = self.getKeys(queryset)
+        values, self.reverse = self.decode_cursor(request)
+
+        # the previous page is retrieved by walking the list backwards
+        keys = [(lookup, field, not descending, self.reverse) for lookup, field, descending in self.keys] if self.reverse \
+            else [(lookup, field, descending, False) for lookup, field, descending in self.keys]
+
+        queryset = queryset.order_by(*[self.orderBy(*key) for key in keys])
+
+        if values is not None:
+            queryset = queryset.filter(self.followingCondition(keys, values))
+
+        # an extra row is fetched to determine whether there is another page
+        results = list(queryset[:self.page_size + 1])
+        self.hasFollowing = len(results) > self.page_size
+        self.page = results[:self.page_size]
+
+        if self.reverse:
+            self.page.reverse()
+
+        # a page reached through a cursor always has a neighbour in the
+        # direction it was reached from, namely the page holding said cursor
+        self.has_next = self.hasFollowing if not self.reverse else True
+        self.has_previous = (values is not None) if not self.reverse else self.hasFollowing
+
+        return self.page
+
+    # (lookup, field, descending) triples, from the ordering, ending with the id;
+    # the lookup is either the column of a model field, or the name of an annotation
+    def getKeys(self, queryset):
+        model = queryset.model
+        ordering = self.ordering or queryset.query.order_by or model._meta.ordering
+        keys = []
+
+        for name in ordering:
+            if not isinstance(name, str):
+                raise ImproperlyConfigured(f'Cannot paginate {model.__name__} on an expression using a keyset.')
+
+            descending = name.startswith('-')
+            name = name.lstrip('-')
+
+            if name in queryset.query.annotations:
+                keys.append((name, queryset.query.annotations[name].output_field, descending))
+                continue
+
+            field = model._meta.pk if name == 'pk' else model._meta.get_field(name)
+
+            if field.is_relation and not field.many_to_one or not field.concrete:
+                raise ImproperlyConfigured(f'Cannot paginate {model.__name__} on "{name}" using a keyset.')
+
+            keys.append((field.attname, field, descending))
+
+        if not any(field.primary_key for lookup, field, descending in keys):
+            keys.append((model._meta.pk.attname, model._meta.pk, False))
+
+        return keys
+
+    def orderBy(self, lookup, field, descending, nullsFirst):
+        if not field.null:
+            return ('-' if descending else '') + lookup
+
+        expression = F(lookup)
+        return expression.desc(nulls_first=nullsFirst, nulls_last=not nullsFirst) if descending \
+            else expression.asc(nulls_first=nullsFirst, nulls_last=not nullsFirst)
+
+    # rows placed after the given values: (a > x) OR (a = x AND b > y) OR ...
+    def followingCondition(self, keys, values):
+        condition = Q(pk__in=[])
+        equalPrefix = Q()
+
+        for (lookup, field, descending, nullsFirst), value in zip(keys, values):
+            condition |= equalPrefix & self.afterCondition(lookup, field, descending, nullsFirst, value)
+            equalPrefix &= Q(**{lookup + '__isnull': True}) if value is None else Q(**{lookup: value})
+
+        return condition
+
+    def afterCondition(self, lookup, field, descending, nullsFirst, value):
+        if value is None:
+            # when the NULLs come first, every other value follows them
+            return Q(**{lookup + '__isnull': False}) if nullsFirst else Q(pk__in=[])
+
+        condition = Q(**{lookup + ('__lt' if descending else '__gt'): value})
+
+        if field.null and not nullsFirst:
+            condition |= Q(**{lookup + '__isnull': True})
+
+        return condition
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+
+        return self.encode_cursor((self.getValues(self.page[-1]), False))
+
+    def get_previous_link(self):
+        if not self.has_previous or not self.page:
+            return None
+
+        return self.encode_cursor((self.getValues(self.page[0]), True))
+
+    # dates and times are encoded in full, since their values are compared
+    # for equality against the database, when the cursor gets decoded
+    def getValues(self, instance):
+        values = [getattr(instance, lookup) for lookup, field, descending in self.keys]
+        return [value.isoformat() if hasattr(value, 'isoformat') else value for value in values]
+
+    def encode_cursor(self, cursor):
+        values, reverse = cursor
+        encoded = json.dumps({'v': values, 'r': reverse})
+        return replace_query_param(self.base_url, self.cursor_query_param, urlsafe_b64encode(encoded.encode()).decode())
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+
+        if encoded is None:
+            return None, False
+
+        try:
+            cursor = json.loads(urlsafe_b64decode(encoded.encode()))
+            values = [None if value is None else field.to_python(value) for (lookup, field, descending), value in zip(self.keys, cursor['v'])]
+
+            if len(values) != len(self.keys):
+                raise ValueError
+
+            return values, bool(cursor['r'])
+        except (TypeError, ValueError, KeyError, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
@@ -1,14 +1,19 @@
 from rest_framework import permissions
+from django.db.models import Q
 from .serializers import BelongsToSerializer, RatingFlagSerializer, IsWithinSerializer
 from .models import *
+from .authorization import getAuthorizationContext
 
 
+# the permissions below compare ids instead of related instances and read the
+# group memberships of the user making the request from the authorization
+# context, so that no related object or membership is queried per object checked
 class IsTheUserMakingTheRequest(permissions.BasePermission):
     def has_object_permission(self, request, view, obj):
         if not request.user:
             return False
 
-        return request.user == obj.baseUser
+        return getAuthorizationContext(request).isUser(obj.baseUser_id)
 
 
 class IsOwnedByTheUserMakingTheRequest(permissions.BasePermission):
@@ -16,7 +21,8 @@ class IsOwnedByTheUserMakingTheRequest(permissions.BasePermission):
         if not request.user:
             return False
 
-        return request.user == obj.user.baseUser
+        # the member's primary key is the id of their base user
+        return getAuthorizationContext(request).isUser(obj.user_id)
 
 
 class IsInGroup(permissions.BasePermission):
@@ -24,14 +30,7 @@ class IsInGroup(permissions.BasePermission):
         if not request.user:
             return False
 
-        user_id = request.user.id
-        group_id = obj.id
-
-        try:
-            BelongsTo.objects.get(user_id=user_id, group_id=group_id)
-            return True
-        except BelongsTo.DoesNotExist:
-            return False
+        return getAuthorizationContext(request).isInGroup(obj.id)
 
 
 class IsAdminOfGroup(permissions.BasePermission):
@@ -39,16 +38,8 @@ class IsAdminOfGroup(permissions.BasePermission):
         if not request.user:
             return False
 
-        user_id = request.user.id
-        group_id = obj.id
-
-        try:
-            is_in_group = BelongsTo.objects.get(user_id=user_id, group_id=group_id)
-            # if the user is an admin, the instance should have isAdmin set to true
-            return is_in_group.isAdmin
-
-        except BelongsTo.DoesNotExist:
-            return False
+        # if the user is an admin, the membership is mapped onto True
+        return getAuthorizationContext(request).isAdminOfGroup(obj.id)
 
 
 class BelongsToAuthorization(permissions.BasePermission):
@@ -83,12 +74,11 @@ class BelongsToAuthorization(permissions.BasePermission):
         return IsAdminOfGroup().has_object_permission(request, view, group)
 
     def has_object_permission(self, request, view, obj):
-        group = Group.objects.get(pk=obj.group_id)
+        context = getAuthorizationContext(request)
 
         if view.action == 'destroy':
-            isAdmin = IsAdminOfGroup().has_object_permission(request, view, group)
-            userToBeModified = Member.objects.get(pk=obj.user_id)
-            theirOwnEntry = IsTheUserMakingTheRequest().has_object_permission(request, view, userToBeModified)
+            isAdmin = context.isAdminOfGroup(obj.group_id)
+            theirOwnEntry = context.isUser(obj.user_id)
 
             return isAdmin or theirOwnEntry
 
@@ -98,19 +88,17 @@ class BelongsToAuthorization(permissions.BasePermission):
         nickname = request.data.get('nickname')
         isAdmin = request.data.get('isAdmin')
 
-        modifiedUser = Member.objects.get(pk=obj.user_id)
-
         # in order to replace a user in a group or move a user in another
         # group, the 'create' and 'delete' actions will be used instead
         if user or groupInRequest:
             return False
 
         # only admins can change the admin status of other group members
-        if isAdmin and not IsAdminOfGroup().has_object_permission(request, view, group):
+        if isAdmin and not context.isAdminOfGroup(obj.group_id):
             return False
 
         # any group member can change their nickname, as long as it's theirs
-        if nickname and not IsTheUserMakingTheRequest().has_object_permission(request, view, modifiedUser):
+        if nickname and not context.isUser(obj.user_id):
             return False
 
         return True
@@ -118,25 +106,51 @@ class BelongsToAuthorization(permissions.BasePermission):
 
 class RouteIsAuthorizedToMakeChanges(permissions.BasePermission):
     def has_object_permission(self, request, view, obj):
+        context = getAuthorizationContext(request)
+
         # current route is owned be the user making the request
-        userCondition = obj.user and IsOwnedByTheUserMakingTheRequest().has_object_permission(request, view, obj)
+        userCondition = obj.user_id is not None and context.isUser(obj.user_id)
         # current route is owned by a group to which the user making the request belongs and is an admin of
-        groupCondition = obj.group and IsAdminOfGroup().has_object_permission(request, view, obj.group)
+        groupCondition = obj.group_id is not None and context.isAdminOfGroup(obj.group_id)
 
         return userCondition or groupCondition
 
 
 class RouteIsPublic(permissions.BasePermission):
     def has_object_permission(self, request, view, obj):
+        context = getAuthorizationContext(request)
         publicCondition = obj.public and permissions.IsAuthenticated().has_permission(request, view)
 
         # current route is owned be the user making the request
-        userCondition = obj.user and IsOwnedByTheUserMakingTheRequest().has_object_permission(request, view, obj)
+        userCondition = obj.user_id is not None and context.isUser(obj.user_id)
         # current route is owned by a group to which the user making the request belongs
-        groupCondition = obj.group and IsInGroup().has_object_permission(request, view, obj.group)
+        groupCondition = obj.group_id is not None and context.isInGroup(obj.group_id)
 
         return publicCondition or userCondition or groupCondition
 
+    # queryset-level counterpart of 'has_object_permission', which expresses
+    # the same three conditions as a single WHERE clause, so that list actions
+    # no longer need to load every route and check it individually;
+    # 'routeField' is the lookup path to the route, when the queryset is
+    # based on a model related to it (e.g. 'route' for isWithin)
+    def filterQueryset(self, request, queryset, routeField=None):
+        if not request.user or not request.user.is_authenticated:
+            return queryset.none()
+
+        prefix = routeField + '__' if routeField else ''
+
+        # the member's primary key is the id of their base user
+        userId = request.user.id
+        # a subquery is used instead of a join on the group's members,
+        # so that public group routes are not duplicated for every member
+        groupsOfUser = BelongsTo.objects.filter(user_id=userId).values('group_id')
+
+        publicCondition = Q(**{prefix + 'public': True})
+        userCondition = Q(**{prefix + 'user_id': userId})
+        groupCondition = Q(**{prefix + 'group_id__in': groupsOfUser})
+
+        return queryset.filter(publicCondition | userCondition | groupCondition)
+
 
 class RatingFlagAuthorization(permissions.BasePermission):
     # necessary for the 'create' action
@@ -0,0 +1,66 @@
+import threading
+from contextlib import contextmanager
+from django.db import transaction
+from django.db.models import Case, IntegerField, Value, When
+from .models import Attraction, isWithin, Route
+from .versioning import touch
+from .routemetrics import updateMetrics
+
+
+# the routes (of the current thread) whose placements are being modified by 'setPlacements',
+# for which the receivers of the placement signals do nothing, since it updates the route,
+# its attractions and its metrics once, by itself
+suspendedRoutes = threading.local()
+
+
+@contextmanager
+def suspendPlacementSignals(routeId):
+    routeIds = suspendedRoutes.__dict__.setdefault('routeIds', set())
+    routeIds.add(routeId)
+
+    try:
+        yield
+    finally:
+        routeIds.discard(routeId)
+
+
+def placementSignalsSuspended(routeId):
+    return routeId in getattr(suspendedRoutes, 'routeIds', ())
+
+
+# places the given attractions within the route, in the given order (numbered from 1), through
+# a fixed number of statements, whatever the number of attractions: the placements of the
+# attractions left out are deleted by a single DELETE, the ones of the attractions which moved
+# are renumbered by a single UPDATE and the new ones are inserted by a single INSERT; every
+# attraction being placed at most once, the (route, attraction) pairs stay unique throughout;
+# the route is locked, so that concurrent placements within the same route are applied one
+# after the other
+def setPlacements(routeId, attractionIds):
+    positions = {attractionId: orderNumber for orderNumber, attractionId in enumerate(attractionIds, start=1)}
+
+    with transaction.atomic(), suspendPlacementSignals(routeId):
+        list(Route.objects.select_for_update().filter(pk=routeId).values_list('pk'))
+        current = dict(isWithin.objects.filter(route_id=routeId).values_list('attraction_id', 'orderNumber'))
+
+        removedIds = [attractionId for attractionId in current if attractionId not in positions]
+        movedIds = [attractionId for attractionId in current if attractionId in positions and current[attractionId] != positions[attractionId]]
+        addedIds = [attractionId for attractionId in positions if attractionId not in current]
+
+        # the receivers of the signals sent for every deleted placement return at once
+        if removedIds:
+            isWithin.objects.filter(route_id=routeId, attraction_id__in=removedIds).delete()
+
+        if movedIds:
+            orderNumbers = [When(attraction_id=attractionId, then=Value(positions[attractionId])) for attractionId in movedIds]
+            isWithin.objects.filter(route_id=routeId, attraction_id__in=movedIds).update(orderNumber=Case(*orderNumbers, output_field=IntegerField()))
+
+        isWithin.objects.bulk_create([isWithin(route_id=routeId, attraction_id=attractionId, orderNumber=positions[attractionId])
+                                      for attractionId in addedIds])
+
+        # the placements sent no signals (or suspended ones), so the route, the attractions
+        # and the metrics of the route are updated here, once
+        touch(Route.objects.filter(pk=routeId))
+        touch(Attraction.objects.filter(pk__in=removedIds + movedIds + addedIds))
+        updateMetrics([routeId])
+
+    return {'added': len(addedIds), 'moved': len(movedIds), 'removed': len(removedIds)}
@@ -0,0 +1,66 @@
+from functools import lru_cache
+from rest_framework import serializers
+
+
+# derives the relations which have to be eagerly loaded for a serializer, so that
+# serializing a queryset never issues one query per nested object:
+#   - every nested (single) serializer is a forward relation, loaded through
+#     'select_related', along with whatever its own nested serializers need;
+#   - every nested 'many=True' serializer is loaded through 'prefetch_related',
+#     along with everything below it;
+#   - relations which cannot be inferred from the declared fields (for instance,
+#     those used by a SerializerMethodField) are declared in the serializer's
+#     Meta class, through the 'select_related' and 'prefetch_related' attributes
+@lru_cache(maxsize=None)
+def getQueryPlan(serializerClass):
+    selectRelated = set()
+    prefetchRelated = set()
+    collectRelations(serializerClass(), '', False, selectRelated, prefetchRelated)
+
+    return sorted(selectRelated), sorted(prefetchRelated)
+
+
+def collectRelations(serializer, prefix, prefetching, selectRelated, prefetchRelated):
+    meta = getattr(serializer, 'Meta', None)
+
+    # relations below a prefetched one can only be prefetched as well
+    for path in getattr(meta, 'select_related', []):
+        (prefetchRelated if prefetching else selectRelated).add(prefix + path)
+
+    for path in getattr(meta, 'prefetch_related', []):
+        prefetchRelated.add(prefix + path)
+
+    for field in serializer.fields.values():
+        if field.write_only or field.source == '*':
+            continue
+
+        path = prefix + '__'.join(field.source_attrs)
+
+        if isinstance(field, serializers.ListSerializer):
+            prefetchRelated.add(path)
+            collectRelations(field.child, path + '__', True, selectRelated, prefetchRelated)
+
+        elif isinstance(field, serializers.BaseSerializer):
+            (prefetchRelated if prefetching else selectRelated).add(path)
+            collectRelations(field, path + '__', prefetching, selectRelated, prefetchRelated)
+
+
+def applyQueryPlan(queryset, serializerClass):
+    selectRelated, prefetchRelated = getQueryPlan(serializerClass)
+
+    if selectRelated:
+        queryset = queryset.select_related(*selectRelated)
+
+    if prefetchRelated:
+        queryset = queryset.prefetch_related(*prefetchRelated)
+
+    return queryset
+
+
+# eagerly loads whatever the serializer of the current action needs; the plan is
+# applied when filtering, so that it also covers the querysets returned by the
+# 'get_queryset' methods overridden in the viewsets, as well as 'get_object'
+class EagerLoadingMixin:
+    def filter_queryset(self, queryset):
+        queryset = applyQueryPlan(queryset, self.get_serializer_class())
+        return super().filter_queryset(queryset)
@@ -0,0 +1,87 @@
+from django.db import transaction
+from django.db.models import Case, Count, F, FloatField, Q, Sum, Value, When
+from django.db.models.functions import Cast
+from .models import Attraction, RatingFlag, RatingSummary, Route
+from .versioning import touch
+
+# RatingFlagType ids up to this one are ratings (their id being the number of stars),
+# while the ones above it are flags
+maxRatingId = 5
+histogramFields = {1: 'oneStar', 2: 'twoStars', 3: 'threeStars', 4: 'fourStars', 5: 'fiveStars'}
+
+
+def isRating(ratingId):
+    return ratingId <= maxRatingId
+
+
+# the summary of the rated route or attraction, as a lookup
+def summaryLookup(routeId, attractionId):
+    return {'route_id': routeId} if routeId is not None else {'attraction_id': attractionId}
+
+
+# adds (sign = 1) or removes (sign = -1) a single rating or flag from the summary of the rated
+# route or attraction; the counters are incremented in the database, rather than in Python,
+# so that concurrent ratings of the same route are never lost, and the mean is computed
+# through a separate statement, since MySQL assigns the columns of an UPDATE one by one,
+# using the values already assigned, unlike every other backend
+def applyRating(routeId, attractionId, ratingId, sign, create=True):
+    lookup = summaryLookup(routeId, attractionId)
+
+    with transaction.atomic():
+        # when removing a rating, the summary either exists, or is being deleted
+        # along with the route or the attraction, in which case it is not recreated
+        if create:
+            RatingSummary.objects.get_or_create(**lookup)
+
+        summaries = RatingSummary.objects.filter(**lookup)
+        # the summary is serialized along with the rated route or attraction
+        touch(Route.objects.filter(pk=routeId) if routeId is not None else Attraction.objects.filter(pk=attractionId))
+
+        if not isRating(ratingId):
+            summaries.update(flagCount=F('flagCount') + sign)
+            return
+
+        histogramField = histogramFields[ratingId]
+        summaries.update(**{histogramField: F(histogramField) + sign},
+                         ratingCount=F('ratingCount') + sign, ratingTotal=F('ratingTotal') + sign * ratingId)
+        summaries.update(ratingMean=meanExpression())
+
+
+def meanExpression():
+    return Case(When(ratingCount=0, then=Value(0.0)),
+                default=Cast('ratingTotal', FloatField()) / F('ratingCount'), output_field=FloatField())
+
+
+# recomputes the summaries of the routes or the attractions ('relationField') with the
+# given ids (all of them, by default) from their ratings, through a single aggregation;
+# needed for the ratings inserted through 'bulk_create', which sends no signals
+def rebuildSummaries(relationField, ids=None):
+    ratings = RatingFlag.objects.filter(**{relationField + '__isnull': False})
+    summaries = RatingSummary.objects.filter(**{relationField + '__isnull': False})
+
+    if ids is not None:
+        ratings = ratings.filter(**{relationField + '_id__in': ids})
+        summaries = summaries.filter(**{relationField + '_id__in': ids})
+
+    histogram = {field: Count('id', filter=Q(rating_id=ratingId)) for ratingId, field in histogramFields.items()}
+    rows = (ratings.order_by().values(relationField + '_id')
+            .annotate(**histogram, ratingCount=Count('id', filter=Q(rating_id__lte=maxRatingId)),
+                      ratingTotal=Sum('rating_id', filter=Q(rating_id__lte=maxRatingId)),
+                      flagCount=Count('id', filter=Q(rating_id__gt=maxRatingId))))
+
+    instances = []
+    for row in rows:
+        row['ratingTotal'] = row['ratingTotal'] or 0
+        row['ratingMean'] = row['ratingTotal'] / row['ratingCount'] if row['ratingCount'] else 0.0
+        instances.append(RatingSummary(**row))
+
+    rated = {'route': Route, 'attraction': Attraction}[relationField].objects.all()
+    if ids is not None:
+        rated = rated.filter(pk__in=ids)
+
+    with transaction.atomic():
+        summaries.delete()
+        RatingSummary.objects.bulk_create(instances, batch_size=1000)
+        touch(rated)
+
+    return len(instances)
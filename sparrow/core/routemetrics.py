@@ -0,0 +1,100 @@
+import numpy as np
+from django.utils import timezone
+from .geo import earthRadius
+from .models import isWithin, Route
+
+# the geometry of a route, through its attractions, in order, denormalized on the Route model
+metricFields = ['length', 'legs', 'minLat', 'minLon', 'maxLat', 'maxLon', 'centroidLat', 'centroidLon']
+
+
+def emptyMetrics():
+    return {'length': 0.0, 'legs': [], 'minLat': None, 'minLon': None, 'maxLat': None, 'maxLon': None,
+            'centroidLat': None, 'centroidLon': None}
+
+
+# haversine distances (in km) between every pair of consecutive points
+def legDistances(latitudes, longitudes):
+    latitudes, longitudes = np.radians(latitudes), np.radians(longitudes)
+    haversine = (np.sin(np.diff(latitudes) / 2) ** 2 +
+                 np.cos(latitudes[:-1]) * np.cos(latitudes[1:]) * np.sin(np.diff(longitudes) / 2) ** 2)
+
+    # rounding errors could otherwise place the argument of the arcsine slightly above 1
+    return 2 * earthRadius * np.arcsin(np.sqrt(np.clip(haversine, 0.0, 1.0)))
+
+
+# haversine distances (in km) between every pair of points, as a square matrix
+def distanceMatrix(latitudes, longitudes):
+    latitudes, longitudes = np.radians(latitudes), np.radians(longitudes)
+    haversine = (np.sin(np.subtract.outer(latitudes, latitudes) / 2) ** 2 +
+                 np.outer(np.cos(latitudes), np.cos(latitudes)) * np.sin(np.subtract.outer(longitudes, longitudes) / 2) ** 2)
+
+    return 2 * earthRadius * np.arcsin(np.sqrt(np.clip(haversine, 0.0, 1.0)))
+
+
+# the metrics of every given route, by id, computed in a single pass over the attractions of all
+# of them: the points are read through a single query, sorted by route and then by order, so that
+# the points of each route are contiguous, and every metric is computed for all the routes at once,
+# through NumPy's grouped reductions; the legs joining the last point of a route to the first one
+# of the next route are masked out, and the centroid is the mean of the points on the sphere,
+# rather than of their coordinates, so that it is not skewed by the antimeridian; the bounding
+# box is that of the coordinates, though
+def computeMetrics(routeIds):
+    metrics = {routeId: emptyMetrics() for routeId in routeIds}
+
+    points = (isWithin.objects.filter(route_id__in=metrics).order_by('route_id', 'orderNumber', 'id')
+              .values_list('route_id', 'attraction__latitude', 'attraction__longitude'))
+    points = np.array(list(points), dtype=float).reshape(-1, 3)
+
+    if not len(points):
+        return metrics
+
+    routes, latitudes, longitudes = points[:, 0].astype(np.int64), points[:, 1], points[:, 2]
+
+    # the index of the first point of every route, and the route (as an index into
+    # said starts) of every point
+    newRoute = np.concatenate(([True], routes[1:] != routes[:-1]))
+    starts = np.flatnonzero(newRoute)
+    groups = np.cumsum(newRoute) - 1
+
+    withinRoute = ~newRoute[1:]
+    legs = legDistances(latitudes, longitudes)[withinRoute]
+    legGroups = groups[1:][withinRoute]
+    lengths = np.bincount(legGroups, weights=legs, minlength=len(starts))
+    legsByRoute = np.split(legs, np.cumsum(np.bincount(legGroups, minlength=len(starts)))[:-1])
+
+    radLatitudes, radLongitudes = np.radians(latitudes), np.radians(longitudes)
+    vectors = np.column_stack((np.cos(radLatitudes) * np.cos(radLongitudes), np.cos(radLatitudes) * np.sin(radLongitudes),
+                               np.sin(radLatitudes)))
+    x, y, z = np.add.reduceat(vectors, starts).T
+    centroidLatitudes = np.degrees(np.arctan2(z, np.hypot(x, y)))
+    centroidLongitudes = np.degrees(np.arctan2(y, x))
+
+    bounds = [np.minimum.reduceat(latitudes, starts), np.minimum.reduceat(longitudes, starts),
+              np.maximum.reduceat(latitudes, starts), np.maximum.reduceat(longitudes, starts)]
+
+    for index, routeId in enumerate(routes[starts].tolist()):
+        metrics[routeId] = {
+            'length': round(float(lengths[index]), 3),
+            'legs': [round(leg, 3) for leg in legsByRoute[index].tolist()],
+            'minLat': float(bounds[0][index]),
+            'minLon': float(bounds[1][index]),
+            'maxLat': float(bounds[2][index]),
+            'maxLon': float(bounds[3][index]),
+            'centroidLat': float(centroidLatitudes[index]),
+            'centroidLon': float(centroidLongitudes[index]),
+        }
+
+    return metrics
+
+
+# recomputes and stores the metrics of the given routes, in batches, through a single
+# UPDATE per batch; the routes are marked as modified (see core.versioning)
+def updateMetrics(routeIds, batchSize=1000):
+    routeIds = list(dict.fromkeys(routeIds))
+
+    for index in range(0, len(routeIds), batchSize):
+        now = timezone.now()
+        routes = [Route(pk=routeId, updatedAt=now, **values) for routeId, values in computeMetrics(routeIds[index:index + batchSize]).items()]
+        Route.objects.bulk_update(routes, metricFields + ['updatedAt'])
+
+    return len(routeIds)
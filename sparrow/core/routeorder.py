@@ -0,0 +1,104 @@
+import time
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from .models import isWithin, Route
+from .placements import setPlacements
+from .routemetrics import distanceMatrix
+
+
+# the order in which the points are visited starting from the given one, always
+# moving on to the closest point not visited yet
+def nearestNeighbourOrder(distances, start):
+    unvisited = np.ones(len(distances), dtype=bool)
+    order = [start]
+    unvisited[start] = False
+
+    for step in range(len(distances) - 1):
+        candidates = np.where(unvisited, distances[order[-1]], np.inf)
+        order.append(int(np.argmin(candidates)))
+        unvisited[order[-1]] = False
+
+    return order
+
+
+# improves the path through 2-opt moves (reversing the segment between two legs, whenever joining
+# their ends the other way round is shorter) until none is left or the time budget runs out; the
+# path goes through a dummy point at zero distance from every other one at each end (or only at the
+# end, for a fixed start), so that the first and last points can change as well; for every leg,
+# the gains of the moves with every later leg are computed at once, and the best one is applied
+def twoOpt(distances, order, fixedStart, deadline):
+    size = len(distances)
+    padded = np.zeros((size + 1, size + 1))
+    padded[:size, :size] = distances
+    path = np.array(([] if fixedStart else [size]) + list(order) + [size])
+
+    improved = True
+    while improved and time.monotonic() < deadline:
+        improved = False
+
+        for first in range(len(path) - 3):
+            a, b = path[first], path[first + 1]
+            c, d = path[first + 2:-1], path[first + 3:]
+            gains = padded[a, b] + padded[c, d] - padded[a, c] - padded[b, d]
+            best = int(np.argmax(gains))
+
+            if gains[best] > 1e-9:
+                last = first + 2 + best
+                path[first + 1:last + 1] = path[first + 1:last + 1][::-1].copy()
+                improved = True
+
+    return [int(point) for point in path if point != size]
+
+
+def pathLength(distances, order):
+    return float(distances[order[:-1], order[1:]].sum()) if len(order) > 1 else 0.0
+
+
+# the shortest order (found heuristically) in which the attractions of the route can be visited,
+# either from the first one or, for a fixed start, from the starting point of the route, which is
+# then counted within the lengths; the order is applied when requested, within a single transaction
+# locking the route, so that no concurrent placement gets overwritten; the lengths are in km
+def optimizeOrder(routeId, fixedStart=False, apply=False):
+    with transaction.atomic():
+        routes = Route.objects.only('startingPointLat', 'startingPointLon')
+        route = (routes.select_for_update() if apply else routes).get(pk=routeId)
+        placements = list(isWithin.objects.filter(route_id=routeId).order_by('orderNumber', 'id')
+                          .values_list('attraction_id', 'attraction__latitude', 'attraction__longitude'))
+
+        attractionIds = [attractionId for attractionId, latitude, longitude in placements]
+        latitudes = [latitude for attractionId, latitude, longitude in placements]
+        longitudes = [longitude for attractionId, latitude, longitude in placements]
+
+        # the starting point is the last point of the matrix, placed first along the path
+        if fixedStart:
+            latitudes.append(float(route.startingPointLat))
+            longitudes.append(float(route.startingPointLon))
+
+        distances = distanceMatrix(np.array(latitudes, dtype=float), np.array(longitudes, dtype=float))
+        start = len(attractionIds) if fixedStart else 0
+        currentOrder = ([start] if fixedStart else []) + list(range(len(attractionIds)))
+
+        optimizedOrder = currentOrder
+        if len(attractionIds) > 1:
+            deadline = time.monotonic() + getattr(settings, 'ROUTE_OPTIMIZER_TIME_BUDGET', 1.0)
+            candidate = twoOpt(distances, nearestNeighbourOrder(distances, start), fixedStart, deadline)
+
+            if pathLength(distances, candidate) < pathLength(distances, currentOrder):
+                optimizedOrder = candidate
+
+        optimizedIds = [attractionIds[point] for point in optimizedOrder if point < len(attractionIds)]
+        length, optimizedLength = pathLength(distances, currentOrder), pathLength(distances, optimizedOrder)
+
+        applied = apply and optimizedIds != attractionIds
+        if applied:
+            setPlacements(routeId, optimizedIds)
+
+    return {
+        'attractions': optimizedIds,
+        'fixedStart': fixedStart,
+        'length': round(length, 3),
+        'optimizedLength': round(optimizedLength, 3),
+        'saved': round(length - optimizedLength, 3),
+        'applied': applied,
+    }
@@ -0,0 +1,93 @@
+import math
+import re
+import unicodedata
+from collections import Counter
+from django.db import transaction
+from django.db.models import FloatField, OuterRef, Q, Subquery, Sum
+from django.db.models.functions import Coalesce
+from .models import Route, Attraction, SearchToken
+
+# the indexed fields of every searchable model, along with their weights,
+# and the field of the SearchToken model pointing at said model
+indexedModels = {
+    Route: ('route', {'title': 3.0, 'description': 1.0}),
+    Attraction: ('attraction', {'name': 3.0, 'generalDescription': 1.0}),
+}
+
+minTokenLength = 2
+maxTokenLength = 50
+
+
+# lowercase, accent-folded words of the given text ('Brașov' -> 'brasov')
+def tokenize(text):
+    decomposed = unicodedata.normalize('NFKD', text or '')
+    folded = ''.join(character for character in decomposed if not unicodedata.combining(character)).lower()
+
+    return [word[:maxTokenLength] for word in re.findall(r'\w+', folded) if len(word) >= minTokenLength]
+
+
+# every token of an instance is weighted by the field it appears in and,
+# sub-linearly, by the number of times it appears there
+def buildTokens(instance):
+    relationField, weights = indexedModels[type(instance)]
+    tokenWeights = Counter()
+
+    for fieldName, fieldWeight in weights.items():
+        for token, frequency in Counter(tokenize(getattr(instance, fieldName))).items():
+            tokenWeights[token] += fieldWeight * (1 + math.log(frequency))
+
+    return [SearchToken(token=token, weight=weight, **{relationField: instance}) for token, weight in tokenWeights.items()]
+
+
+# replaces the tokens of a single instance; called whenever said instance is saved
+def reindex(instance):
+    relationField, weights = indexedModels[type(instance)]
+
+    with transaction.atomic():
+        SearchToken.objects.filter(**{relationField: instance}).delete()
+        SearchToken.objects.bulk_create(buildTokens(instance))
+
+
+# rebuilds the tokens of every instance of the given queryset, in batches
+def rebuildIndex(queryset, batchSize=1000):
+    relationField, weights = indexedModels[queryset.model]
+    lastId = 0
+    indexed = 0
+
+    while True:
+        batch = list(queryset.filter(pk__gt=lastId).order_by('pk').only('pk', *weights)[:batchSize])
+        if not batch:
+            return indexed
+
+        with transaction.atomic():
+            SearchToken.objects.filter(**{relationField + '__in': batch}).delete()
+            SearchToken.objects.bulk_create([token for instance in batch for token in buildTokens(instance)], batch_size=batchSize)
+
+        lastId = batch[-1].pk
+        indexed += len(batch)
+
+
+# restricts the queryset to the instances containing a token starting with every
+# search term and annotates them with their 'rank', namely the summed weights of
+# their matching tokens; every condition is an index range scan on the tokens
+def search(queryset, text):
+    relationField, weights = indexedModels[queryset.model]
+    terms = list(dict.fromkeys(tokenize(text)))
+
+    if not terms:
+        return queryset
+
+    indexed = SearchToken.objects.filter(**{relationField + '__isnull': False})
+
+    for term in terms:
+        matchingIds = indexed.filter(token__istartswith=term).values(relationField + '_id')
+        queryset = queryset.filter(pk__in=matchingIds)
+
+    anyTerm = Q()
+    for term in terms:
+        anyTerm |= Q(token__istartswith=term)
+
+    rank = (indexed.filter(anyTerm, **{relationField: OuterRef('pk')})
+            .values(relationField).annotate(total=Sum('weight')).values('total'))
+
+    return queryset.annotate(rank=Coalesce(Subquery(rank, output_field=FloatField()), 0.0))
@@ -3,11 +3,34 @@ from django.contrib.auth import authenticate
 from django.contrib.auth.models import User
 from django.contrib.auth.hashers import check_password
 from django.contrib.auth.password_validation import validate_password
-from django.core.files.storage import default_storage
-from django.conf import settings
+from django.db import transaction
 from .models import *
+from .authorization import getAuthorizationContext
+from .cache import referenceDataCache
+from .imaging import variantUrls
+from .jobs import enqueue
+from .mediastore import storeUpload
+from collections import Counter
 from datetime import date
-import uuid
+
+
+# primary key field of the reference data (Status, Tag & RatingFlagType), whose
+# instances are looked up in the reference data cache, rather than in the database
+class ReferenceDataField(serializers.PrimaryKeyRelatedField):
+    def to_internal_value(self, data):
+        if isinstance(data, bool):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+
+        instance = referenceDataCache.get(self.get_queryset().model, data)
+        if instance is None:
+            try:
+                int(data)
+            except (TypeError, ValueError):
+                self.fail('incorrect_type', data_type=type(data).__name__)
+
+            self.fail('does_not_exist', pk_value=data)
+
+        return instance
 
 
 # includes the email field and is, therefore, accessible
@@ -160,10 +183,14 @@ class RegisterMemberSerializer(serializers.ModelSerializer):
 
 class MemberSerializer(serializers.ModelSerializer):
     baseUser = UserSerializer()
+    profilePhotoVariants = serializers.SerializerMethodField()
 
     class Meta:
         model = Member
-        fields = ['baseUser', 'profilePhoto', 'birthDate']
+        fields = ['baseUser', 'profilePhoto', 'profilePhotoVariants', 'birthDate']
+
+    def get_profilePhotoVariants(self, obj):
+        return variantUrls(obj.profilePhoto.name, obj.profilePhotoVariants)
 
     # custom update method, for updating the related user
     # with the corresponding validated data, before updating
@@ -187,19 +214,28 @@ class MemberSerializer(serializers.ModelSerializer):
 
 class PrivateMemberSerializer(serializers.ModelSerializer):
     baseUser = PrivateUserSerializer(read_only=True)
+    profilePhotoVariants = serializers.SerializerMethodField()
 
     class Meta:
         model = Member
-        fields = ['baseUser', 'profilePhoto', 'birthDate']
+        fields = ['baseUser', 'profilePhoto', 'profilePhotoVariants', 'birthDate']
+
+    def get_profilePhotoVariants(self, obj):
+        return variantUrls(obj.profilePhoto.name, obj.profilePhotoVariants)
 
 
 # nested in related models and used for the list action
 class SmallAndListMemberSerializer(serializers.ModelSerializer):
     baseUser = SmallUserSerializer(read_only=True)
+    # lists should show the thumbnail, rather than the original photo
+    profilePhotoVariants = serializers.SerializerMethodField()
 
     class Meta:
         model = Member
-        fields = ['baseUser', 'profilePhoto']
+        fields = ['baseUser', 'profilePhoto', 'profilePhotoVariants']
+
+    def get_profilePhotoVariants(self, obj):
+        return variantUrls(obj.profilePhoto.name, obj.profilePhotoVariants)
 
 
 class SmallGroupSerializer(serializers.ModelSerializer):
@@ -220,10 +256,31 @@ class BelongsToSerializer(serializers.ModelSerializer):
         fields = ['id', 'user', 'group', 'isAdmin', 'nickname']
 
 
+# used for listing the members of a group
+class RosterSerializer(serializers.ModelSerializer):
+    user = SmallAndListMemberSerializer(read_only=True)
+
+    class Meta:
+        model = BelongsTo
+        fields = ['id', 'user', 'isAdmin', 'nickname']
+
+
+# the rating aggregates of a route or an attraction, nested in their serializers;
+# null for the routes and the attractions which were never rated or flagged
+class RatingSummarySerializer(serializers.ModelSerializer):
+    class Meta:
+        model = RatingSummary
+        fields = ['oneStar', 'twoStars', 'threeStars', 'fourStars', 'fiveStars', 'ratingCount', 'ratingMean', 'flagCount']
+
+
 class RouteSerializer(serializers.ModelSerializer):
+    ratingSummary = RatingSummarySerializer(read_only=True)
+
     class Meta:
         model = Route
-        fields = ['id', 'title', 'description', 'verified', 'public', 'startingPointLat', 'startingPointLon', 'publicationDate', 'user', 'group']
+        # the metrics of the route (see core.routemetrics) are read-only
+        fields = ['id', 'title', 'description', 'verified', 'public', 'startingPointLat', 'startingPointLon', 'publicationDate', 'user', 'group', 'ratingSummary',
+                  'length', 'legs', 'minLat', 'minLon', 'maxLat', 'maxLon', 'centroidLat', 'centroidLon']
         extra_kwargs = {'verified': {'read_only': True}, 'publicationDate': {'read_only': True}}
 
     # only one and exactly one of the two nullable fields (group, user) can be null at a time.
@@ -245,10 +302,15 @@ class RouteSerializer(serializers.ModelSerializer):
 class ListRouteSerializer(serializers.ModelSerializer):
     user = SmallAndListMemberSerializer()
     group = SmallGroupSerializer()
+    ratingSummary = RatingSummarySerializer(read_only=True)
+    # only present when the routes are looked up around a given point
+    distance = serializers.FloatField(read_only=True)
+    # only present when the routes are searched
+    rank = serializers.FloatField(read_only=True)
 
     class Meta:
         model = Route
-        fields = ['id', 'title', 'description', 'verified', 'startingPointLat', 'startingPointLon', 'publicationDate', 'user', 'group']
+        fields = ['id', 'title', 'description', 'verified', 'startingPointLat', 'startingPointLon', 'publicationDate', 'user', 'group', 'ratingSummary', 'length', 'distance', 'rank']
         extra_kwargs = {'publicationDate': {'read_only': True}}
 
 
@@ -264,16 +326,106 @@ class IsWithinSerializer(serializers.ModelSerializer):
         fields = ['id', 'route', 'attraction', 'orderNumber']
 
 
+# the ordered attractions of a route, placed at once (see core.placements)
+class RoutePlacementSerializer(serializers.Serializer):
+    attractions = serializers.ListField(child=serializers.IntegerField(min_value=1), allow_empty=True, max_length=1000)
+
+    def validate_attractions(self, value):
+        duplicates = sorted(attractionId for attractionId, count in Counter(value).items() if count > 1)
+        if duplicates:
+            raise serializers.ValidationError(f'Attractions placed more than once: {duplicates}.')
+
+        unknown = set(value) - set(Attraction.objects.filter(pk__in=value).values_list('pk', flat=True))
+        if unknown:
+            raise serializers.ValidationError(f'Unknown attractions: {sorted(unknown)}.')
+
+        return value
+
+
+# options of the route order optimizer (see core.routeorder)
+class RouteOrderSerializer(serializers.Serializer):
+    fixedStart = serializers.BooleanField(default=False)
+
+
 class SmallAttractionSerializer(serializers.ModelSerializer):
     class Meta:
         model = Attraction
         fields = ['id', 'name']
 
 
+# entries of the route and attraction rankings (top rated, most flagged)
+class RatedRouteSerializer(RatingSummarySerializer):
+    route = SmallRouteSerializer(read_only=True)
+
+    class Meta(RatingSummarySerializer.Meta):
+        fields = ['route'] + RatingSummarySerializer.Meta.fields
+
+
+class RatedAttractionSerializer(RatingSummarySerializer):
+    attraction = SmallAttractionSerializer(read_only=True)
+
+    class Meta(RatingSummarySerializer.Meta):
+        fields = ['attraction'] + RatingSummarySerializer.Meta.fields
+
+
 class AttractionSerializer(serializers.ModelSerializer):
+    ratingSummary = RatingSummarySerializer(read_only=True)
+    # only present when the attractions are looked up around a given point
+    distance = serializers.FloatField(read_only=True)
+    # only present when the attractions are searched
+    rank = serializers.FloatField(read_only=True)
+
     class Meta:
         model = Attraction
-        fields = ['id', 'name', 'generalDescription', 'latitude', 'longitude']
+        fields = ['id', 'name', 'generalDescription', 'latitude', 'longitude', 'ratingSummary', 'distance', 'rank']
+
+
+# an attraction placed within an expanded route, along with its tags (read from
+# the reference data cache), the variants of its images and its rating summary
+class PlacedAttractionSerializer(serializers.ModelSerializer):
+    ratingSummary = RatingSummarySerializer(read_only=True)
+    tags = serializers.SerializerMethodField()
+    images = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Attraction
+        fields = ['id', 'name', 'generalDescription', 'latitude', 'longitude', 'ratingSummary', 'tags', 'images']
+
+    def get_tags(self, obj):
+        tags = [referenceDataCache.get(Tag, entry.tag_id) for entry in obj.isTagged.all()]
+        return TagSerializer([tag for tag in tags if tag is not None], many=True).data
+
+    def get_images(self, obj):
+        return [{'id': image.id, **variantUrls(image.imagePath, image.variants)} for image in obj.image.all()]
+
+
+class PlacementSerializer(serializers.ModelSerializer):
+    attraction = PlacedAttractionSerializer(read_only=True)
+
+    class Meta:
+        model = isWithin
+        fields = ['id', 'orderNumber', 'attraction']
+
+
+# everything shown along with a route, so that it takes a single request: its owner,
+# its rating summary and its attractions, in order, read through a fixed number of queries
+class ExpandedRouteSerializer(serializers.ModelSerializer):
+    user = SmallAndListMemberSerializer(read_only=True)
+    group = SmallGroupSerializer(read_only=True)
+    ratingSummary = RatingSummarySerializer(read_only=True)
+    attractions = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Route
+        fields = ['id', 'title', 'description', 'verified', 'public', 'startingPointLat', 'startingPointLon', 'publicationDate',
+                  'user', 'group', 'ratingSummary', 'length', 'legs', 'minLat', 'minLon', 'maxLat', 'maxLon', 'centroidLat', 'centroidLon', 'attractions']
+        # the placements are read by 'get_attractions'
+        prefetch_related = ['isWithin__attraction__ratingSummary', 'isWithin__attraction__isTagged', 'isWithin__attraction__image']
+
+    # the prefetched placements are ordered in Python, so that they are reused
+    def get_attractions(self, obj):
+        placements = sorted(obj.isWithin.all(), key=lambda placement: (placement.orderNumber, placement.id))
+        return PlacementSerializer(placements, many=True, context=self.context).data
 
 
 class StatusSerializer(serializers.ModelSerializer):
@@ -289,6 +441,8 @@ class TagSerializer(serializers.ModelSerializer):
 
 
 class IsTaggedSerializer(serializers.ModelSerializer):
+    tag = ReferenceDataField(queryset=Tag.objects.all())
+
     class Meta:
         model = IsTagged
         fields = ['id', 'tag', 'attraction']
@@ -308,6 +462,7 @@ class ListNotebookSerializer(serializers.ModelSerializer):
 # db and on disk, and also deleting images when needed
 class ImageUploadSerializer(serializers.ModelSerializer):
     image = serializers.ImageField(write_only=True)
+    variants = serializers.SerializerMethodField()
 
     # the class constructor of this serializer stores the values of folder_name, notebook, attraction, 
     # and owner attributes for each image that is being created
@@ -321,62 +476,67 @@ class ImageUploadSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Image
-        fields = ['id', 'image', 'imagePath']
+        fields = ['id', 'image', 'imagePath', 'variants']
         read_only_fields=['imagePath']
 
+    def get_variants(self, obj):
+        return variantUrls(obj.imagePath, obj.variants)
+
     def create(self, validated_data):
         image = validated_data.pop('image')
 
-        # I am retrieving the extension of the file and generating a unique file name for the current file
-        file_extension = image.name.split('.')[-1]
-        generated_unique_filename = '{}.{}'.format(uuid.uuid4(), file_extension)
-
-        # the file_path variable is set to the merging of the destination folder_name 
-        # and the newly generated unique filename for the current file
-        self.file_path =  self.folder_name + generated_unique_filename
+        # save the uploaded image file to the media directory, under the hash of its content,
+        # within the destination folder_name; the file is written in chunks, and only if
+        # the same content was not uploaded before, in which case the stored file is shared
+        self.file_path = storeUpload(image, self.folder_name)
 
         validated_data['imagePath'] = self.file_path
         validated_data['notebook'] = self.notebook
         validated_data['attraction'] = self.attraction
         validated_data['owner'] = self.owner
 
-        # save the uploaded image file to the media directory
-        # I am uploading the files using chunks of data as this action can consume a lot of server resources, 
-        # so this aproach can help reduce memory usage and improve performance
-        # 'wb+' => reading and writting a file in binary
-        with default_storage.open(settings.MEDIA_ROOT + '/' + self.file_path, 'wb+') as destination:
-            for chunk in image.chunks():
-                destination.write(chunk)
+        # the image and the reference to its file are saved together
+        with transaction.atomic():
+            instance = super().create(validated_data)
+            instance.save()
 
-        instance = super().create(validated_data)
-        instance.save()
+        # the thumbnail, medium and (recompressed, EXIF-stripped) full size derivatives
+        # are rendered by a background job, while the original is served in the meantime
+        enqueue('renderImageVariants', imageId=instance.id)
         return instance
     
     # the delete method of the serializer is responsible for removing instances 
-    # from both the database and the corresponding folder where the image file is stored
+    # from both the database and the corresponding folder where the image file is stored;
+    # the file is only deleted along with its last reference, by a background job, which
+    # is queued along with the deletion of the instance and runs once it is committed
     def delete(self, instance):
-        try:
-            default_storage.delete(instance.imagePath)
-        except Exception as e:
-            raise ValidationError('Failed to delete image {}'.format(instance.imagePath))
-
-        instance.delete()
+        with transaction.atomic():
+            instance.delete()
 
 
 class NotebookSerializer(serializers.ModelSerializer):
+    status = ReferenceDataField(queryset=Status.objects.all())
     images = serializers.ListField(required=False)
     images_list = serializers.SerializerMethodField()
+    # the URLs of the derivatives of every image, so that clients
+    # do not have to download the originals to show thumbnails
+    images_variants = serializers.SerializerMethodField()
 
     class Meta:
         model = Notebook
-        fields = ['id', 'route', 'title', 'note', 'status', 'dateStarted', 'dateCompleted', 'images', 'images_list']
+        fields = ['id', 'route', 'title', 'note', 'status', 'dateStarted', 'dateCompleted', 'images', 'images_list', 'images_variants']
         extra_kwargs = {'dateStarted': {'read_only': True}, 'dateCompleted': {'read_only': True}}
+        # the images are read by 'get_images_list' and 'get_images_variants'
+        prefetch_related = ['image']
 
     # this method retrieves and returns a list of all the images 
-    # associated with the current instance of the Notebook class
+    # associated with the current instance of the Notebook class;
+    # the related manager is used, so that prefetched images are reused
     def get_images_list(self, obj):
-        images = Image.objects.filter(notebook=obj)
-        return [image.imagePath for image in images]
+        return [image.imagePath for image in obj.image.all()]
+
+    def get_images_variants(self, obj):
+        return [{'id': image.id, **variantUrls(image.imagePath, image.variants)} for image in obj.image.all()]
 
     def create(self, validated_data):
         request = self.context.get('request')
@@ -384,7 +544,7 @@ class NotebookSerializer(serializers.ModelSerializer):
         if not request:
             raise serializers.ValidationError({'request': 'Request related error'})
 
-        member = Member.objects.get(baseUser=request.user)
+        member = getAuthorizationContext(request).member
         # the user making the request gets associated with the current notebook-entry
         validated_data['user'] = member
 
@@ -415,11 +575,11 @@ class NotebookSerializer(serializers.ModelSerializer):
         if not request: 
             raise serializers.ValidationError({'request': 'Request related error'})
 
-        member = Member.objects.get(baseUser=request.user)
+        member = getAuthorizationContext(request).member
         validated_data['user'] = member
         
         # the previous status
-        old_status = instance.status.status
+        old_status = referenceDataCache.get(Status, instance.status_id).status
 
         # the completion date is updated only when the status is set to 'completed' from a previous state
         if validated_data['status'].status == 'Completed' and old_status != 'Completed':
@@ -445,6 +605,8 @@ class NotebookSerializer(serializers.ModelSerializer):
 
 
 class RatingFlagSerializer(serializers.ModelSerializer):
+    rating = ReferenceDataField(queryset=RatingFlagType.objects.all())
+
     class Meta:
         model = RatingFlag
         fields = ['id', 'user', 'rating', 'comment', 'route', 'attraction']
@@ -491,8 +653,7 @@ class RatingFlagSerializer(serializers.ModelSerializer):
 
         validated_data = {**self.validated_data, **kwargs}
 
-        currentUser = self.context['request'].user
-        validated_data['user'] = Member.objects.get(baseUser=currentUser)
+        validated_data['user'] = getAuthorizationContext(self.context['request']).member
 
         if self.instance is not None:
             self.instance = self.update(self.instance, validated_data)
@@ -1,12 +1,23 @@
 from django.core.management import call_command
-from django.db.models.signals import post_save,post_migrate,pre_delete
+from django.db import transaction
+from django.db.models.signals import post_save,post_migrate,pre_delete,post_delete,pre_save
 from django.dispatch import receiver
 from django.contrib.auth.models import User
 from django.dispatch import receiver
-from .models import Member, Status, Tag, RatingFlagType, Notebook, Image
+from .models import defaultProfilePhoto, Member, Status, Tag, RatingFlagType, Notebook, Image, BelongsTo, Group, Attraction, Route, RatingFlag, isWithin, IsTagged
+from .geo import encodeGeohash
+from .search import indexedModels, reindex
+from .ratings import applyRating
+from .imaging import getImageVariants, variantPath
+from .jobs import enqueue
+from .mediastore import releaseImages
+from .cache import membershipCache, referenceDataCache
+from .versioning import touch
+from .routemetrics import updateMetrics
+from .placements import placementSignalsSuspended
+from django.utils import timezone
 import os
 from django.conf import settings
-from django.core.exceptions import ValidationError
 
 
 # whenever 'post_save' (used to save instances to the database)
@@ -58,16 +69,177 @@ def create_media_subdirectories(sender, **kwargs):
                 os.makedirs(path)
 
 
-# this is a "cron job" implemented as a signal receiver, which is triggered when a Notebook instance is about to be deleted
-# it deletes all associated Image instances for the Notebook by iterating through them 
-# and removing their corresponding files from the media directory
-# if an error occurs while attempting to delete an image file, it raises a validation error with a message 
-# indicating the file that failed to delete
-@receiver(pre_delete, sender=Notebook)
-def sweep_notebook_associated_images(sender, instance, **kwargs):
-    images = Image.objects.filter(notebook=instance)
-    for image in images:
-        try:
-            os.remove(settings.MEDIA_ROOT + '/' + image.imagePath)
-        except OSError:
-            raise ValidationError('Failed to delete image {}'.format(image.imagePath))
+# releases the file of every deleted image (original and variants), which is shared by every
+# image with the same content, whichever way the image is deleted: on its own, or along with
+# its notebook, attraction or owner; the files left without any reference are removed from
+# the media directory by background jobs, which only run once the deletion is committed
+@receiver(post_delete, sender=Image)
+def releaseDeletedImage(sender, instance, **kwargs):
+    releaseImages([(instance.imagePath, instance.variants)])
+
+
+# the derivatives of a member's profile photo are rendered by a background job whenever
+# a new photo is saved, and dropped, along with the ones of the previous photo, when it
+# gets replaced or reset to the default one
+@receiver(post_save, sender=Member)
+def updateProfilePhotoVariants(sender, instance, raw=False, **kwargs):
+    photo = instance.profilePhoto.name
+    previousVariants = instance.profilePhotoVariants
+
+    if raw or photo == defaultProfilePhoto and not previousVariants:
+        return
+
+    if photo != defaultProfilePhoto and set(previousVariants.values()) == {variantPath(photo, name) for name in getImageVariants()}:
+        return
+
+    enqueue('renderProfilePhotoVariants', memberId=instance.pk)
+
+# the cached group memberships of a member are dropped whenever one of their
+# BelongsTo entries is created, modified or deleted (including the cascading
+# deletions of groups and members, which send this signal for every member,
+# so that deleting a group needs no receiver of its own); the entry is dropped
+# once more after the transaction commits, in case a concurrent request has
+# cached the memberships in between, before the modification became visible to it
+@receiver(post_save, sender=BelongsTo)
+@receiver(post_delete, sender=BelongsTo)
+def invalidateMemberships(sender, instance, **kwargs):
+    userId = instance.user_id
+    membershipCache.invalidateUser(userId)
+    transaction.on_commit(lambda: membershipCache.invalidateUser(userId))
+
+
+# the cached reference data is dropped whenever one of its rows is created (including
+# the seeded ones), modified or deleted, and once more after the transaction commits,
+# in case a concurrent request has cached the table in between
+@receiver(post_save, sender=Status)
+@receiver(post_save, sender=Tag)
+@receiver(post_save, sender=RatingFlagType)
+@receiver(post_delete, sender=Status)
+@receiver(post_delete, sender=Tag)
+@receiver(post_delete, sender=RatingFlagType)
+def invalidateReferenceData(sender, **kwargs):
+    referenceDataCache.invalidate(sender)
+    transaction.on_commit(lambda: referenceDataCache.invalidate(sender))
+
+
+# the geohashes used for spatial lookups are derived from the coordinates
+# right before saving; instances inserted through 'bulk_create' bypass
+# this receiver, so their geohashes have to be set beforehand
+@receiver(pre_save, sender=Attraction)
+def updateAttractionGeohash(sender, instance, **kwargs):
+    instance.geohash = encodeGeohash(float(instance.latitude), float(instance.longitude))
+
+
+@receiver(pre_save, sender=Route)
+def updateRouteGeohash(sender, instance, **kwargs):
+    instance.startingPointGeohash = encodeGeohash(float(instance.startingPointLat), float(instance.startingPointLon))
+
+
+# the search tokens of a route or an attraction are rebuilt whenever it is saved,
+# unless none of its indexed fields were among the updated ones; the tokens of
+# deleted instances are removed by the cascading deletion of their foreign key
+@receiver(post_save, sender=Route)
+@receiver(post_save, sender=Attraction)
+def updateSearchIndex(sender, instance, update_fields=None, **kwargs):
+    relationField, weights = indexedModels[sender]
+
+    if update_fields is not None and not set(update_fields) & set(weights):
+        return
+
+    reindex(instance)
+
+
+# the rating summaries follow every change of a rating or a flag: the previous values of
+# a modified instance are read right before saving it, so that they can be taken out of
+# the summary they were counted in (the route, the attraction or the type may change)
+@receiver(pre_save, sender=RatingFlag)
+def rememberPreviousRating(sender, instance, **kwargs):
+    instance.previousRating = None
+
+    if instance.pk is not None:
+        instance.previousRating = (RatingFlag.objects.filter(pk=instance.pk)
+                                   .values_list('route_id', 'attraction_id', 'rating_id').first())
+
+
+@receiver(post_save, sender=RatingFlag)
+def updateRatingSummary(sender, instance, created, **kwargs):
+    currentRating = (instance.route_id, instance.attraction_id, instance.rating_id)
+    previousRating = getattr(instance, 'previousRating', None)
+
+    if not created and previousRating is not None:
+        if previousRating == currentRating:
+            return
+
+        applyRating(*previousRating, -1, create=False)
+
+    applyRating(*currentRating, 1)
+
+
+# the summary of a deleted route or attraction is deleted along with
+# its ratings, so their cascading deletion does not have to update it
+@receiver(post_delete, sender=RatingFlag)
+def removeFromRatingSummary(sender, instance, origin=None, **kwargs):
+    if isinstance(origin, Route) and origin.pk == instance.route_id or \
+            isinstance(origin, Attraction) and origin.pk == instance.attraction_id:
+        return
+
+    applyRating(instance.route_id, instance.attraction_id, instance.rating_id, -1, create=False)
+
+
+# the modification time read by the conditional GET support (see core.versioning) is set
+# right before saving; the changes made through 'update' set it themselves (see 'touch')
+@receiver(pre_save, sender=Route)
+@receiver(pre_save, sender=Attraction)
+@receiver(pre_save, sender=Notebook)
+@receiver(pre_save, sender=Member)
+@receiver(pre_save, sender=Group)
+def updateModificationTime(sender, instance, raw=False, **kwargs):
+    if not raw:
+        instance.updatedAt = timezone.now()
+
+
+# the versions read by the conditional GET support (see core.versioning) cover the rows
+# serialized along with a notebook, a route or an attraction, as well as the ones its
+# lists are filtered or ordered by: the images of a notebook, and the placements and
+# tags of an attraction
+@receiver(post_save, sender=Image)
+@receiver(post_delete, sender=Image)
+def touchImageNotebook(sender, instance, raw=False, **kwargs):
+    if not raw and instance.notebook_id is not None:
+        touch(Notebook.objects.filter(pk=instance.notebook_id))
+
+
+@receiver(post_save, sender=isWithin)
+@receiver(post_delete, sender=isWithin)
+def touchPlacement(sender, instance, raw=False, **kwargs):
+    if not raw and not placementSignalsSuspended(instance.route_id):
+        touch(Route.objects.filter(pk=instance.route_id))
+        touch(Attraction.objects.filter(pk=instance.attraction_id))
+
+
+@receiver(post_save, sender=IsTagged)
+@receiver(post_delete, sender=IsTagged)
+def touchTaggedAttraction(sender, instance, raw=False, **kwargs):
+    if not raw:
+        touch(Attraction.objects.filter(pk=instance.attraction_id))
+
+
+# the metrics of a route (see core.routemetrics) are recomputed whenever one of its attractions
+# is placed, moved or removed, unless the route itself is being deleted, as well as whenever an
+# attraction is moved, for every route it is placed within; 'setPlacements' suspends these
+# receivers for the placements it inserts, renumbers and deletes, and recomputes them once
+@receiver(post_save, sender=isWithin)
+@receiver(post_delete, sender=isWithin)
+def updatePlacementMetrics(sender, instance, raw=False, origin=None, **kwargs):
+    if raw or isinstance(origin, Route) and origin.pk == instance.route_id or placementSignalsSuspended(instance.route_id):
+        return
+
+    updateMetrics([instance.route_id])
+
+
+@receiver(post_save, sender=Attraction)
+def updateAttractionRouteMetrics(sender, instance, created, raw=False, update_fields=None, **kwargs):
+    if raw or created or update_fields is not None and not {'latitude', 'longitude'} & set(update_fields):
+        return
+
+    updateMetrics(isWithin.objects.filter(attraction_id=instance.pk).values_list('route_id', flat=True))
@@ -0,0 +1,68 @@
+from django.core.files.storage import default_storage
+from django.utils import timezone
+from .models import defaultProfilePhoto, Image, Member, Notebook, StoredFile
+from .imaging import createVariants, deleteVariants
+from .jobs import jobHandler
+from .versioning import touch
+
+
+# the handlers of the background jobs, which move the disk-bound work out of the requests;
+# every handler tolerates running more than once, since a job is retried whenever it fails
+
+
+# the images deleted while their variants were being rendered drop said variants; the
+# images sharing their (content-addressed) file with another image reuse its variants;
+# the notebook listing the variants is marked as modified
+@jobHandler('renderImageVariants')
+def renderImageVariants(imageId):
+    image = Image.objects.filter(pk=imageId).first()
+    if image is None:
+        return
+
+    renderedVariants = [variants for variants in Image.objects.filter(imagePath=image.imagePath).values_list('variants', flat=True) if variants]
+    variants = renderedVariants[0] if renderedVariants else createVariants(image.imagePath)
+
+    if not Image.objects.filter(pk=imageId).update(variants=variants):
+        if not renderedVariants:
+            deleteVariants(variants)
+        return
+
+    touch(Notebook.objects.filter(pk=image.notebook_id))
+
+
+# renders the variants of the member's current profile photo, dropping the ones of their
+# previous photo; the variants of the default photo are not rendered
+@jobHandler('renderProfilePhotoVariants')
+def renderProfilePhotoVariants(memberId):
+    member = Member.objects.filter(pk=memberId).first()
+    if member is None:
+        return
+
+    photo = member.profilePhoto.name
+    previousVariants = member.profilePhotoVariants
+
+    # an unreadable photo keeps being served as is
+    try:
+        variants = {} if photo == defaultProfilePhoto else createVariants(photo)
+    except OSError:
+        variants = {}
+
+    Member.objects.filter(pk=memberId).update(profilePhotoVariants=variants, updatedAt=timezone.now())
+    deleteVariants({name: path for name, path in previousVariants.items() if path not in variants.values()})
+
+
+# the files of deleted images; already missing files are ignored by the storage
+@jobHandler('deleteFiles')
+def deleteFiles(paths):
+    for path in paths:
+        default_storage.delete(path)
+
+
+# the file released by the last image referencing it, along with its variants, unless
+# the same content was uploaded again (and therefore stored under the same path) since
+@jobHandler('deleteUnreferencedFile')
+def deleteUnreferencedFile(path, variants):
+    if StoredFile.objects.filter(path=path).exists() or Image.objects.filter(imagePath=path).exists():
+        return
+
+    deleteFiles([path, *variants])
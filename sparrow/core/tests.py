@@ -1,10 +1,46 @@
+import hashlib
+import io
+import os
+import shutil
+import tempfile
+from PIL import Image as PillowImage
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.core.management.base import CommandError
 from django.urls import reverse
+from django.utils import timezone
 from rest_framework import status
 from rest_framework.test import APITestCase
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.test import RequestFactory, override_settings
 from .models import *
+from .permissions import RouteIsPublic, RouteIsAuthorizedToMakeChanges
+from .authorization import AuthorizationContext, getAuthorizationContext
+from .cache import membershipCache, referenceDataCache
+from .queryplans import getQueryPlan
+from .middleware import endpointStats
+from .geo import encodeGeohash, haversine
+from .ratings import rebuildSummaries
+from .jobs import enqueue, jobHandler, jobHandlers
+from .imaging import createVariants, variantPath
+from .mediastore import contentPath, isSharded, shardedPath
+from .placements import setPlacements
+from .serializers import ListRouteSerializer, ListNotebookSerializer, NotebookSerializer
 
 
-class RouteTests(APITestCase):
+# the per-process caches outlive the transactions in which
+# each test runs, so they are emptied before every test
+class SparrowTestCase(APITestCase):
+    def setUp(self):
+        membershipCache.clear()
+        # the cached tables may hold the rows of the previous test, which were rolled back
+        referenceDataCache.clear()
+
+
+class RouteTests(SparrowTestCase):
     fixtures = ['testing-members.json', 'testing-groups.json', 'testing-belongsTo.json', 'testing-attractions.json', 'testing-routes.json']
 
     def testPermissions(self):
@@ -51,8 +87,1100 @@ class RouteTests(APITestCase):
         response = self.client.delete(detailThirdRouteURL)
         self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
 
+    def testListQueryCount(self):
+        """
+        Verify that the visibility filtering of the list action is done in the database, as follows:
+            - user test-3 issues a list request and the number of executed queries is recorded
+            - more routes are added (public, private, owned by the user's group and by another group)
+            - the list request is issued again => the number of queries is the same and only
+                the visible routes are returned
+        """
+
+        user = User.objects.get(pk=3)
+        self.client.force_login(user)
+        listRouteURL = reverse('core:route-list')
+
+        with CaptureQueriesContext(connection) as initialQueries:
+            response = self.client.get(listRouteURL, {'page_size': 100})
+        self.assertEqual(len(response.data['results']), 2)
+
+        for index in range(20):
+            Route.objects.create(title=f'public-{index}', description='', public=True, startingPointLat=0, startingPointLon=0, user_id=1)
+            Route.objects.create(title=f'private-{index}', description='', public=False, startingPointLat=0, startingPointLon=0, user_id=2)
+            Route.objects.create(title=f'group-1-{index}', description='', public=False, startingPointLat=0, startingPointLon=0, group_id=1)
+            Route.objects.create(title=f'group-2-{index}', description='', public=False, startingPointLat=0, startingPointLon=0, group_id=2)
+
+        with CaptureQueriesContext(connection) as finalQueries:
+            response = self.client.get(listRouteURL, {'page_size': 100})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        # the initial two routes, the new public ones and the ones owned by group-1
+        self.assertEqual(len(response.data['results']), 42)
+        self.assertEqual(len(finalQueries), len(initialQueries))
+
+    def testExpandedRoute(self):
+        """
+        Verify that the expanded route holds everything shown along with it, through a fixed number of queries, as follows:
+            - both attractions are placed within the first route, in reverse order, the second one being tagged,
+                pictured and rated => user test-3 retrieves the expanded route, whose attractions are in order,
+                with their tags, images and rating summaries, along with the owner and the route's rating summary
+            - more tagged and pictured attractions are placed within the route => the number of queries is the same
+            - user test-3 retrieves the expanded third route (private, owned by user test-1) => 403
+        """
+
+        setPlacements(1, [2, 1])
+        IsTagged.objects.create(attraction_id=2, tag_id=1)
+        Image.objects.create(imagePath='attraction_images/2.jpeg', attraction_id=2, owner_id=1)
+        RatingFlag.objects.create(user_id=1, rating_id=4, attraction_id=2)
+        RatingFlag.objects.create(user_id=2, rating_id=5, route_id=1)
+
+        self.client.force_login(User.objects.get(pk=3))
+        expandedRouteURL = reverse('core:route-expanded', args=[1])
+        self.client.get(reverse('core:tag-list'))
+
+        with CaptureQueriesContext(connection) as initialQueries:
+            response = self.client.get(expandedRouteURL)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['user']['baseUser']['id'], 1)
+        self.assertEqual(response.data['ratingSummary']['fiveStars'], 1)
+
+        attractions = [placement['attraction'] for placement in response.data['attractions']]
+        self.assertEqual([attraction['id'] for attraction in attractions], [2, 1])
+        self.assertEqual(attractions[0]['tags'], [{'id': 1, 'tagName': Tag.objects.get(pk=1).tagName}])
+        self.assertEqual([image['id'] for image in attractions[0]['images']], list(Image.objects.values_list('id', flat=True)))
+        self.assertEqual(attractions[0]['ratingSummary']['ratingMean'], 4)
+        self.assertIsNone(attractions[1]['ratingSummary'])
+
+        attractionIds = [2, 1]
+        for index in range(5):
+            attraction = Attraction.objects.create(name=f'attraction-{index}', generalDescription='', latitude=40, longitude=40)
+            IsTagged.objects.create(attraction=attraction, tag_id=index + 1)
+            Image.objects.create(imagePath=f'attraction_images/{attraction.id}.jpeg', attraction=attraction, owner_id=1)
+            attractionIds.append(attraction.id)
+        setPlacements(1, attractionIds)
+
+        with CaptureQueriesContext(connection) as finalQueries:
+            response = self.client.get(expandedRouteURL)
+        self.assertEqual([placement['attraction']['id'] for placement in response.data['attractions']], attractionIds)
+        self.assertEqual(len(finalQueries), len(initialQueries))
+
+        self.assertEqual(self.client.get(reverse('core:route-expanded', args=[3])).status_code, status.HTTP_403_FORBIDDEN)
+
+    def testKeysetPagination(self):
+        """
+        Verify that paging through the route list visits every visible route exactly once, in order, as follows:
+            - routes sharing the same publication date are added, so that the id is needed as a tiebreaker
+            - user test-3 follows the 'next' links, three routes per page => every visible route is returned once,
+                newest first, and the last page has no 'next' link
+            - user test-3 follows the 'previous' link of the last page => the second to last page is returned again
+            - an invalid cursor is rejected
+        """
+
+        publicationDate = timezone.now()
+        for index in range(7):
+            route = Route.objects.create(title=f'public-{index}', description='', public=True, startingPointLat=0, startingPointLon=0, user_id=1)
+            Route.objects.filter(pk=route.pk).update(publicationDate=publicationDate)
+
+        user = User.objects.get(pk=3)
+        self.client.force_login(user)
+
+        pages = []
+        response = self.client.get(reverse('core:route-list'), {'page_size': 3})
+        pages.append([route['id'] for route in response.data['results']])
+        while response.data['next']:
+            response = self.client.get(response.data['next'])
+            pages.append([route['id'] for route in response.data['results']])
+
+        expected = list(Route.objects.filter(public=True).order_by('-publicationDate', 'id').values_list('id', flat=True)) + [2]
+        self.assertEqual(sum(pages, []), expected)
+        self.assertEqual([len(page) for page in pages], [3, 3, 3])
+
+        response = self.client.get(response.data['previous'])
+        self.assertEqual([route['id'] for route in response.data['results']], pages[-2])
+
+        response = self.client.get(reverse('core:route-list'), {'cursor': 'invalid'})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def testRouteMetrics(self):
+        """
+        Verify that the metrics of a route follow its attractions and can be filtered and sorted by, as follows:
+            - three attractions are placed within the first route => its length is the sum of the distances between
+                consecutive attractions, and its bounding box and centroid enclose them
+            - the attractions are reordered, one of them is moved and one placement is deleted => the metrics are recomputed
+            - the second route has no attraction => its length is 0 and it has neither bounding box nor centroid
+            - user test-3 lists the routes by length, or the ones of at least 1 km => only the first route is that long
+        """
+
+        coordinates = [(40.0, 20.0), (41.0, 21.0), (40.5, 22.0)]
+        attractionIds = [Attraction.objects.create(name=f'attraction-{index}', generalDescription='', latitude=latitude, longitude=longitude).id
+                         for index, (latitude, longitude) in enumerate(coordinates)]
+        setPlacements(1, attractionIds)
+
+        def expectedLegs(points):
+            return [haversine(*first, *second) for first, second in zip(points, points[1:])]
+
+        route = Route.objects.get(pk=1)
+        self.assertAlmostEqual(route.length, sum(expectedLegs(coordinates)), places=2)
+        self.assertEqual(len(route.legs), 2)
+        self.assertEqual((route.minLat, route.minLon, route.maxLat, route.maxLon), (40.0, 20.0, 41.0, 22.0))
+        self.assertTrue(40.0 < route.centroidLat < 41.0 and 20.0 < route.centroidLon < 22.0)
+
+        setPlacements(1, attractionIds[::-1])
+        Attraction.objects.filter(pk=attractionIds[0]).update(latitude=45.0)
+        attraction = Attraction.objects.get(pk=attractionIds[0])
+        attraction.save()
+        isWithin.objects.get(route_id=1, attraction_id=attractionIds[1]).delete()
+
+        route = Route.objects.get(pk=1)
+        self.assertAlmostEqual(route.length, haversine(40.5, 22.0, 45.0, 20.0), places=2)
+        self.assertEqual(route.maxLat, 45.0)
+
+        route = Route.objects.get(pk=2)
+        self.assertEqual((route.length, route.legs, route.minLat, route.centroidLat), (0.0, [], None, None))
+
+        self.client.force_login(User.objects.get(pk=3))
+        response = self.client.get(reverse('core:route-list'), {'ordering': '-length'})
+        self.assertEqual([route['id'] for route in response.data['results']][0], 1)
+        response = self.client.get(reverse('core:route-list'), {'min_length': 1})
+        self.assertEqual([route['id'] for route in response.data['results']], [1])
+
+
+class AuthorizationContextTests(SparrowTestCase):
+    fixtures = ['testing-members.json', 'testing-groups.json', 'testing-belongsTo.json', 'testing-routes.json']
+
+    def testSingleMembershipQuery(self):
+        """
+        Verify that the group memberships of the user making the request are loaded at most once, as follows:
+            - the route permissions are checked for every route, on behalf of user test-3 => a single query is issued
+            - the results match the memberships of the user (member of group-1, but not an admin)
+        """
+
+        request = RequestFactory().get('/')
+        request.user = User.objects.get(pk=3)
+        routes = list(Route.objects.all())
+
+        with self.assertNumQueries(1):
+            visible = [RouteIsPublic().has_object_permission(request, None, route) for route in routes]
+            editable = [RouteIsAuthorizedToMakeChanges().has_object_permission(request, None, route) for route in routes]
+
+        self.assertEqual(visible, [True, True, False])
+        self.assertEqual(editable, [False, False, False])
+        self.assertEqual(getAuthorizationContext(request).memberships, {1: False})
+
+    def testCrossRequestCache(self):
+        """
+        Verify that the group memberships are cached across requests and invalidated whenever they change, as follows:
+            - the memberships of user test-3 are read through two separate contexts => a single query is issued
+            - user test-3 becomes an admin of group-1 => the cached entry is dropped and the change is visible
+            - group-1 is deleted => the cached entry is dropped and the user no longer belongs to any group
+        """
+
+        user = User.objects.get(pk=3)
+
+        initialHits = membershipCache.hits
+        with self.assertNumQueries(1):
+            self.assertEqual(AuthorizationContext(user).memberships, {1: False})
+            self.assertEqual(AuthorizationContext(user).memberships, {1: False})
+        self.assertEqual(membershipCache.hits, initialHits + 1)
+
+        entry = BelongsTo.objects.get(user_id=3, group_id=1)
+        entry.isAdmin = True
+        entry.save()
+        self.assertEqual(AuthorizationContext(user).memberships, {1: True})
+
+        Group.objects.get(pk=1).delete()
+        self.assertEqual(AuthorizationContext(user).memberships, {})
+
+
+class QueryPlanTests(SparrowTestCase):
+    fixtures = ['testing-members.json', 'testing-groups.json', 'testing-routes.json']
+
+    def testDerivedRelations(self):
+        """
+        Verify that the relations needed by a serializer are derived from its nested serializers and its Meta class:
+            - the route list serializer selects the owner, the owner's base user and the group
+            - the notebook serializer prefetches the images declared in its Meta class
+            - listing members issues the same number of queries, regardless of how many members there are
+        """
+
+        self.assertEqual(getQueryPlan(ListRouteSerializer), (['group', 'ratingSummary', 'user', 'user__baseUser'], []))
+        self.assertEqual(getQueryPlan(ListNotebookSerializer), (['route', 'status'], []))
+        self.assertEqual(getQueryPlan(NotebookSerializer), ([], ['image']))
+
+        user = User.objects.get(pk=1)
+        self.client.force_login(user)
+        listMemberURL = reverse('core:member-list')
+
+        with CaptureQueriesContext(connection) as initialQueries:
+            self.client.get(listMemberURL)
+
+        for index in range(5):
+            User.objects.create(username=f'member-{index}')
+
+        with CaptureQueriesContext(connection) as finalQueries:
+            response = self.client.get(listMemberURL)
+        self.assertEqual(response.data['count'], 8)
+        self.assertEqual(len(finalQueries), len(initialQueries))
+
+
+class StatsTests(SparrowTestCase):
+    fixtures = ['testing-members.json', 'testing-groups.json', 'testing-routes.json']
+
+    def testEndpointInstrumentation(self):
+        """
+        Verify that the query count of every endpoint is recorded and exposed only to staff, as follows:
+            - the recorded metrics are discarded and user test-1 lists the routes twice, with the instrumentation
+                and its headers enabled => the query count is returned in the headers of each response
+            - user test-1 lists the routes once more, with the instrumentation disabled => nothing is recorded
+            - user test-1 requests the collected metrics => forbidden, since they are not a staff member
+            - user test-1 becomes a staff member => the route list endpoint is reported with two requests
+        """
+
+        endpointStats.reset()
+        user = User.objects.get(pk=1)
+        self.client.force_login(user)
+
+        with self.settings(QUERY_INSTRUMENTATION=True, QUERY_INSTRUMENTATION_HEADERS=True):
+            for index in range(2):
+                with CaptureQueriesContext(connection) as queries:
+                    response = self.client.get(reverse('core:route-list'))
+                self.assertEqual(int(response['X-Query-Count']), len(queries))
+
+        with self.settings(QUERY_INSTRUMENTATION=False, QUERY_INSTRUMENTATION_HEADERS=True):
+            self.assertNotIn('X-Query-Count', self.client.get(reverse('core:route-list')))
+
+        statsURL = reverse('core:stats')
+        response = self.client.get(statsURL)
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+        user.is_staff = True
+        user.save()
+        response = self.client.get(statsURL)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['endpoints']['core:route-list:list']['requests'], 2)
+        self.assertIn('hits', response.data['membershipCache'])
+
+
+class GenerateDataTests(SparrowTestCase):
+    def testGeneratedCounts(self):
+        """
+        Verify that the dataset generator inserts the requested number of instances of every model,
+        along with a member for every generated user
+        """
+
+        call_command('generatedata', members=12, groups=3, group_size=4, attractions=10, routes=15, stops=3, tags=2,
+                     ratings=20, notebooks=5, images=2, prefix='generated', seed=1, stdout=io.StringIO())
+
+        self.assertEqual(Member.objects.filter(baseUser__username__startswith='generated-').count(), 12)
+        self.assertEqual(BelongsTo.objects.count(), 12)
+        self.assertEqual(Route.objects.count(), 15)
+        self.assertEqual(isWithin.objects.count(), 45)
+        self.assertEqual(IsTagged.objects.count(), 20)
+        self.assertEqual(RatingFlag.objects.count(), 20)
+        # the summaries of the bulk-inserted ratings are rebuilt afterwards
+        self.assertEqual(sum(summary.ratingCount + summary.flagCount for summary in RatingSummary.objects.all()), 20)
+        self.assertEqual(Image.objects.count(), 20)
+
+    def testMissingDependencies(self):
+        """
+        Verify that the dataset generator refuses the counts leaving some generated instances without their
+        owner or their route, as follows:
+            - no members are requested, along with the default number of routes => CommandError, nothing is inserted
+            - no routes are requested, along with the default number of notebooks => CommandError
+            - neither routes nor attractions are requested, along with ratings => CommandError
+        """
+
+        for counts in [{'members': 0}, {'routes': 0}, {'routes': 0, 'attractions': 0, 'notebooks': 0}]:
+            with self.assertRaises(CommandError):
+                call_command('generatedata', prefix='generated', stdout=io.StringIO(), **counts)
+
+        self.assertFalse(User.objects.filter(username__startswith='generated-').exists())
+
+
+class IsWithinTests(SparrowTestCase):
+    fixtures = ['testing-members.json', 'testing-groups.json', 'testing-belongsTo.json', 'testing-attractions.json', 'testing-routes.json']
+
+    def testListFiltering(self):
+        """
+        Verify that only the entries associated with routes visible to the user making the request are listed, as follows:
+            - both attractions are placed in each of the three routes
+            - user test-3 issues a list request => only the entries of the first route (public) and the
+                second route (owned by a group which the user belongs to) are shown
+            - user test-3 filters by the third route (private and owned by user-1) => nothing is shown
+        """
+
+        for routeId in [1, 2, 3]:
+            for attractionId in [1, 2]:
+                isWithin.objects.create(route_id=routeId, attraction_id=attractionId, orderNumber=attractionId)
+
+        user = User.objects.get(pk=3)
+        self.client.force_login(user)
+        listIsWithinURL = reverse('core:isWithin-list')
+
+        response = self.client.get(listIsWithinURL)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['count'], 4)
+        self.assertNotIn(3, [entry['route'] for entry in response.data['results']])
+
+        response = self.client.get(listIsWithinURL, {'route_id': 3})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['count'], 0)
+
+    def testBulkPlacement(self):
+        """
+        Verify that the attractions of a route are placed and reordered at once, as follows:
+            - user test-3 places attractions within the third route (private, owned by user test-1) => 403
+            - user test-1 places 3 attractions within it => they are numbered in order, through a single INSERT
+            - user test-1 places the second and third ones, in reverse order, along with a fourth one => the first one
+                is removed, the moved ones are renumbered through a single UPDATE and the fourth one is inserted
+            - an attraction is placed twice, or an unknown one is placed => 400, nothing changes
+            - user test-1 removes 3 attractions, then 4 attractions => the same number of queries is issued both times
+        """
+
+        for index in range(3, 5):
+            Attraction.objects.create(name=f'attraction-{index}', generalDescription='', latitude=40, longitude=40)
+
+        placementURL = reverse('core:route-attractions', args=[3])
+        self.client.force_login(User.objects.get(pk=3))
+        self.assertEqual(self.client.put(placementURL, {'attractions': [1, 2]}).status_code, status.HTTP_403_FORBIDDEN)
+
+        self.client.force_login(User.objects.get(pk=1))
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.put(placementURL, {'attractions': [3, 1, 2]})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([(entry['attraction'], entry['orderNumber']) for entry in response.data], [(3, 1), (1, 2), (2, 3)])
+        self.assertEqual(len([query for query in queries if query['sql'].startswith(f'INSERT INTO {connection.ops.quote_name("isWithin")}')]), 1)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.put(placementURL, {'attractions': [2, 3, 4]})
+        self.assertEqual([(entry['attraction'], entry['orderNumber']) for entry in response.data], [(2, 1), (3, 2), (4, 3)])
+        self.assertEqual(len([query for query in queries if query['sql'].startswith(f'UPDATE {connection.ops.quote_name("isWithin")}')]), 1)
+        self.assertFalse(isWithin.objects.filter(route_id=3, attraction_id=1).exists())
+
+        for attractions in [[2, 2], [2, 999]]:
+            self.assertEqual(self.client.put(placementURL, {'attractions': attractions}).status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(list(isWithin.objects.filter(route_id=3).order_by('orderNumber').values_list('attraction_id', flat=True)), [2, 3, 4])
+
+        with CaptureQueriesContext(connection) as initialQueries:
+            self.client.put(placementURL, {'attractions': []})
+        self.assertFalse(isWithin.objects.filter(route_id=3).exists())
+
+        self.client.put(placementURL, {'attractions': [1, 2, 3, 4]})
+        with CaptureQueriesContext(connection) as finalQueries:
+            self.client.put(placementURL, {'attractions': []})
+        self.assertFalse(isWithin.objects.filter(route_id=3).exists())
+        self.assertEqual(len(finalQueries), len(initialQueries))
+
+    def testRouteOrderOptimization(self):
+        """
+        Verify that the attractions of a route are reordered along the shortest path found, as follows:
+            - four attractions along a parallel are placed within the third route (private, owned by user test-1)
+                out of order => user test-3 cannot preview the optimized order (403)
+            - user test-1 previews it => the attractions are sorted from west to east, the saved distance is
+                reported, but nothing changes
+            - user test-1 previews it from the starting point of the route (east of every attraction) => the
+                attractions are sorted from east to west
+            - user test-1 applies it => the attractions are renumbered and the length of the route is the optimized one
+            - user test-1 applies it once more => nothing is saved nor applied
+        """
+
+        attractionIds = [Attraction.objects.create(name=f'attraction-{index}', generalDescription='', latitude=40, longitude=longitude).id
+                         for index, longitude in enumerate([20, 22, 21, 23])]
+        setPlacements(3, attractionIds)
+        Route.objects.filter(pk=3).update(startingPointLat=40, startingPointLon=24)
+        sortedIds = [attractionIds[index] for index in [0, 2, 1, 3]]
+
+        def pathLength(longitudes):
+            return sum(haversine(40, first, 40, second) for first, second in zip(longitudes, longitudes[1:]))
+
+        optimizationURL = reverse('core:route-optimized-order', args=[3])
+        self.client.force_login(User.objects.get(pk=3))
+        self.assertEqual(self.client.get(optimizationURL).status_code, status.HTTP_403_FORBIDDEN)
+
+        self.client.force_login(User.objects.get(pk=1))
+        response = self.client.get(optimizationURL)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['attractions'], sortedIds)
+        self.assertAlmostEqual(response.data['saved'], pathLength([20, 22, 21, 23]) - pathLength([20, 21, 22, 23]), places=2)
+        self.assertFalse(response.data['applied'])
+        self.assertEqual(list(isWithin.objects.filter(route_id=3).order_by('orderNumber').values_list('attraction_id', flat=True)), attractionIds)
+
+        response = self.client.get(optimizationURL, {'fixedStart': 'true'})
+        self.assertEqual(response.data['attractions'], sortedIds[::-1])
+        self.assertAlmostEqual(response.data['optimizedLength'], pathLength([24, 23, 22, 21, 20]), places=2)
+
+        response = self.client.post(optimizationURL)
+        self.assertTrue(response.data['applied'])
+        self.assertEqual(list(isWithin.objects.filter(route_id=3).order_by('orderNumber').values_list('attraction_id', flat=True)), sortedIds)
+        self.assertAlmostEqual(Route.objects.get(pk=3).length, response.data['optimizedLength'], places=2)
+
+        response = self.client.post(optimizationURL)
+        self.assertEqual((response.data['saved'], response.data['applied']), (0, False))
+
+
+class NotebookTests(SparrowTestCase):
+    fixtures = ['testing-members.json', 'testing-groups.json', 'testing-routes.json']
+
+    def createNotebook(self, imageCount):
+        notebook = Notebook.objects.create(route_id=1, user_id=1, status_id=1, title='notebook', note='')
+
+        for index in range(imageCount):
+            Image.objects.create(imagePath=f'notebook_images/{notebook.id}-{index}.jpeg', notebook=notebook, owner_id=1)
+
+        return notebook
+
+    def testFixedQueryCount(self):
+        """
+        Verify that listing and retrieving notebooks issues the same number of queries, regardless of how many
+        notebooks and images there are, as follows:
+            - the list and retrieve requests are issued for a single notebook with a single image
+            - more notebooks with more images are added => the same requests issue the same number of queries,
+                and every image is still returned
+        """
+
+        user = User.objects.get(pk=1)
+        self.client.force_login(user)
+        listNotebookURL = reverse('core:notebook-list')
+        notebook = self.createNotebook(1)
+
+        with CaptureQueriesContext(connection) as initialListQueries:
+            self.client.get(listNotebookURL)
+        with CaptureQueriesContext(connection) as initialDetailQueries:
+            self.client.get(reverse('core:notebook-detail', args=[notebook.id]))
+
+        for index in range(5):
+            notebook = self.createNotebook(4)
+
+        with CaptureQueriesContext(connection) as finalListQueries:
+            response = self.client.get(listNotebookURL)
+        self.assertEqual(len(response.data['results']), 6)
+        self.assertEqual(len(finalListQueries), len(initialListQueries))
+
+        with CaptureQueriesContext(connection) as finalDetailQueries:
+            response = self.client.get(reverse('core:notebook-detail', args=[notebook.id]))
+        self.assertEqual(len(response.data['images_list']), 4)
+        self.assertEqual(len(finalDetailQueries), len(initialDetailQueries))
+
+
+class AttractionTests(SparrowTestCase):
+    fixtures = ['testing-members.json', 'testing-attractions.json']
+
+    def testProximityLookups(self):
+        """
+        Verify that attractions can be looked up around a point and within a bounding box, as follows:
+            - attractions are added along a meridian, one every ~11 km north of (45, 25)
+            - the attractions within 50 km of (45, 25) are requested, two per page => the five closest ones
+                are returned, sorted by their distance, across three pages
+            - the attractions within a box around the fixture attractions are requested => only those two are returned
+            - an invalid radius is rejected
+            - the geohashes are cleared through 'update' => the attractions are left out of the box until
+                the 'rebuildgeohashes' command recomputes them
+        """
+
+        for index in range(10):
+            Attraction.objects.create(name=f'attraction-{index}', generalDescription='', latitude=45 + index * 0.1, longitude=25)
+
+        self.assertEqual(Attraction.objects.get(name='attraction-0').geohash, encodeGeohash(45, 25))
+
+        user = User.objects.get(pk=1)
+        self.client.force_login(user)
+        listAttractionURL = reverse('core:attraction-list')
+
+        results = []
+        response = self.client.get(listAttractionURL, {'near': '45,25', 'radius': 50, 'page_size': 2})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        results += response.data['results']
+        while response.data['next']:
+            response = self.client.get(response.data['next'])
+            results += response.data['results']
+
+        self.assertEqual([attraction['name'] for attraction in results], [f'attraction-{index}' for index in range(5)])
+        for attraction in results:
+            self.assertAlmostEqual(attraction['distance'], haversine(45, 25, attraction['latitude'], 25), places=3)
+
+        response = self.client.get(listAttractionURL, {'bbox': '39.5,39.5,41.5,41.5'})
+        self.assertEqual([attraction['id'] for attraction in response.data['results']], [1, 2])
+        self.assertNotIn('distance', response.data['results'][0])
+
+        response = self.client.get(listAttractionURL, {'near': '45,25', 'radius': -1})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
 
-class GroupTests(APITestCase):
+        Attraction.objects.update(geohash='')
+        self.assertEqual(self.client.get(listAttractionURL, {'bbox': '39.5,39.5,41.5,41.5'}).data['results'], [])
+        call_command('rebuildgeohashes', stdout=io.StringIO())
+        response = self.client.get(listAttractionURL, {'bbox': '39.5,39.5,41.5,41.5'})
+        self.assertEqual([attraction['id'] for attraction in response.data['results']], [1, 2])
+
+    def testIndexedSearch(self):
+        """
+        Verify that attractions are searched through the inverted index, as follows:
+            - 'brasov' is searched => the attraction whose name holds 'Brașov' is returned first,
+                followed by the one only mentioning it in its description
+            - 'Bras cast' is searched => only the attraction holding words starting with both terms is returned
+            - the description of an attraction is updated => the attraction is found by its new description
+            - a single character or only punctuation is searched => no term is left, every attraction is returned
+        """
+
+        Attraction.objects.create(name='Old Town', generalDescription='Close to Brașov', latitude=45.6, longitude=25.6)
+        castle = Attraction.objects.create(name='Brașov castle', generalDescription='A castle', latitude=45.6, longitude=25.6)
+
+        user = User.objects.get(pk=1)
+        self.client.force_login(user)
+        listAttractionURL = reverse('core:attraction-list')
+
+        response = self.client.get(listAttractionURL, {'search': 'brasov'})
+        self.assertEqual([attraction['name'] for attraction in response.data['results']], ['Brașov castle', 'Old Town'])
+        self.assertGreater(response.data['results'][0]['rank'], response.data['results'][1]['rank'])
+
+        response = self.client.get(listAttractionURL, {'search': 'Bras cast'})
+        self.assertEqual([attraction['name'] for attraction in response.data['results']], ['Brașov castle'])
+
+        castle.generalDescription = 'A medieval fortress'
+        castle.save(update_fields=['generalDescription'])
+        response = self.client.get(listAttractionURL, {'search': 'medieval'})
+        self.assertEqual([attraction['id'] for attraction in response.data['results']], [castle.id])
+
+        for text in ['a', '!!']:
+            response = self.client.get(listAttractionURL, {'search': text})
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(len(response.data['results']), Attraction.objects.count())
+
+
+class RatingSummaryTests(SparrowTestCase):
+    fixtures = ['testing-members.json', 'testing-groups.json', 'testing-belongsTo.json', 'testing-attractions.json', 'testing-routes.json']
+
+    def testSummaryUpdates(self):
+        """
+        Verify that the rating summaries follow every change of the ratings, as follows:
+            - user test-3 rates the first route with four stars and flags it, user test-2 rates it with two stars
+                => the summary of the route holds both ratings (mean 3) and the flag
+            - user test-3 changes their rating to five stars => the histogram and the mean change accordingly
+            - user test-3 deletes their rating => only the rating of user test-2 remains
+            - the summaries are rebuilt from the ratings => nothing changes
+        """
+
+        user = User.objects.get(pk=3)
+        self.client.force_login(user)
+        listRatingFlagURL = reverse('core:ratingFlag-list')
+        detailRouteURL = reverse('core:route-detail', args=[1])
+
+        response = self.client.post(listRatingFlagURL, {'rating': 4, 'route': 1, 'comment': 'nice'})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        ratingId = response.data['id']
+        self.client.post(listRatingFlagURL, {'rating': 8, 'route': 1})
+        RatingFlag.objects.create(user_id=2, rating_id=2, route_id=1)
+
+        summary = self.client.get(detailRouteURL).data['ratingSummary']
+        self.assertEqual((summary['twoStars'], summary['fourStars'], summary['ratingCount'], summary['flagCount']), (1, 1, 2, 1))
+        self.assertEqual(summary['ratingMean'], 3)
+
+        detailRatingURL = reverse('core:ratingFlag-detail', args=[ratingId])
+        response = self.client.put(detailRatingURL, {'rating': 5, 'route': 1, 'comment': 'great'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        summary = self.client.get(detailRouteURL).data['ratingSummary']
+        self.assertEqual((summary['fourStars'], summary['fiveStars'], summary['ratingCount']), (0, 1, 2))
+        self.assertEqual(summary['ratingMean'], 3.5)
+
+        self.client.delete(detailRatingURL)
+        summary = self.client.get(detailRouteURL).data['ratingSummary']
+        self.assertEqual((summary['fiveStars'], summary['ratingCount'], summary['flagCount']), (0, 1, 1))
+        self.assertEqual(summary['ratingMean'], 2)
+
+        rebuildSummaries('route')
+        self.assertEqual(self.client.get(detailRouteURL).data['ratingSummary'], summary)
+
+    def testRankings(self):
+        """
+        Verify that the rankings only hold visible, rated or flagged instances, in order, as follows:
+            - every route is rated, the second one (owned by group-1) best and the third one (private) with
+                five stars => user test-3 sees the second and the first route in the top rated ones
+            - the first route is flagged => it is the only one among the most flagged routes
+            - an attraction is rated => it is the only top rated attraction
+        """
+
+        RatingFlag.objects.create(user_id=1, rating_id=3, route_id=1)
+        RatingFlag.objects.create(user_id=2, rating_id=4, route_id=1)
+        RatingFlag.objects.create(user_id=1, rating_id=5, route_id=2)
+        RatingFlag.objects.create(user_id=1, rating_id=5, route_id=3)
+        RatingFlag.objects.create(user_id=2, rating_id=9, route_id=1)
+        RatingFlag.objects.create(user_id=2, rating_id=2, attraction_id=2)
+
+        user = User.objects.get(pk=3)
+        self.client.force_login(user)
+
+        response = self.client.get(reverse('core:route-top-rated'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([entry['route']['id'] for entry in response.data['results']], [2, 1])
+        self.assertEqual(response.data['results'][1]['ratingMean'], 3.5)
+
+        response = self.client.get(reverse('core:route-top-rated'), {'min_ratings': 2})
+        self.assertEqual([entry['route']['id'] for entry in response.data['results']], [1])
+
+        response = self.client.get(reverse('core:route-most-flagged'))
+        self.assertEqual([(entry['route']['id'], entry['flagCount']) for entry in response.data['results']], [(1, 1)])
+
+        response = self.client.get(reverse('core:attraction-top-rated'))
+        self.assertEqual([entry['attraction']['id'] for entry in response.data['results']], [2])
+
+
+class ReferenceDataTests(SparrowTestCase):
+    fixtures = ['testing-members.json', 'testing-groups.json', 'testing-attractions.json', 'testing-routes.json']
+
+    def testReferenceDataCache(self):
+        """
+        Verify that the reference data is served from the per-process cache, as follows:
+            - the tag list is retrieved twice => the second (paginated) response is identical, without
+                querying the tag table, and the filtered list is still read from the database
+            - the statuses are listed, then a status is retrieved => served from the cache, while an unknown one gets a 404
+            - a completed notebook is created and set back to "Started" => the statuses are not queried
+            - a status is renamed => the list reflects the change at once
+        """
+
+        self.client.force_login(User.objects.get(pk=1))
+        listTagURL = reverse('core:tag-list')
+
+        expected = self.client.get(listTagURL).content
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(listTagURL)
+        self.assertEqual(response.content, expected)
+        self.assertFalse(any(connection.ops.quote_name('tag') in query['sql'] for query in queries))
+        self.assertEqual(response.json()['count'], Tag.objects.count())
+        self.assertEqual(self.client.get(f'{listTagURL}?page=2').json()['results'],
+                         [{'id': tag.id, 'tagName': tag.tagName} for tag in Tag.objects.order_by('tagName')[10:20]])
+        self.assertEqual(self.client.get(f'{listTagURL}?isTagged__attraction_id=1').json()['count'], 0)
+
+        self.client.get(reverse('core:status-list'))
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get(reverse('core:status-detail', args=[3])).data, {'id': 3, 'status': 'Completed'})
+        self.assertFalse(any(connection.ops.quote_name('status') in query['sql'] for query in queries))
+        self.assertEqual(self.client.get(reverse('core:status-detail', args=[999])).status_code, status.HTTP_404_NOT_FOUND)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(reverse('core:notebook-list'), {'route': 1, 'title': 'trip', 'note': 'notes', 'status': 3})
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+            detailNotebookURL = reverse('core:notebook-detail', args=[response.data['id']])
+            response = self.client.put(detailNotebookURL, {'route': 1, 'title': 'trip', 'note': 'notes', 'status': 1})
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertFalse(any(f'FROM {connection.ops.quote_name("status")}' in query['sql'] for query in queries))
+        self.assertIsNone(Notebook.objects.get(pk=response.data['id']).dateCompleted)
+
+        status1 = Status.objects.get(pk=1)
+        status1.status = 'Planned'
+        status1.save()
+        self.assertIn({'id': 1, 'status': 'Planned'}, self.client.get(reverse('core:status-list')).json()['results'])
+
+
+class ConditionalGetTests(SparrowTestCase):
+    fixtures = ['testing-members.json', 'testing-groups.json', 'testing-belongsTo.json', 'testing-attractions.json', 'testing-routes.json']
+
+    def testConditionalRequests(self):
+        """
+        Verify that unchanged routes and attractions are answered with a 304 after a single query, as follows:
+            - user test-3 retrieves the first route => ETag and Last-Modified are set
+            - the route is retrieved again, with its ETag or its modification date => 304, after a single query
+            - the route is rated => its ETag changes
+            - the attraction list is retrieved, without any aggregate over the table, then retrieved again with its
+                ETag => 304, after reading the page and its version; more attractions are added => same number of queries
+            - an attraction is placed within a route, then deleted from the list's filter => the ETag changes both times
+            - the owner of a listed route changes their profile => the route list's ETag changes
+            - another user retrieves the attraction list with the ETag of test-3 => 200
+        """
+
+        user = User.objects.get(pk=3)
+        self.client.force_login(user)
+        detailRouteURL = reverse('core:route-detail', args=[1])
+
+        response = self.client.get(detailRouteURL)
+        etag = response['ETag']
+        self.assertIn('Last-Modified', response)
+
+        for headers in [{'HTTP_IF_NONE_MATCH': etag}, {'HTTP_IF_MODIFIED_SINCE': response['Last-Modified']}]:
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(detailRouteURL, **headers)
+            self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+            # the session and the user, then the version of the route
+            self.assertEqual(len(queries), 3)
+
+        self.client.post(reverse('core:ratingFlag-list'), {'rating': 4, 'route': 1})
+        response = self.client.get(detailRouteURL, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+
+        listAttractionURL = reverse('core:attraction-list')
+        with CaptureQueriesContext(connection) as queries:
+            etag = self.client.get(listAttractionURL)['ETag']
+        self.assertFalse(any('COUNT(' in query['sql'] or 'MAX(' in query['sql'] for query in queries))
+
+        for batch in range(2):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(listAttractionURL, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+            # the session and the user, then the page and its version
+            self.assertEqual(len(queries), 4)
+
+            for index in range(30):
+                Attraction.objects.create(name=f'attraction-{batch}-{index}', generalDescription='', latitude=40, longitude=40)
+            etag = self.client.get(listAttractionURL)['ETag']
+
+        filteredURL = f'{listAttractionURL}?isWithin__route_id=2'
+        filteredETag = self.client.get(filteredURL)['ETag']
+        placement = isWithin.objects.create(route_id=2, attraction_id=1, orderNumber=100)
+        self.assertNotEqual(self.client.get(listAttractionURL, HTTP_IF_NONE_MATCH=etag).status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertNotEqual(self.client.get(filteredURL)['ETag'], filteredETag)
+
+        filteredETag = self.client.get(filteredURL)['ETag']
+        placement.delete()
+        self.assertNotEqual(self.client.get(filteredURL)['ETag'], filteredETag)
+
+        listRouteURL = reverse('core:route-list')
+        etag = self.client.get(listRouteURL)['ETag']
+        Member.objects.get(pk=1).save()
+        self.assertEqual(self.client.get(listRouteURL, HTTP_IF_NONE_MATCH=etag).status_code, status.HTTP_200_OK)
+
+        etag = self.client.get(listAttractionURL)['ETag']
+        self.client.force_login(User.objects.get(pk=2))
+        self.assertEqual(self.client.get(listAttractionURL, HTTP_IF_NONE_MATCH=etag).status_code, status.HTTP_200_OK)
+
+
+# every test runs against its own, temporary media directory,
+# created before and deleted after it
+class ImageTests(SparrowTestCase):
+    fixtures = ['testing-members.json', 'testing-groups.json', 'testing-routes.json']
+
+    def setUp(self):
+        super().setUp()
+        mediaSettings = self.settings(MEDIA_ROOT=tempfile.mkdtemp())
+        mediaSettings.enable()
+        self.addCleanup(mediaSettings.disable)
+        # usually created after migrating
+        os.makedirs(os.path.join(settings.MEDIA_ROOT, 'notebook_images'), exist_ok=True)
+
+    def tearDown(self):
+        shutil.rmtree(settings.MEDIA_ROOT, ignore_errors=True)
+
+    def createUpload(self, name, size, mode='RGB', **saveOptions):
+        content = io.BytesIO()
+        PillowImage.new(mode, size, 'red').save(content, 'JPEG' if mode == 'RGB' else 'PNG', **saveOptions)
+        return SimpleUploadedFile(name, content.getvalue())
+
+    # the stored files, relative to the media directory, throughout its subdirectories
+    def listFiles(self):
+        return sorted(os.path.relpath(os.path.join(directory, name), settings.MEDIA_ROOT)
+                      for directory, subdirectories, names in os.walk(settings.MEDIA_ROOT) for name in names)
+
+    def testVariants(self):
+        """
+        Verify that the derivatives of every uploaded image are rendered and exposed, as follows:
+            - a notebook is created with a large, EXIF-tagged photo (rotated through its orientation tag)
+                and a transparent PNG => the originals are listed in place of the variants, which are not rendered yet
+            - the background jobs are run => three JPEG variants are stored for each image, the thumbnail fitting
+                within 256 pixels, the full size keeping the (rotated) dimensions, and none of them holding EXIF data
+            - the notebook is retrieved => the variant URLs of both images are listed
+            - an image is deleted => its files are deleted once the background jobs are run
+        """
+
+        user = User.objects.get(pk=1)
+        self.client.force_login(user)
+
+        exif = PillowImage.Exif()
+        exif[0x0112] = 6    # rotated by 90 degrees
+        photo = self.createUpload('photo.jpeg', (1600, 1200), exif=exif.tobytes())
+        drawing = self.createUpload('drawing.png', (300, 100), mode='RGBA')
+
+        response = self.client.post(reverse('core:notebook-list'), {'route': 1, 'title': 'trip', 'note': 'photos', 'status': 1,
+                                                                     'images': [photo, drawing]}, format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        detailNotebookURL = reverse('core:notebook-detail', args=[response.data['id']])
+
+        response = self.client.get(detailNotebookURL)
+        self.assertEqual([variants['thumbnail'] for variants in response.data['images_variants']],
+                         [default_storage.url(path) for path in response.data['images_list']])
+
+        call_command('runjobs', workers=0, once=True)
+        images = list(Image.objects.order_by('id'))
+        self.assertEqual([sorted(image.variants) for image in images], [['full', 'medium', 'thumbnail']] * 2)
+
+        for image in images:
+            for path in image.variants.values():
+                with default_storage.open(path, 'rb') as file:
+                    variant = PillowImage.open(file)
+                    self.assertEqual(variant.format, 'JPEG')
+                    self.assertEqual(len(variant.getexif()), 0)
+
+        with default_storage.open(images[0].variants['full'], 'rb') as file:
+            self.assertEqual(PillowImage.open(file).size, (1200, 1600))
+        with default_storage.open(images[0].variants['thumbnail'], 'rb') as file:
+            self.assertEqual(PillowImage.open(file).size, (192, 256))
+
+        response = self.client.get(detailNotebookURL)
+        self.assertEqual([variants['thumbnail'] for variants in response.data['images_variants']],
+                         [default_storage.url(image.variants['thumbnail']) for image in images])
+
+        response = self.client.delete(reverse('core:image-detail', args=[images[0].id]))
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertTrue(default_storage.exists(images[0].imagePath))
+
+        call_command('runjobs', workers=0, once=True)
+        self.assertFalse(any(default_storage.exists(path) for path in [images[0].imagePath, *images[0].variants.values()]))
+        self.assertTrue(default_storage.exists(images[1].imagePath))
+
+    def testDeduplication(self):
+        """
+        Verify that identical uploads share a single, content-addressed file, as follows:
+            - the same photo is uploaded to two notebooks => both images reference a single file, named
+                after the hash of its content, whose reference count is 2, and the variants are shared
+            - the first notebook is deleted => the file is kept, with a single reference left
+            - an attraction image references the file, then the attraction is deleted => the image is deleted
+                in cascade, and its reference is dropped as well
+            - the image of the second notebook is deleted => the file and its variants are deleted
+        """
+
+        user = User.objects.get(pk=1)
+        self.client.force_login(user)
+        listNotebookURL = reverse('core:notebook-list')
+        content = self.createUpload('photo.jpeg', (640, 480)).read()
+
+        notebookIds = []
+        for index in range(2):
+            response = self.client.post(listNotebookURL, {'route': 1, 'title': f'trip-{index}', 'note': 'photos', 'status': 1,
+                                                          'images': [SimpleUploadedFile(f'photo-{index}.jpeg', content)]}, format='multipart')
+            notebookIds.append(response.data['id'])
+
+        call_command('runjobs', workers=0, once=True)
+
+        images = list(Image.objects.order_by('id'))
+        storedFile = StoredFile.objects.get()
+        self.assertEqual({image.imagePath for image in images}, {storedFile.path})
+        contentHash = hashlib.sha256(content).hexdigest()
+        self.assertEqual(storedFile.path, f'notebook_images/{contentHash[:2]}/{contentHash[2:4]}/{contentHash}.jpeg')
+        self.assertEqual(storedFile.referenceCount, 2)
+        self.assertEqual(images[0].variants, images[1].variants)
+        self.assertEqual(len(self.listFiles()), 4)
+
+        self.client.delete(reverse('core:notebook-detail', args=[notebookIds[0]]))
+        call_command('runjobs', workers=0, once=True)
+        self.assertEqual(StoredFile.objects.get().referenceCount, 1)
+        self.assertTrue(all(default_storage.exists(path) for path in [storedFile.path, *images[1].variants.values()]))
+
+        attraction = Attraction.objects.create(name='castle', generalDescription='', latitude=45, longitude=25)
+        Image.objects.create(imagePath=storedFile.path, variants=images[1].variants, attraction=attraction, owner_id=1)
+        StoredFile.objects.update(referenceCount=2)
+        attraction.delete()
+        call_command('runjobs', workers=0, once=True)
+        self.assertEqual(StoredFile.objects.get().referenceCount, 1)
+        self.assertTrue(default_storage.exists(storedFile.path))
+
+        self.client.delete(reverse('core:image-detail', args=[images[1].id]))
+        call_command('runjobs', workers=0, once=True)
+        self.assertFalse(StoredFile.objects.exists())
+        self.assertEqual(self.listFiles(), [])
+
+    def testSharding(self):
+        """
+        Verify that the images stored in the flat layout are moved into the sharded one, as follows:
+            - two images share a flat file with rendered variants, a third one is already sharded
+                => the shared file and its variants are moved, both images and the stored file referencing
+                the new paths, while the sharded image is left as is
+            - the command is run again => nothing is moved
+            - an interrupted run left the file linked under both paths => the migration is completed
+        """
+
+        notebook = Notebook.objects.create(route_id=1, user_id=1, status_id=1, title='trip', note='photos')
+        flatPath = 'notebook_images/legacy.jpeg'
+        default_storage.save(flatPath, self.createUpload('legacy.jpeg', (320, 240)))
+        variants = createVariants(flatPath)
+        StoredFile.objects.create(contentHash='0' * 64, path=flatPath, size=default_storage.size(flatPath), referenceCount=2)
+        sharedImages = [Image.objects.create(imagePath=flatPath, variants=variants, notebook=notebook, owner_id=1) for index in range(2)]
+
+        shardedImage = Image.objects.create(imagePath=shardedPath('notebook_images/other.jpeg'), notebook=notebook, owner_id=1)
+        default_storage.save(shardedImage.imagePath, self.createUpload('other.jpeg', (32, 32)))
+
+        call_command('shardmedia', batch_size=2, stdout=io.StringIO())
+        newPath = shardedPath(flatPath)
+        self.assertTrue(isSharded(newPath))
+        self.assertEqual({Image.objects.get(pk=image.pk).imagePath for image in sharedImages}, {newPath})
+        self.assertEqual(Image.objects.get(pk=sharedImages[0].pk).variants, {name: variantPath(newPath, name) for name in variants})
+        self.assertEqual(StoredFile.objects.get().path, newPath)
+        self.assertEqual(Image.objects.get(pk=shardedImage.pk).imagePath, shardedImage.imagePath)
+        self.assertEqual(self.listFiles(), sorted([shardedImage.imagePath, newPath, *(variantPath(newPath, name) for name in variants)]))
+
+        output = io.StringIO()
+        call_command('shardmedia', stdout=output)
+        self.assertIn('Done, 0 files moved.', output.getvalue())
+
+        interruptedPath = 'notebook_images/interrupted.jpeg'
+        default_storage.save(interruptedPath, self.createUpload('interrupted.jpeg', (32, 32)))
+        os.makedirs(os.path.dirname(default_storage.path(shardedPath(interruptedPath))))
+        os.link(default_storage.path(interruptedPath), default_storage.path(shardedPath(interruptedPath)))
+        interruptedImage = Image.objects.create(imagePath=interruptedPath, notebook=notebook, owner_id=1)
+
+        call_command('shardmedia', start_after=shardedImage.pk, stdout=io.StringIO())
+        self.assertEqual(Image.objects.get(pk=interruptedImage.pk).imagePath, shardedPath(interruptedPath))
+        self.assertFalse(default_storage.exists(interruptedPath))
+        self.assertTrue(default_storage.exists(shardedPath(interruptedPath)))
+
+    def testSweeping(self):
+        """
+        Verify that the orphaned media files are swept, as follows:
+            - the media directory holds a referenced image (along with its variants), a member's photo, the default
+                photo, an orphaned image (along with its variants), a replaced photo and a recent, orphaned upload
+                => a dry run reports the 5 old orphans, without touching them
+            - the orphaned image still has a stored file, left behind with a reference count which never dropped
+                => it is reported all the same
+            - the orphans are quarantined => they are moved to the quarantine and the stale stored file is
+                deleted, while the recent upload is kept
+            - the grace period is disabled => the recent upload is deleted too, and its size reported
+        """
+
+        notebook = Notebook.objects.create(route_id=1, user_id=1, status_id=1, title='trip', note='photos')
+        for path in ['notebook_images/kept.jpeg', 'notebook_images/orphan.png', 'profile-photos/current.jpeg',
+                     'profile-photos/replaced.jpeg', defaultProfilePhoto, 'notebook_images/recent.jpeg']:
+            default_storage.save(path, self.createUpload('image.jpeg', (64, 64)))
+
+        keptVariants = createVariants('notebook_images/kept.jpeg')
+        orphanVariants = createVariants('notebook_images/orphan.png')
+        Image.objects.create(imagePath='notebook_images/kept.jpeg', variants=keptVariants, notebook=notebook, owner_id=1)
+        Member.objects.filter(pk=1).update(profilePhoto='profile-photos/current.jpeg')
+
+        StoredFile.objects.create(contentHash='0' * 64, path='notebook_images/orphan.png', size=0, referenceCount=1)
+        orphans = ['notebook_images/orphan.png', *orphanVariants.values(), 'profile-photos/replaced.jpeg']
+        for path in self.listFiles():
+            if path != 'notebook_images/recent.jpeg':
+                os.utime(default_storage.path(path), (0, 0))
+
+        output = io.StringIO()
+        call_command('sweepmedia', dry_run=True, batch_size=3, stdout=output)
+        self.assertEqual(sorted(output.getvalue().splitlines()[:-1]), sorted(orphans))
+        self.assertIn('Scanned 12 files, 5 orphaned', output.getvalue())
+        self.assertEqual(len(self.listFiles()), 12)
+        self.assertTrue(StoredFile.objects.exists())
+
+        quarantine = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, quarantine)
+        orphanSize = sum(default_storage.size(path) for path in orphans)
+        output = io.StringIO()
+        call_command('sweepmedia', quarantine=quarantine, batch_size=3, stdout=output)
+        self.assertIn(f'5 orphaned, {orphanSize} bytes reclaimed', output.getvalue())
+        self.assertTrue(all(os.path.exists(os.path.join(quarantine, path)) for path in orphans))
+        self.assertFalse(StoredFile.objects.exists())
+        self.assertEqual(self.listFiles(), sorted(['notebook_images/kept.jpeg', *keptVariants.values(), defaultProfilePhoto,
+                                                   'profile-photos/current.jpeg', 'notebook_images/recent.jpeg']))
+
+        recentSize = default_storage.size('notebook_images/recent.jpeg')
+        output = io.StringIO()
+        call_command('sweepmedia', grace_period=0, stdout=output)
+        self.assertIn(f'1 orphaned, {recentSize} bytes reclaimed', output.getvalue())
+        self.assertFalse(default_storage.exists('notebook_images/recent.jpeg'))
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class MediaServingTests(SparrowTestCase):
+    def setUp(self):
+        super().setUp()
+        self.content = bytes(range(256)) * 4
+        self.contentHash = hashlib.sha256(self.content).hexdigest()
+        self.imagePath = default_storage.save(contentPath('notebook_images/', self.contentHash, '.jpeg'), io.BytesIO(self.content))
+        self.photoPath = default_storage.save('profile-photos/photo.jpeg', io.BytesIO(self.content))
+
+    def tearDown(self):
+        shutil.rmtree(settings.MEDIA_ROOT, ignore_errors=True)
+
+    def testConditionalAndRangeRequests(self):
+        """
+        Verify that the media files are served with validators, cache headers and ranges, as follows:
+            - a content-addressed image is requested => it is served whole, with its hash as the ETag
+                and an immutable cache header, while a profile photo has to be revalidated
+            - the image is requested again with its ETag, or with its modification date => 304, without content
+            - ranges are requested => the first 10 bytes, the last 100 bytes and the rest of the file from the
+                1000th byte are served (206); a range beyond the end of the file is unsatisfiable (416),
+                and a range with an outdated 'If-Range' validator gets the whole file
+            - a missing file and a path outside of the media directory are requested => 404
+            - the transfer is handed off to nginx => the response carries no content, only the internal redirect
+        """
+
+        imageURL = reverse('media', args=[self.imagePath])
+        response = self.client.get(imageURL)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(b''.join(response.streaming_content), self.content)
+        self.assertEqual(response['ETag'], f'"{self.contentHash}"')
+        self.assertEqual(response['Content-Type'], 'image/jpeg')
+        self.assertEqual(response['Cache-Control'], 'public, max-age=31536000, immutable')
+        self.assertEqual(self.client.get(reverse('media', args=[self.photoPath]))['Cache-Control'], 'public, no-cache')
+
+        for headers in [{'HTTP_IF_NONE_MATCH': response['ETag']}, {'HTTP_IF_MODIFIED_SINCE': response['Last-Modified']}]:
+            notModified = self.client.get(imageURL, **headers)
+            self.assertEqual(notModified.status_code, status.HTTP_304_NOT_MODIFIED)
+            self.assertEqual(notModified.content, b'')
+
+        for requestedRange, expected in [('bytes=0-9', (0, 9)), ('bytes=-100', (924, 1023)), ('bytes=1000-', (1000, 1023))]:
+            partial = self.client.get(imageURL, HTTP_RANGE=requestedRange)
+            self.assertEqual(partial.status_code, status.HTTP_206_PARTIAL_CONTENT)
+            self.assertEqual(b''.join(partial.streaming_content), self.content[expected[0]:expected[1] + 1])
+            self.assertEqual(partial['Content-Range'], f'bytes {expected[0]}-{expected[1]}/1024')
+
+        unsatisfiable = self.client.get(imageURL, HTTP_RANGE='bytes=2000-')
+        self.assertEqual(unsatisfiable.status_code, status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE)
+        self.assertEqual(unsatisfiable['Content-Range'], 'bytes */1024')
+        self.assertEqual(self.client.get(imageURL, HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE='"outdated"').status_code, status.HTTP_200_OK)
+
+        self.assertEqual(self.client.get(reverse('media', args=['notebook_images/missing.jpeg'])).status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(self.client.get(reverse('media', args=['../secret'])).status_code, status.HTTP_404_NOT_FOUND)
+
+        with self.settings(MEDIA_SENDFILE='x-accel-redirect'):
+            offloaded = self.client.get(imageURL)
+            self.assertEqual(offloaded['X-Accel-Redirect'], f'/protected-media/{self.imagePath}')
+            self.assertEqual(offloaded.content, b'')
+            self.assertEqual(offloaded['ETag'], f'"{self.contentHash}"')
+
+
+class JobTests(SparrowTestCase):
+    def setUp(self):
+        super().setUp()
+        self.calls = []
+
+        @jobHandler('testJob')
+        def testJob(value):
+            self.calls.append(value)
+            if value == 'failing':
+                raise ValueError(value)
+
+    def tearDown(self):
+        jobHandlers.pop('testJob')
+
+    def testRetriesAndDeadLetters(self):
+        """
+        Verify that the background jobs are run, retried and dead-lettered, as follows:
+            - a succeeding and a failing job are queued => the succeeding job is run once and deleted,
+                while the failing one is queued again, to be retried later
+            - the failing job becomes due again, twice => it is dead-lettered after its third attempt,
+                along with the error it raised
+            - the dead-lettered jobs are queued again => the job is run once more
+        """
+
+        with self.settings(JOB_MAX_ATTEMPTS=3):
+            enqueue('testJob', value='succeeding')
+            failingJob = enqueue('testJob', value='failing')
+
+        call_command('runjobs', workers=0, once=True)
+        self.assertEqual(self.calls, ['succeeding', 'failing'])
+        failingJob.refresh_from_db()
+        self.assertEqual((failingJob.status, failingJob.attempts), (Job.QUEUED, 1))
+        self.assertGreater(failingJob.runAfter, timezone.now())
+
+        for index in range(2):
+            Job.objects.filter(pk=failingJob.pk).update(runAfter=timezone.now())
+            call_command('runjobs', workers=0, once=True)
+
+        failingJob.refresh_from_db()
+        self.assertEqual((failingJob.status, failingJob.attempts), (Job.DEAD, 3))
+        self.assertIn('ValueError: failing', failingJob.lastError)
+        self.assertEqual(Job.objects.count(), 1)
+
+        call_command('runjobs', requeue_dead=True, stdout=io.StringIO())
+        call_command('runjobs', workers=0, once=True)
+        self.assertEqual(self.calls, ['succeeding'] + ['failing'] * 4)
+
+
+class GroupTests(SparrowTestCase):
     fixtures = ['testing-members.json']
 
     def testBelongsToUponGroupCreation(self):
@@ -74,7 +1202,7 @@ class GroupTests(APITestCase):
         self.assertIn({'id': 5, 'user': 3, 'group': 3, 'isAdmin': True, 'nickname': None}, response.data['results'])
 
 
-class MemberTests(APITestCase):
+class MemberTests(SparrowTestCase):
     fixtures = ['testing-members.json']
 
     def testProfilePhotoAndAccountRemoval(self):
@@ -112,7 +1240,7 @@ class MemberTests(APITestCase):
         self.assertEqual(deletedUser, None)
 
 
-class BelongsToTests(APITestCase):
+class BelongsToTests(SparrowTestCase):
     fixtures = ['testing-members.json', 'testing-groups.json', 'testing-belongsTo.json']
 
     def testCorrectListFiltering(self):
@@ -131,8 +1259,38 @@ class BelongsToTests(APITestCase):
         self.assertEqual(len(response.data['results']), 3)
         self.assertNotIn({'user': 2, 'group': 2, 'isAdmin': True}, response.data['results'])
 
+        # a user which belongs to no group gets an empty list
+        BelongsTo.objects.filter(user_id=3).delete()
+        self.client.force_login(User.objects.get(pk=3))
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['results']), 0)
+
+    def testGroupMembersPagination(self):
+        """
+        Verify that the members of a group can be browsed page by page, as follows:
+            - user test-1 requests the members of group-1, two per page => the first two members are returned,
+                along with a cursor to the next page, which contains the third member
+            - user test-1 requests the members of group-2 => forbidden, since they do not belong to it
+        """
+
+        user = User.objects.get(pk=1)
+        self.client.force_login(user)
+
+        response = self.client.get(reverse('core:group-members', args=[1]), {'page_size': 2})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([entry['user']['baseUser']['id'] for entry in response.data['results']], [1, 2])
+        self.assertIsNotNone(response.data['next'])
+
+        response = self.client.get(response.data['next'])
+        self.assertEqual([entry['user']['baseUser']['id'] for entry in response.data['results']], [3])
+        self.assertIsNone(response.data['next'])
+
+        response = self.client.get(reverse('core:group-members', args=[2]))
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
 
-class IsTaggedTests(APITestCase):
+class IsTaggedTests(SparrowTestCase):
     fixtures = ['testing-members.json', 'testing-attractions.json']
 
     def testConcurrentTagging(self):
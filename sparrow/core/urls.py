@@ -18,6 +18,27 @@ routeDetail = RouteViewSet.as_view({
     'delete': 'destroy'
 })
 
+routeTopRated = RouteViewSet.as_view({
+    'get': 'topRated'
+})
+
+routeMostFlagged = RouteViewSet.as_view({
+    'get': 'mostFlagged'
+})
+
+routeExpanded = RouteViewSet.as_view({
+    'get': 'expanded'
+})
+
+routeAttractions = RouteViewSet.as_view({
+    'put': 'placeAttractions'
+})
+
+routeOptimizedOrder = RouteViewSet.as_view({
+    'get': 'optimizedOrder',
+    'post': 'optimizedOrder'
+})
+
 
 groupList = GroupViewSet.as_view({
     'get': 'list',
@@ -31,6 +52,10 @@ groupDetail = GroupViewSet.as_view({
     'delete': 'destroy'
 })
 
+groupMembers = GroupViewSet.as_view({
+    'get': 'members'
+})
+
 
 memberList = MemberViewSet.as_view({
     'get': 'list',
@@ -58,17 +83,25 @@ login = LoginViewSet.as_view({
 
 logout = LogoutView.as_view()
 
+stats = StatsView.as_view()
+
 
 attractionList = AttractionViewSet.as_view({
     'get': 'list',
     'post': 'create'
 })
 
+# attractions can only be created and viewed
 attractionDetail = AttractionViewSet.as_view({
     'get': 'retrieve',
-    'put': 'update',
-    'patch': 'partial_update',
-    'delete': 'destroy',
+})
+
+attractionTopRated = AttractionViewSet.as_view({
+    'get': 'topRated'
+})
+
+attractionMostFlagged = AttractionViewSet.as_view({
+    'get': 'mostFlagged'
 })
 
 
@@ -162,6 +195,8 @@ urlpatterns = [
     path('auth/login/', login, name='login'),
     path('auth/logout/', logout, name='logout'),
 
+    path('stats/', stats, name='stats'),
+
     path('member/list/', memberList, name='member-list'),
     path('member/detail/<int:pk>/', memberDetail, name='member-detail'),
     path('member/change-password/<int:pk>/', changePassword, name='member-change-password'),
@@ -169,12 +204,20 @@ urlpatterns = [
     
     path('group/list/', groupList, name='group-list'),
     path('group/detail/<int:pk>/', groupDetail, name='group-detail'),
+    path('group/members/<int:pk>/', groupMembers, name='group-members'),
     
     path('attraction/list/', attractionList, name='attraction-list'),
     path('attraction/detail/<int:pk>/', attractionDetail, name='attraction-detail'),
+    path('attraction/top-rated/', attractionTopRated, name='attraction-top-rated'),
+    path('attraction/most-flagged/', attractionMostFlagged, name='attraction-most-flagged'),
     
     path('route/list/', routeList, name='route-list'),
     path('route/detail/<int:pk>/', routeDetail, name='route-detail'),
+    path('route/detail/<int:pk>/expanded/', routeExpanded, name='route-expanded'),
+    path('route/detail/<int:pk>/attractions/', routeAttractions, name='route-attractions'),
+    path('route/detail/<int:pk>/optimized-order/', routeOptimizedOrder, name='route-optimized-order'),
+    path('route/top-rated/', routeTopRated, name='route-top-rated'),
+    path('route/most-flagged/', routeMostFlagged, name='route-most-flagged'),
 
     path('belongsTo/list/', belongsToList, name="belongsTo-list"),
     path('belongsTo/detail/<int:pk>/', belongsToDetail, name='belongsTo-detail'),
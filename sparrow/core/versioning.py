@@ -0,0 +1,83 @@
+from django.db.models import F
+from django.shortcuts import get_object_or_404
+from django.utils import timezone
+from django.utils.cache import get_conditional_response
+from django.utils.crypto import md5
+from django.utils.http import http_date
+from rest_framework.response import Response
+
+
+# marks the instances of the queryset as modified, for the changes made through
+# 'update' (or to the related rows serialized along with them), which 'auto_now' misses
+def touch(queryset):
+    return queryset.update(updatedAt=timezone.now())
+
+
+# conditional GET support for the 'list' and 'retrieve' actions of a viewset: the version of the
+# response is read from the 'updatedAt' columns of the instances and of the related instances
+# serialized along with them ('versionFields'), through a single query, and a request whose
+# 'If-None-Match' (or, for a single instance, 'If-Modified-Since') still matches said version
+# gets a 304, before anything is serialized; the ETag also depends on the user making the
+# request and on the full URL (filters, cursor), which select what is listed; a list is
+# versioned by the page actually served, namely the ids of its instances (which catch the
+# added and deleted ones), their modifications and the links to the neighbouring pages, so
+# that its cost depends on the page size rather than on the size of the table; since the
+# deleted instances cannot be dated, 'If-Modified-Since' is only answered for single instances
+class ConditionalGetMixin:
+    versionFields = ['updatedAt']
+
+    def getVersionFields(self):
+        return self.versionFields
+
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        page = self.paginate_queryset(queryset)
+        instances = list(queryset) if page is None else page
+
+        versionFields = self.getVersionFields()
+        rows = queryset.model.objects.filter(pk__in=[instance.pk for instance in instances]).values_list('pk', *versionFields)
+        versions = {row[0]: row[1:] for row in rows}
+
+        version = {'page': [(instance.pk, versions.get(instance.pk)) for instance in instances]}
+        for index in range(len(versionFields)):
+            modifications = [values[index] for values in versions.values() if values[index] is not None]
+            version[f'version{index}'] = max(modifications, default=None)
+
+        if page is not None:
+            version['links'] = (self.paginator.get_next_link(), self.paginator.get_previous_link())
+
+        return self.conditionalResponse(request, version, False, lambda: self.listResponse(page, instances))
+
+    def listResponse(self, page, instances):
+        serializer = self.get_serializer(instances, many=True)
+        return self.get_paginated_response(serializer.data) if page is not None else Response(serializer.data)
+
+    # the instance is loaded without any eager loading, only to check the permissions
+    # of the user making the request and read its version
+    def retrieve(self, request, *args, **kwargs):
+        lookupUrlKwarg = self.lookup_url_kwarg or self.lookup_field
+        versionFields = self.getVersionFields()
+        queryset = self.get_queryset().annotate(**{f'version{index}': F(field) for index, field in enumerate(versionFields)})
+
+        instance = get_object_or_404(queryset, **{self.lookup_field: self.kwargs[lookupUrlKwarg]})
+        self.check_object_permissions(request, instance)
+        version = {f'version{index}': getattr(instance, f'version{index}') for index in range(len(versionFields))}
+
+        return self.conditionalResponse(request, version, True, lambda: super(ConditionalGetMixin, self).retrieve(request, *args, **kwargs))
+
+    def conditionalResponse(self, request, version, answersModifiedSince, respond):
+        modifications = [value for key, value in version.items() if key.startswith('version') and value is not None]
+        lastModified = int(max(modifications).timestamp()) if modifications else None
+
+        etag = '"%s"' % md5(repr((request.user.pk, request.get_full_path(), request.accepted_renderer.format,
+                                  sorted(version.items()))).encode(), usedforsecurity=False).hexdigest()
+
+        response = get_conditional_response(request, etag=etag, last_modified=lastModified if answersModifiedSince else None)
+        if response is None:
+            response = respond()
+
+        response['ETag'] = etag
+        if lastModified is not None:
+            response['Last-Modified'] = http_date(lastModified)
+
+        return response
@@ -3,62 +3,196 @@ from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework.decorators import action
 from rest_framework import status, mixins
-from rest_framework.permissions import IsAuthenticated, AllowAny
+from django_filters.rest_framework import DjangoFilterBackend
+from rest_framework.permissions import IsAuthenticated, AllowAny, IsAdminUser
+from rest_framework.exceptions import ValidationError
+from rest_framework.filters import OrderingFilter
 from django.contrib.auth import login, logout
+from django.db import transaction
+from django.http import Http404, HttpResponse
 from .serializers import *
 from .permissions import *
-
-
-class RouteViewSet(ModelViewSet):
-    # search & options for filtering and ordering
-    filterset_fields = ['verified', 'user__baseUser__username', 'user__baseUser__first_name', 'user__baseUser__last_name',
-                        'group__name', 'isWithin__attraction__name', 'isWithin__attraction__isTagged__tag__tagName',
-                        'notebook__id', 'user', 'group', 'ratingFlag__id']
-    search_fields = ['title', 'description', 'startingPointLat', 'startingPointLon']
+from .authorization import getAuthorizationContext
+from .pagination import RosterPagination, KeysetPagination
+from .filters import ProximityFilter, IndexedSearchFilter, RouteFilterSet
+from .queryplans import EagerLoadingMixin, applyQueryPlan
+from .middleware import endpointStats
+from .cache import membershipCache, referenceDataCache
+from .jobs import queueStats
+from .versioning import ConditionalGetMixin
+from .placements import setPlacements
+from .routeorder import optimizeOrder
+
+
+# rankings of the routes or the attractions of a viewset, read page by page straight from
+# their rating summaries, in the order of the summary indexes, instead of aggregating
+# every rating; the summaries are the ones of the 'rankedField' relation ('route' or 'attraction'),
+# restricted to the instances visible to the user making the request by the 'filterQueryset' of
+# the 'rankingVisibility' permission, if any
+class RatingRankingMixin:
+    rankedField = None
+    rankingVisibility = None
+    rankingSerializerClass = None
+
+    def getRankedSummaries(self, request):
+        summaries = RatingSummary.objects.filter(**{self.rankedField + '__isnull': False})
+
+        if self.rankingVisibility is not None:
+            summaries = self.rankingVisibility().filterQueryset(request, summaries, routeField=self.rankedField)
+
+        return summaries
+
+    # only the instances rated by at least 'min_ratings' members (1, by default) are ranked
+    def topRated(self, request, **kwargs):
+        try:
+            minRatings = max(int(request.query_params.get('min_ratings', 1)), 1)
+        except ValueError:
+            raise ValidationError({'min_ratings': 'Must be an integer.'})
+
+        queryset = self.getRankedSummaries(request).filter(ratingCount__gte=minRatings)
+        return self.listRanking(request, queryset, ['-ratingMean', '-ratingCount'])
+
+    def mostFlagged(self, request, **kwargs):
+        queryset = self.getRankedSummaries(request).filter(flagCount__gt=0)
+        return self.listRanking(request, queryset, ['-flagCount'])
+
+    def listRanking(self, request, queryset, ordering):
+        paginator = KeysetPagination()
+        paginator.ordering = ordering
+
+        page = paginator.paginate_queryset(applyQueryPlan(queryset, self.rankingSerializerClass), request, view=self)
+        serializer = self.rankingSerializerClass(page, many=True, context=self.get_serializer_context())
+        return paginator.get_paginated_response(serializer.data)
+
+
+# list and retrieve actions of the reference data (Status, Tag & RatingFlagType), served from the
+# reference data cache; the unfiltered JSON lists are rendered once for every version of the table
+# (and every URL, since the pagination links are absolute), while the filtered ones are still
+# read from the database
+class ReferenceDataMixin:
+    unfilteredParams = {'page', 'format'}
+
+    def list(self, request, *args, **kwargs):
+        if set(request.query_params) - self.unfilteredParams:
+            return super().list(request, *args, **kwargs)
+
+        if request.accepted_renderer.format != 'json':
+            return self.listCached()
+
+        model = self.get_queryset().model
+        key = (request.build_absolute_uri(), request.accepted_media_type)
+        render = lambda: request.accepted_renderer.render(self.listCached().data, request.accepted_media_type, self.get_renderer_context())
+
+        return HttpResponse(referenceDataCache.rendered(model, key, render), content_type=request.accepted_media_type)
+
+    def listCached(self):
+        instances = referenceDataCache.all(self.get_queryset().model)
+        page = self.paginate_queryset(instances)
+
+        if page is not None:
+            return self.get_paginated_response(self.get_serializer(page, many=True).data)
+
+        return Response(self.get_serializer(instances, many=True).data)
+
+    def get_object(self):
+        lookupUrlKwarg = self.lookup_url_kwarg or self.lookup_field
+        instance = referenceDataCache.get(self.get_queryset().model, self.kwargs[lookupUrlKwarg])
+
+        if instance is None:
+            raise Http404
+
+        self.check_object_permissions(self.request, instance)
+        return instance
+
+
+class RouteViewSet(ConditionalGetMixin, EagerLoadingMixin, RatingRankingMixin, ModelViewSet):
+    # pages are selected through a range condition on the ordering, rather than an OFFSET
+    pagination_class = KeysetPagination
+    # search & options for filtering and ordering (by length, through the 'route_length_idx' index)
+    filterset_class = RouteFilterSet
+    search_fields = ['title', 'description']
+    ordering_fields = ['length', 'publicationDate']
+    # routes are searched through the inverted index and can be looked up around their starting point
+    filter_backends = [DjangoFilterBackend, IndexedSearchFilter, ProximityFilter, OrderingFilter]
+    proximityFields = ('startingPointLat', 'startingPointLon', 'startingPointGeohash')
+    # only the summaries of the routes visible to the user making the request are ranked
+    rankedField = 'route'
+    rankingVisibility = RouteIsPublic
+    rankingSerializerClass = RatedRouteSerializer
 
     def get_queryset(self):
+        # only the routes visible to the user making the request are listed,
+        # filtered in the database rather than route by route
         if self.action == 'list':
-            filteredIds = [route.id for route in Route.objects.all() if RouteIsPublic().has_object_permission(self.request, self, route)]
-            queryset = Route.objects.filter(id__in=filteredIds)
-
-            return queryset
+            return RouteIsPublic().filterQueryset(self.request, Route.objects.all())
 
         return Route.objects.all()
 
     def get_serializer_class(self):
         if self.action == 'list':
             return ListRouteSerializer
+        if self.action == 'expanded':
+            return ExpandedRouteSerializer
         return RouteSerializer
 
+    # the route along with its attractions, owner and ratings (see ExpandedRouteSerializer)
+    def expanded(self, request, **kwargs):
+        return Response(self.get_serializer(self.get_object()).data)
+
+    # replaces the attractions placed within the route by the given, ordered ones, after
+    # a single authorization check, through a fixed number of statements
+    def placeAttractions(self, request, **kwargs):
+        route = self.get_object()
+        serializer = RoutePlacementSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        setPlacements(route.pk, serializer.validated_data['attractions'])
+        placements = isWithin.objects.filter(route=route).order_by('orderNumber')
+        return Response(IsWithinSerializer(placements, many=True).data)
+
+    # the shortest order found for the attractions of the route ('fixedStart' starting from the route's
+    # starting point), along with the distance it saves; previewed through GET and applied through POST
+    def optimizedOrder(self, request, **kwargs):
+        route = self.get_object()
+        serializer = RouteOrderSerializer(data=request.query_params if request.method == 'GET' else request.data)
+        serializer.is_valid(raise_exception=True)
+
+        return Response(optimizeOrder(route.pk, serializer.validated_data['fixedStart'], apply=request.method == 'POST'))
+
+    # the owners of the listed routes are serialized along with them
+    def getVersionFields(self):
+        if self.action == 'list':
+            return ['updatedAt', 'user__updatedAt', 'group__updatedAt']
+        return ['updatedAt']
+
     def get_permissions(self):
         # route can be accessed only if it is public
-        if self.action == 'retrieve':
+        if self.action == 'retrieve' or self.action == 'expanded' or self.action == 'optimizedOrder' and self.request.method == 'GET':
             return [RouteIsPublic()]
 
         # edited or deleted only if admin or admin of the group
-        if self.action == 'update' or self.action == 'partial_update' or self.action == 'destroy':
+        if self.action == 'update' or self.action == 'partial_update' or self.action == 'destroy' or self.action == 'placeAttractions' or \
+                self.action == 'optimizedOrder':
             return [RouteIsAuthorizedToMakeChanges()]
 
         # any authenticated user can create routes
         return [IsAuthenticated()]
 
 
-class IsWithinViewSet(GenericViewSet, mixins.ListModelMixin, mixins.CreateModelMixin, mixins.UpdateModelMixin, mixins.DestroyModelMixin):
+class IsWithinViewSet(EagerLoadingMixin, GenericViewSet, mixins.ListModelMixin, mixins.CreateModelMixin, mixins.UpdateModelMixin, mixins.DestroyModelMixin):
     serializer_class = IsWithinSerializer
     filterset_fields = ['route_id', 'attraction_id']
 
     def get_queryset(self):
+        # only the entries of routes visible to the user making the request are listed, by
+        # joining on the related route, in a stable order, so that the pages do not overlap
         if self.action == 'list':
-            initialQuerySet = isWithin.objects.all()
-            filteredIds = [IsWithin.id for IsWithin in initialQuerySet if RouteIsPublic().has_object_permission(self.request, self, IsWithin.route)]
-            querySet = initialQuerySet.filter(id__in=filteredIds)
-
-            return querySet
+            return RouteIsPublic().filterQueryset(self.request, isWithin.objects.all(), routeField='route').order_by('route_id', 'orderNumber', 'id')
 
         return isWithin.objects.all()
 
 
-class GroupViewSet(ModelViewSet):
+class GroupViewSet(EagerLoadingMixin, ModelViewSet):
     queryset = Group.objects.all()
     serializer_class = GroupSerializer
     filterset_fields = ['route__id', 'belongsTo__user_id']
@@ -74,15 +208,25 @@ class GroupViewSet(ModelViewSet):
     # creates a belongsTo entity, adding the user creating the group as an admin
     def perform_create(self, serializer, request):
         group = serializer.save()
-        member = Member.objects.get(pk=request.user.id)
+        member = getAuthorizationContext(request).member
 
         instance = BelongsTo(user=member, group=group, isAdmin=True)
         instance.save()
 
+    # lists the members of a group, page by page, using keyset pagination
+    def members(self, request, **kwargs):
+        group = self.get_object()
+        queryset = applyQueryPlan(BelongsTo.objects.filter(group=group), RosterSerializer)
+
+        paginator = RosterPagination()
+        page = paginator.paginate_queryset(queryset, request, view=self)
+        serializer = RosterSerializer(page, many=True, context=self.get_serializer_context())
+        return paginator.get_paginated_response(serializer.data)
+
     def get_permissions(self):
-        # if the use tries to see a group/ list of groups, check if
-        # he/she appears in the group
-        if self.action == 'list' or self.action == 'retrieve':
+        # if the use tries to see a group/ list of groups/ the members
+        # of a group, check if he/she appears in the group
+        if self.action == 'list' or self.action == 'retrieve' or self.action == 'members':
             return [IsInGroup()]
 
         if self.action == 'create':
@@ -92,7 +236,7 @@ class GroupViewSet(ModelViewSet):
         return [IsAdminOfGroup()]
 
 
-class MemberViewSet(ModelViewSet):
+class MemberViewSet(EagerLoadingMixin, ModelViewSet):
     queryset = Member.objects.all()
     search_fields = ['baseUser__username', 'baseUser__first_name', 'baseUser__last_name']
     filterset_fields = ['belongsTo__group_id', 'route__id', 'ratingFlag__id']
@@ -103,8 +247,10 @@ class MemberViewSet(ModelViewSet):
         
         if self.action == 'retrieve':
             # only a member requesting to view their own profile can 
-            # access the detailed serializer containing the email field
-            if self.get_object().baseUser == self.request.user:
+            # access the detailed serializer containing the email field;
+            # the member's primary key is the id of their base user, so
+            # the requested member itself does not have to be retrieved
+            if self.kwargs.get('pk') == self.request.user.id:
                 return MemberSerializer
             else:
                 return PrivateMemberSerializer
@@ -166,41 +312,65 @@ class LogoutView(APIView):
         return Response(None, status=status.HTTP_204_NO_CONTENT)
 
 
+# aggregated query count, database time and serialization time of every endpoint,
+# along with the membership and reference data cache counters and the number of
+# background jobs in every state, accessible only to staff members;
+# the collected metrics are discarded through the DELETE method
+class StatsView(APIView):
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        return Response({
+            'endpoints': endpointStats.summary(),
+            'membershipCache': membershipCache.stats(),
+            'referenceDataCache': referenceDataCache.stats(),
+            'jobs': queueStats(),
+        })
+
+    def delete(self, request):
+        endpointStats.reset()
+        return Response(None, status=status.HTTP_204_NO_CONTENT)
+
+
 # since only the update action will be performed, a mixin is used
 class ChangePasswordViewSet(mixins.UpdateModelMixin, GenericViewSet):
     queryset = User.objects.all()
     serializer_class = ChangePasswordSerializer
 
 
-class AttractionViewSet(GenericViewSet, mixins.ListModelMixin, mixins.RetrieveModelMixin, mixins.CreateModelMixin):
+class AttractionViewSet(ConditionalGetMixin, EagerLoadingMixin, RatingRankingMixin, GenericViewSet, mixins.ListModelMixin, mixins.RetrieveModelMixin, mixins.CreateModelMixin):
+    # pages are selected through a range condition on the ordering, rather than an OFFSET
+    pagination_class = KeysetPagination
     queryset = Attraction.objects.all()
     serializer_class = AttractionSerializer
     permission_classes = [IsAuthenticated]
     filterset_fields = ['ratingFlag__id', 'isWithin__route_id', 'isTagged__tag__tagName']
     search_fields = ['name', 'generalDescription']
+    filter_backends = [DjangoFilterBackend, IndexedSearchFilter, ProximityFilter]
+    proximityFields = ('latitude', 'longitude', 'geohash')
     ordering_fields = ['isWithin__orderNumber']
-    
+    rankedField = 'attraction'
+    rankingSerializerClass = RatedAttractionSerializer
+
 
-class BelongsToViewSet(GenericViewSet, mixins.ListModelMixin, mixins.CreateModelMixin, mixins.UpdateModelMixin, mixins.DestroyModelMixin):
+class BelongsToViewSet(EagerLoadingMixin, GenericViewSet, mixins.ListModelMixin, mixins.CreateModelMixin, mixins.UpdateModelMixin, mixins.DestroyModelMixin):
     serializer_class = BelongsToSerializer
     filterset_fields = ['user_id', 'group_id']
     permission_classes = [BelongsToAuthorization]
 
     def get_queryset(self):
+        # the entries of every group the user making the request belongs to,
+        # selected through a single subquery on their own memberships
         if self.action == 'list':
-            memberMakingTheRequest = Member.objects.get(pk=self.request.user.id)
-            groupsOfMemberMakingTheRequest = Group.objects.filter(belongsTo__user=memberMakingTheRequest)
-            queryset = BelongsTo.objects.filter(group=groupsOfMemberMakingTheRequest[0])
-
-            for group in groupsOfMemberMakingTheRequest:
-                queryset |= BelongsTo.objects.filter(group=group)
-
-            return queryset
+            groupsOfMemberMakingTheRequest = BelongsTo.objects.filter(user_id=self.request.user.id).values('group_id')
+            return BelongsTo.objects.filter(group_id__in=groupsOfMemberMakingTheRequest).order_by('group_id', 'id')
 
         return BelongsTo.objects.all()
 
 
-class NotebookViewSet(ModelViewSet):
+class NotebookViewSet(ConditionalGetMixin, EagerLoadingMixin, ModelViewSet):
+    # pages are selected through a range condition on the ordering, rather than an OFFSET
+    pagination_class = KeysetPagination
     queryset = Notebook.objects.all()
     filterset_fields = ["user_id"]
     permission_classes = [IsOwnedByTheUserMakingTheRequest]
@@ -211,6 +381,12 @@ class NotebookViewSet(ModelViewSet):
         
         return NotebookSerializer
 
+    # the routes of the listed notebooks are serialized along with them
+    def getVersionFields(self):
+        if self.action == 'list':
+            return ['updatedAt', 'route__updatedAt']
+        return ['updatedAt']
+
     def get_permissions(self):
         # let anyone create a notebook
         if self.action == 'create':
@@ -219,14 +395,14 @@ class NotebookViewSet(ModelViewSet):
         return [IsOwnedByTheUserMakingTheRequest()]
 
 
-class StatusViewSet(GenericViewSet, mixins.ListModelMixin, mixins.RetrieveModelMixin):
+class StatusViewSet(ReferenceDataMixin, EagerLoadingMixin, GenericViewSet, mixins.ListModelMixin, mixins.RetrieveModelMixin):
     queryset = Status.objects.all()
     serializer_class = StatusSerializer
     permission_classes = [IsAuthenticated]
     filterset_fields = ['notebook__id']
 
 
-class RatingFlagViewSet(GenericViewSet, mixins.ListModelMixin, mixins.CreateModelMixin,
+class RatingFlagViewSet(EagerLoadingMixin, GenericViewSet, mixins.ListModelMixin, mixins.CreateModelMixin,
                                      mixins.UpdateModelMixin, mixins.DestroyModelMixin):
     serializer_class = RatingFlagSerializer
     filterset_fields = ['route_id', 'attraction_id']
@@ -241,29 +417,43 @@ class RatingFlagViewSet(GenericViewSet, mixins.ListModelMixin, mixins.CreateMode
         # that the query set can be limitted to ratings
         return RatingFlag.objects.filter(rating_id__lte=5)
 
+    # the rating and the summary of the rated route or attraction, which is
+    # updated by the RatingFlag receivers, are written within the same transaction
+    @transaction.atomic
+    def perform_create(self, serializer):
+        serializer.save()
+
+    @transaction.atomic
+    def perform_update(self, serializer):
+        serializer.save()
+
+    @transaction.atomic
+    def perform_destroy(self, instance):
+        instance.delete()
+
 
-class RatingFlagTypeViewSet(GenericViewSet, mixins.ListModelMixin, mixins.RetrieveModelMixin):
+class RatingFlagTypeViewSet(ReferenceDataMixin, EagerLoadingMixin, GenericViewSet, mixins.ListModelMixin, mixins.RetrieveModelMixin):
     queryset = RatingFlagType.objects.all()
     serializer_class = RatingFlagTypeSerializer
     permission_classes = [IsAuthenticated]
     filterset_fields = ['ratingFlag__id']
 
 
-class TagViewSet(GenericViewSet, mixins.ListModelMixin):
+class TagViewSet(ReferenceDataMixin, EagerLoadingMixin, GenericViewSet, mixins.ListModelMixin):
     queryset = Tag.objects.all()
     serializer_class = TagSerializer
     permission_classes = [IsAuthenticated]
     filterset_fields = ['isTagged__attraction_id']
 
 
-class IsTaggedViewSet(GenericViewSet, mixins.ListModelMixin, mixins.CreateModelMixin, mixins.DestroyModelMixin):
+class IsTaggedViewSet(EagerLoadingMixin, GenericViewSet, mixins.ListModelMixin, mixins.CreateModelMixin, mixins.DestroyModelMixin):
     queryset = IsTagged.objects.all()
     serializer_class = IsTaggedSerializer
     permission_classes = [IsAuthenticated]
     filterset_fields = ['attraction_id', 'tag_id']
 
 
-class ImageViewSet(ModelViewSet):
+class ImageViewSet(EagerLoadingMixin, ModelViewSet):
     queryset = Image.objects.all()
     serializer_class = ImageUploadSerializer
 
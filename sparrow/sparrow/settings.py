@@ -33,6 +33,7 @@ INSTALLED_APPS = [
 ]
 MIDDLEWARE = [
     'corsheaders.middleware.CorsMiddleware',
+    'core.middleware.QueryInstrumentationMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -153,4 +154,48 @@ MEDIA_URL = '/media/'
 
 # the absolute filesystem path to the directory that holds
 # user-uploaded media files
-MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
\ No newline at end of file
+MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+
+# the front-end server the transfer of the media files is handed off to:
+# 'x-accel-redirect' (nginx), with an internal location at MEDIA_ACCEL_REDIRECT_PREFIX
+# aliasing MEDIA_ROOT, or 'x-sendfile' (Apache's mod_xsendfile, lighttpd); when None,
+# the files are streamed by the application itself
+MEDIA_SENDFILE = None
+MEDIA_ACCEL_REDIRECT_PREFIX = '/protected-media/'
+
+# cross-request cache of the group memberships of each member;
+# when an alias from CACHES is specified, said shared backend
+# is used instead of the bounded, per-process LRU
+MEMBERSHIP_CACHE_SIZE = 10000
+MEMBERSHIP_CACHE_TIMEOUT = 300
+MEMBERSHIP_CACHE_ALIAS = None
+
+# per-process cache of the reference data (Status, Tag & RatingFlagType);
+# when an alias from CACHES is specified, the version of every table is
+# kept in said shared backend, so that every process sees the changes
+# at once, rather than after REFERENCE_DATA_CACHE_TIMEOUT seconds
+REFERENCE_DATA_CACHE_TIMEOUT = 300
+REFERENCE_DATA_CACHE_ALIAS = None
+
+
+# per-endpoint query count, database time and serialization time
+# recording, which wraps every query, and is therefore only enabled
+# while debugging (and by the 'benchmark' command); the metrics of each
+# request are only returned in the response headers when
+# QUERY_INSTRUMENTATION_HEADERS is enabled
+QUERY_INSTRUMENTATION = DEBUG
+QUERY_INSTRUMENTATION_HEADERS = False
+
+
+# background job queue, processed by the 'runjobs' command; failed jobs
+# are retried after JOB_RETRY_DELAY seconds, doubled after every attempt,
+# up to JOB_MAX_ATTEMPTS attempts, after which they are dead-lettered;
+# jobs left running for JOB_LOCK_TIMEOUT seconds are queued again
+JOB_MAX_ATTEMPTS = 5
+JOB_RETRY_DELAY = 30
+JOB_LOCK_TIMEOUT = 600
+
+
+# the route order optimizer (see core.routeorder) stops improving the order
+# after ROUTE_OPTIMIZER_TIME_BUDGET seconds, returning the best one found
+ROUTE_OPTIMIZER_TIME_BUDGET = 1.0